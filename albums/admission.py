@@ -0,0 +1,314 @@
+# admission control for rendering reports: at most MAX_PENDING reports are rendered (or waiting
+# for a worker process) at once, further requests wait in a short queue for a free render slot.
+# A request which does not get a slot within QUEUE_TIMEOUT (or finds the queue full) is
+# rejected with 503, so a burst of report requests cannot slow down all other requests.
+import asyncio
+import collections
+import contextlib
+import datetime
+import os
+import threading
+import time
+import uuid
+from timeit import default_timer as timer
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import Q
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from . import metrics
+from .models import RenderSlot
+
+DEFAULT_RENDER_POOL = {
+    # number of worker processes, defaults to the number of cpus
+    'POOL_SIZE': None,
+    # max. number of reports rendered or waiting for a worker process at once (render slots),
+    # defaults to twice the number of worker processes
+    'MAX_PENDING': None,
+    # max. number of requests waiting for a free render slot, further requests are rejected
+    'MAX_QUEUE': 20,
+    # max. number of seconds a request waits for a free render slot before it is rejected
+    'QUEUE_TIMEOUT': 10,
+    # Retry-After header (seconds) of a rejected request
+    'RETRY_AFTER': 5,
+    # number of render slots shared by all processes using the same db, None: slots are per process
+    'SHARED_SLOTS': None,
+}
+
+# interval in seconds to check for a free shared render slot
+SHARED_POLL_INTERVAL = 0.05
+# a shared render slot held longer than this (in seconds) is considered free,
+# e.g. because the process holding it was terminated
+SHARED_SLOT_TIMEOUT = 600
+
+_slots = None
+_slots_lock = threading.Lock()
+
+# counters exposed at /metrics: admitted and rejected requests
+stats = dict(admitted=0, rejected=0)
+
+
+class RenderBusyError(Exception):
+    pass
+
+
+class _Waiter:
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+
+
+class RenderSlots:
+    """Limits the number of reports rendered at once in this process.
+
+    Can be used by threads (*acquire*) and coroutines (*aacquire*) at the same time, waiting
+    requests get a free slot in the order they arrived. Coroutines wait without blocking a thread.
+    """
+    def __init__(self, size, max_queue):
+        self.size = size
+        self.max_queue = max_queue
+        self.used = 0
+        self.waiters = collections.deque()
+        self.lock = threading.Lock()
+
+    def _try_acquire(self, waiter):
+        # must be called with the lock held, returns False if the waiter was added to the queue
+        if self.used < self.size and not self.waiters:
+            self.used += 1
+            return True
+        if len(self.waiters) >= self.max_queue:
+            raise RenderBusyError()
+        self.waiters.append(waiter)
+        return False
+
+    def _cancel(self, waiter):
+        # returns True if the slot was granted in the meantime, the caller owns the slot in this case
+        with self.lock:
+            if waiter.granted:
+                return True
+            self.waiters.remove(waiter)
+            return False
+
+    def try_acquire(self):
+        """Takes a free slot without waiting, returns False if no slot is free or other requests are waiting."""
+        with self.lock:
+            if self.used < self.size and not self.waiters:
+                self.used += 1
+                return True
+            return False
+
+    def acquire(self, timeout):
+        """Waits max. *timeout* seconds for a free slot, raises RenderBusyError if no slot is available."""
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        with self.lock:
+            if self._try_acquire(waiter):
+                return
+        if not event.wait(timeout) and not self._cancel(waiter):
+            raise RenderBusyError()
+
+    async def aacquire(self, timeout):
+        """Same as *acquire* for coroutines."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(_set_result, future))
+        with self.lock:
+            if self._try_acquire(waiter):
+                return
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if not self._cancel(waiter):
+                raise RenderBusyError()
+        except asyncio.CancelledError:
+            # request was cancelled (e.g. client disconnected)
+            if self._cancel(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                # the slot is passed directly to the first waiting request
+                waiter = self.waiters.popleft()
+                waiter.granted = True
+                waiter.notify()
+            else:
+                self.used -= 1
+
+    def get_queue_depth(self):
+        return len(self.waiters)
+
+
+def _set_result(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def get_config():
+    """Returns the render pool settings (ALBUMS_RENDER_POOL) merged with the defaults.
+
+    MAX_PENDING defaults to twice the number of worker processes.
+    """
+    config = dict(DEFAULT_RENDER_POOL)
+    config.update(getattr(settings, 'ALBUMS_RENDER_POOL', {}))
+    if config['MAX_PENDING'] is None:
+        config['MAX_PENDING'] = 2 * (config['POOL_SIZE'] or os.cpu_count() or 1)
+    return config
+
+
+def get_slots():
+    global _slots
+    if _slots is None:
+        with _slots_lock:
+            if _slots is None:
+                config = get_config()
+                _slots = RenderSlots(config['MAX_PENDING'], config['MAX_QUEUE'])
+    return _slots
+
+
+@receiver(setting_changed)
+def reset_slots(setting, **kwargs):
+    """Creates the render slots again when the settings are changed (e.g. by override_settings)."""
+    global _slots
+    if setting == 'ALBUMS_RENDER_POOL':
+        _slots = None
+
+
+def acquire_shared_slot(size, deadline):
+    """Takes one of *size* render slots shared by all processes using the same db (render_slot table).
+
+    Polls until a slot is free, returns the holder token needed to release the slot.
+    Raises RenderBusyError if no slot is free before *deadline* (timer value).
+    """
+    token = str(uuid.uuid4())
+    create_shared_slots(size)
+    while True:
+        if try_acquire_shared_slot(size, token):
+            return token
+        if timer() + SHARED_POLL_INTERVAL > deadline:
+            raise RenderBusyError()
+        time.sleep(SHARED_POLL_INTERVAL)
+
+
+async def aacquire_shared_slot(size, deadline):
+    """Same as *acquire_shared_slot* for async views.
+
+    Only the attempts to take a slot are executed in the sync thread, the poll interval is awaited
+    in the event loop so other requests can use the sync thread (e.g. for db queries) meanwhile.
+    """
+    token = str(uuid.uuid4())
+    await sync_to_async(create_shared_slots)(size)
+    while True:
+        if await sync_to_async(try_acquire_shared_slot)(size, token):
+            return token
+        if timer() + SHARED_POLL_INTERVAL > deadline:
+            raise RenderBusyError()
+        await asyncio.sleep(SHARED_POLL_INTERVAL)
+
+
+def create_shared_slots(size):
+    RenderSlot.objects.bulk_create([RenderSlot(slot=i) for i in range(size)], ignore_conflicts=True)
+
+
+def try_acquire_shared_slot(size, token):
+    now = datetime.datetime.now()
+    free = Q(holder=None) | Q(acquired_at__lt=now - datetime.timedelta(seconds=SHARED_SLOT_TIMEOUT))
+    # a single update statement so the slot cannot be taken by another process at the same time
+    free_slot = RenderSlot.objects.filter(free, slot__lt=size).values('id')[:1]
+    return RenderSlot.objects.filter(free, id__in=free_slot).update(holder=token, acquired_at=now) == 1
+
+
+def release_shared_slot(token):
+    RenderSlot.objects.filter(holder=token).update(holder=None, acquired_at=None)
+
+
+def _admitted(start):
+    stats['admitted'] += 1
+    metrics.record('render_wait', timer() - start)
+
+
+def _rejected(start):
+    stats['rejected'] += 1
+    metrics.record('render_wait', timer() - start)
+
+
+@contextlib.contextmanager
+def render_slot(wait=True):
+    """Waits for a free render slot, the slot is released at the end of the block.
+
+    Raises RenderBusyError if no slot is available within QUEUE_TIMEOUT seconds. With *wait*
+    set to False (background work, e.g. prerendering xlsx previews) the request does not
+    wait in the queue, RenderBusyError is raised right away if no slot is free and
+    the request is not counted as rejected.
+    """
+    config = get_config()
+    slots = get_slots()
+    start = timer()
+    if not wait:
+        if not slots.try_acquire():
+            raise RenderBusyError()
+    else:
+        try:
+            slots.acquire(config['QUEUE_TIMEOUT'])
+        except RenderBusyError:
+            _rejected(start)
+            raise
+    try:
+        token = None
+        if config['SHARED_SLOTS']:
+            if not wait:
+                token = acquire_shared_slot(config['SHARED_SLOTS'], start)
+            else:
+                try:
+                    token = acquire_shared_slot(config['SHARED_SLOTS'], start + config['QUEUE_TIMEOUT'])
+                except RenderBusyError:
+                    _rejected(start)
+                    raise
+        _admitted(start)
+        try:
+            yield
+        finally:
+            if token is not None:
+                release_shared_slot(token)
+    finally:
+        slots.release()
+
+
+@contextlib.asynccontextmanager
+async def arender_slot():
+    """Same as *render_slot* for async views."""
+    config = get_config()
+    slots = get_slots()
+    start = timer()
+    try:
+        await slots.aacquire(config['QUEUE_TIMEOUT'])
+    except RenderBusyError:
+        _rejected(start)
+        raise
+    try:
+        token = None
+        if config['SHARED_SLOTS']:
+            try:
+                token = await aacquire_shared_slot(config['SHARED_SLOTS'], start + config['QUEUE_TIMEOUT'])
+            except RenderBusyError:
+                _rejected(start)
+                raise
+        _admitted(start)
+        try:
+            yield
+        finally:
+            if token is not None:
+                await sync_to_async(release_shared_slot)(token)
+    finally:
+        slots.release()
+
+
+def create_busy_response():
+    """Returns the response for a request rejected because all render slots are busy."""
+    response = HttpResponse('too many reports are rendered at the moment, try again later', status=503)
+    response['Retry-After'] = str(get_config()['RETRY_AFTER'])
+    return response
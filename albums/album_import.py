@@ -0,0 +1,103 @@
+import csv
+import itertools
+import json
+
+from django.db import transaction
+
+from . import row_cache
+from .models import Album
+from .utils import validate_album
+
+DEFAULT_BATCH_SIZE = 1000
+
+FORMATS = ('jsonl', 'csv')
+
+
+def read_json_lines(lines):
+    """Yields line number and album values for each line containing a json object.
+
+    Values are None in case the line does not contain a valid json object.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            album = json.loads(line)
+        except ValueError:
+            album = None
+        yield line_number, album if isinstance(album, dict) else None
+
+
+def read_csv(lines):
+    """Yields line number and album values for each csv row, the first row must contain the column names.
+
+    Supported columns are id, name, artist, year and best_of_compilation.
+    """
+    lines = (line.decode('utf-8') if isinstance(line, bytes) else line for line in lines)
+    reader = csv.DictReader(lines)
+    for album in reader:
+        best_of_compilation = (album.get('best_of_compilation') or '').strip().lower()
+        album['best_of_compilation'] = best_of_compilation in ('1', 'true', 'yes', 'x')
+        yield reader.line_num, album
+
+
+def import_albums(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Adds or updates (if an id is set) albums, rows are given as tuples of line number and album values.
+
+    Rows are validated and written in batches with the same rules used when a single album is
+    saved. Invalid rows are skipped and returned with their errors, all valid rows are written in
+    a single transaction. Returns a dict with the number of created and updated albums and the errors.
+    """
+    rv = dict(created=0, updated=0, errors=[])
+    rows = iter(rows)
+    with transaction.atomic():
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            _import_batch(batch, rv)
+    if rv['updated']:
+        row_cache.clear()
+    return rv
+
+
+def _import_batch(batch, rv):
+    new_albums = []
+    updated_values = dict()  # album id -> (line number, values)
+    for line_number, album in batch:
+        if album is None:
+            rv['errors'].append(dict(line=line_number, field=None, msg='invalid row'))
+            continue
+        album_id = None
+        if album.get('id'):
+            try:
+                album_id = int(album.get('id'))
+            except (ValueError, TypeError):
+                rv['errors'].append(dict(line=line_number, field='id', msg='invalid album id'))
+                continue
+        values, errors = validate_album(album)
+        if errors:
+            rv['errors'].extend(dict(line=line_number, **error) for error in errors)
+        elif album_id:
+            updated_values[album_id] = (line_number, values)
+        else:
+            new_albums.append(Album(**values))
+
+    if new_albums:
+        Album.objects.bulk_create(new_albums)
+        rv['created'] += len(new_albums)
+
+    if updated_values:
+        albums = Album.objects.in_bulk(list(updated_values.keys()))
+        for album_id, (line_number, values) in updated_values.items():
+            album = albums.get(album_id)
+            if album is None:
+                rv['errors'].append(dict(line=line_number, field='id', msg='album not found'))
+                continue
+            for field, value in values.items():
+                setattr(album, field, value)
+        if albums:
+            Album.objects.bulk_update(albums.values(), ['name', 'artist', 'year', 'best_of_compilation'])
+            rv['updated'] += len(albums)
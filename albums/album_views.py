@@ -1,22 +1,166 @@
+import base64
+import binascii
+import csv
 import datetime
 import json
 
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
 from django.forms.models import model_to_dict
-from django.http import HttpResponseBadRequest, HttpResponseServerError, HttpResponse, JsonResponse
+from django.conf import settings
+from django.http import FileResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseServerError,\
+    HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.safestring import SafeString
-from django.utils.translation import gettext as _
-from django.views.decorators.csrf import ensure_csrf_cookie
-from reportbro import Report, ReportBroError
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 
-from .models import Album, ReportDefinition
-from .utils import create_album_report_template, get_menu_items
+from . import admission, album_import, eviction, export, metrics, partitioning, pdf_cache, render_pool, rendering,\
+    row_cache, search, template_cache, versions
+from .decorators import async_cache_control, async_condition, async_ensure_csrf_cookie
+from .models import Album, AlbumTombstone, ReportDefinition
+from .profiling import profile_async_view
+from .utils import ALBUM_FIELDS, create_album_report_template, get_menu_items, has_valid_token, validate_album
 
+MAX_PAGE_SIZE = 500  # max. number of albums returned in one page
+MAX_CHANGES_SIZE = 5000  # max. number of changed albums returned at once (delta sync)
+INDEX_PAGE_SIZE = 100  # number of albums initially shown on the index page
+INDEX_SYNC_INTERVAL = 30000  # interval in ms to sync changed albums on the index page
+STREAM_CHUNK_SIZE = 500  # number of albums fetched from the db and sent at once when streaming
 
-def data(request):
+
+def get_data_etag(request):
+    """Returns the ETag of album/data/, it changes whenever an album is added, modified or deleted.
+
+    The change counter is incremented by db triggers, so changes by other processes or directly in the db
+    are detected as well.
+    """
+    return 'albums-%d' % versions.get_version(versions.ALBUM_CHANGES)
+
+
+def get_report_etag(request):
+    """Returns the ETag of album/report/.
+
+    It changes whenever an album is added, modified or deleted, when the report definition is modified
+    and on every day because the current date is printed in the report (same as the key of the pdf cache).
+    """
+    last_modified_at = ReportDefinition.objects.filter(report_type='albums_report').\
+        values_list('last_modified_at', flat=True).first()
+    if last_modified_at is None:
+        return None
+    return 'albums-report-%d-%s-%s' % (
+        versions.get_version(versions.ALBUM_CHANGES), last_modified_at.isoformat(), datetime.date.today())
+
+
+# the client must revalidate the response (conditional request with the ETag) every time,
+# 304 is returned before the albums are queried if nothing was modified
+@profile_async_view
+@async_cache_control(private=True, no_cache=True)
+@async_condition(get_data_etag)
+async def data(request):
     """Returns available albums from the database. Can be optionally filtered by year.
 
     This is called from templates/albums/album/index.html when the year input is changed.
+    If the *limit* parameter is set, only one page of albums is returned together
+    with a cursor (*next*) which is passed as *after* parameter to get the next page.
+    With the *stream* parameter all albums are streamed without loading them into memory at once.
+    With the *since* parameter (change token) only albums changed after the token are returned,
+    see *get_album_changes*. 410 is returned if the token is older than the kept tombstones.
+    """
+    year = request.GET.get('year')
+    if year:
+        try:
+            year = int(year)
+        except (ValueError, TypeError):
+            return HttpResponseBadRequest('invalid year parameter')
+    else:
+        year = None
+
+    if request.GET.get('since'):
+        try:
+            since = int(request.GET.get('since'))
+            limit = min(int(request.GET.get('limit') or MAX_CHANGES_SIZE), MAX_CHANGES_SIZE)
+        except (ValueError, TypeError):
+            return HttpResponseBadRequest('invalid since or limit parameter')
+        if since < 0 or limit < 1:
+            return HttpResponseBadRequest('invalid since or limit parameter')
+        if 0 < since < await versions.aget_version(versions.ALBUM_TOMBSTONES_PRUNED):
+            # deleted albums cannot be synced anymore, the client must load all albums again
+            # and use the returned token for the next sync
+            token = await versions.aget_version(versions.ALBUM_CHANGES)
+            return JsonResponse(dict(token=str(token)), status=410)
+        changes = await get_album_changes(since, year, limit)
+        return HttpResponse(row_cache.encode_object(**changes), content_type='application/json')
+
+    if request.GET.get('limit') or request.GET.get('after'):
+        try:
+            limit = min(int(request.GET.get('limit') or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+        except (ValueError, TypeError):
+            return HttpResponseBadRequest('invalid limit parameter')
+        if limit < 1:
+            return HttpResponseBadRequest('invalid limit parameter')
+        after = None
+        if request.GET.get('after'):
+            try:
+                after = decode_cursor(request.GET.get('after'))
+            except ValueError:
+                return HttpResponseBadRequest('invalid after parameter')
+        page = await get_album_page(year, limit, after)
+        return HttpResponse(
+            row_cache.encode_object(page['albums'], next=page['next']), content_type='application/json')
+
+    if request.GET.get('stream'):
+        # a sync iterator would be read into memory completely when served by asgi (and an async
+        # iterator when served by wsgi), so the albums are only streamed with the matching iterator
+        if isinstance(request, ASGIRequest):
+            return StreamingHttpResponse(astream_albums(year), content_type='application/json')
+        return StreamingHttpResponse(stream_albums(year), content_type='application/json')
+    rows = [row async for row in get_albums(year).values_list(*row_cache.FIELDS)]
+    return HttpResponse(row_cache.encode_list(rows), content_type='application/json')
+
+
+# search results are only modified when an album is added or modified, same as album/data/
+@profile_async_view
+@async_cache_control(private=True, no_cache=True)
+@async_condition(get_data_etag)
+async def search_albums(request):
+    """Returns albums where name or artist match the search text (*q*), best matches first.
+
+    This is called from templates/albums/album/index.html when the search text is changed.
+    The last word of the search text is used as prefix. Albums can be optionally filtered by year.
+    One page of *limit* albums is returned together with the offset of the next page (*next*)
+    which is passed as *offset* parameter to get the next page.
+    """
+    year = request.GET.get('year')
+    if year:
+        try:
+            year = int(year)
+        except (ValueError, TypeError):
+            return HttpResponseBadRequest('invalid year parameter')
+    else:
+        year = None
+    try:
+        limit = min(int(request.GET.get('limit') or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+        offset = int(request.GET.get('offset') or 0)
+    except (ValueError, TypeError):
+        return HttpResponseBadRequest('invalid limit or offset parameter')
+    if limit < 1 or offset < 0:
+        return HttpResponseBadRequest('invalid limit or offset parameter')
+
+    rows = await sync_to_async(search.search_albums)(request.GET.get('q') or '', year, limit + 1, offset)
+    next_offset = offset + limit if len(rows) > limit else None
+    return JsonResponse(dict(albums=rows[:limit], next=next_offset))
+
+
+# the export is only modified when an album is added or modified, same as album/data/
+@profile_async_view
+@async_cache_control(private=True, no_cache=True)
+@async_condition(get_data_etag)
+async def export_albums(request):
+    """Returns all albums as csv (default) or xlsx file (*format* parameter). Can be optionally filtered by year.
+
+    The csv file is streamed while the albums are fetched from the db. The xlsx file is
+    written to a temporary file first, see export.create_xlsx.
     """
     year = request.GET.get('year')
     if year:
@@ -26,7 +170,25 @@ def data(request):
             return HttpResponseBadRequest('invalid year parameter')
     else:
         year = None
-    return JsonResponse(list(get_albums(year)), safe=False)
+    export_format = request.GET.get('format') or 'csv'
+    if export_format not in export.EXPORT_FORMATS:
+        return HttpResponseBadRequest('invalid format parameter')
+    content_type, extension = export.EXPORT_FORMATS[export_format]
+    filename = 'albums.' + extension
+
+    # same as album/data/ the files are only streamed with the iterator matching the server
+    if export_format == 'xlsx':
+        output = await sync_to_async(export.create_xlsx)(get_albums(year))
+        if isinstance(request, ASGIRequest):
+            response = StreamingHttpResponse(export.astream_file(output), content_type=content_type)
+        else:
+            response = FileResponse(output, content_type=content_type)
+    elif isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(export.astream_csv(get_albums(year)), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(export.stream_csv(get_albums(year)), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{filename}"'.format(filename=filename)
+    return response
 
 
 @ensure_csrf_cookie
@@ -42,16 +204,30 @@ def edit(request, album_id=None):
     return render(request, 'albums/album/edit.html', context)
 
 
-@ensure_csrf_cookie
-def index(request):
+@profile_async_view
+@async_ensure_csrf_cookie
+async def index(request):
     """Shows a page where all available albums are listed."""
+    # old tombstones of deleted albums are pruned periodically in a background thread
+    eviction.start_background_eviction()
     context = dict()
     context['menu_items'] = get_menu_items('album')
-    context['albums'] = SafeString(json.dumps(list(get_albums())))
+    # changes made after the token was read are synced by the page (album/data/?since=token),
+    # so the token must be read before the albums
+    context['token'] = SafeString(json.dumps(str(await versions.aget_version(versions.ALBUM_CHANGES))))
+    # only the first page is included, further albums are loaded on demand
+    page = await get_album_page(limit=INDEX_PAGE_SIZE)
+    context['albums'] = SafeString(row_cache.encode_list(page['albums']).decode('utf-8'))
+    context['next'] = SafeString(json.dumps(page['next']))
+    context['page_size'] = INDEX_PAGE_SIZE
+    context['sync_interval'] = INDEX_SYNC_INTERVAL
     return render(request, 'albums/album/index.html', context)
 
 
-def report(request):
+@profile_async_view
+@async_cache_control(private=True, no_cache=True)
+@async_condition(get_report_etag)
+async def report(request):
     """Prints a pdf file with all available albums.
 
     The albums can be optionally filtered by year. reportbro-lib is used to
@@ -59,6 +235,8 @@ def report(request):
     from the database (*get_albums*). The report_definition
     is also stored in the database and is created on-the-fly if not present (to make
     this Demo App easier to use).
+    The pdf file is rendered in a worker process of the render pool, the request
+    does not block a thread while it waits for the rendered file.
     """
     year = request.GET.get('year')
     if year:
@@ -69,31 +247,57 @@ def report(request):
     else:
         year = None
 
+    # the parsed and validated report definition is cached per process,
+    # it is only loaded again from the db after it was modified
+    template = await sync_to_async(get_report_template)()
+    if template is None:
+        return HttpResponseServerError('no report_definition available')
+
+    # rendered pdf files are cached, the key contains the versions of the albums and
+    # the report definition so a cached file is never outdated. The current date is
+    # also part of the key because it is printed in the report.
+    cache = pdf_cache.get_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = pdf_cache.get_key(
+            'albums_report', year or '', await versions.aget_version(versions.ALBUM_CHANGES),
+            template.last_modified_at.isoformat(), datetime.date.today())
+        # the file cache reads from disk, this is done in a thread to not block the event loop
+        pdf_report = await sync_to_async(cache.get, thread_sensitive=False)(cache_key)
+        if pdf_report is not None:
+            return create_pdf_response(pdf_report)
+
     # NOTE: these params must match exactly with the parameters defined in the
     # report definition in ReportBro Designer, check the name and type (Number, Date, List, ...)
     # of those parameters in the Designer.
-    params = dict(year=year, albums=list(get_albums(year)), current_date=datetime.datetime.now())
-
-    if ReportDefinition.objects.filter(report_type='albums_report').count() == 0:
-        create_album_report_template()
-
-    report_definition = ReportDefinition.objects.get(report_type='albums_report')
-    if not report_definition:
-        return HttpResponseServerError('no report_definition available')
+    params = dict(
+        year=year, albums=[album async for album in get_albums(year)], current_date=datetime.datetime.now())
 
+    if template.errors:
+        # report definition should never contain any errors,
+        # unless you saved an invalid report and didn't test in ReportBro Designer
+        return HttpResponseServerError('report error: ' + str(template.errors[0]))
     try:
-        report_inst = Report(json.loads(report_definition.report_definition), params)
-        if report_inst.errors:
-            # report definition should never contain any errors,
-            # unless you saved an invalid report and didn't test in ReportBro Designer
-            raise ReportBroError(report_inst.errors[0])
-
-        pdf_report = report_inst.generate_pdf()
-        response = HttpResponse(bytes(pdf_report), content_type='application/pdf')
-        response['Content-Disposition'] = 'inline; filename="{filename}"'.format(filename='albums.pdf')
-        return response
-    except ReportBroError as ex:
-        return HttpResponseServerError('report error: ' + str(ex.error))
+        with metrics.timed('render'):
+            if partitioning.is_enabled(len(params['albums'])):
+                # a big report is split into chunks of albums which are rendered in parallel
+                # by worker processes, the pdf files of all chunks are merged afterwards.
+                # The whole report takes a single render slot
+                async with admission.arender_slot():
+                    rv = await sync_to_async(partitioning.render_pdf, thread_sensitive=False)(
+                        template.report_definition, params, 'albums')
+            else:
+                rv = await render_pool.arender(
+                    rendering.render_report, template.report_definition, params, False, 'pdf')
+        if 'errors' in rv:
+            # the data does not match the parameters defined in the report definition
+            return HttpResponseServerError('report error: ' + str(rv['errors'][0]))
+        pdf_report = rv['file']
+        if cache is not None:
+            await sync_to_async(cache.set, thread_sensitive=False)(cache_key, pdf_report)
+        return create_pdf_response(pdf_report)
+    except admission.RenderBusyError:
+        return admission.create_busy_response()
     except Exception as ex:
         return HttpResponseServerError('report exception: ' + str(ex))
 
@@ -113,40 +317,170 @@ def save(request):
         except (ValueError, TypeError):
             return HttpResponseBadRequest('invalid album id')
 
-    values = dict(best_of_compilation=album.get('best_of_compilation'))
-    rv = dict(errors=[])
-
-    # perform some basic form validation
-    if not album.get('name'):
-        rv['errors'].append(dict(field='name', msg=str(_('error.the field must not be empty'))))
-    else:
-        values['name'] = album.get('name')
-    if not album.get('artist'):
-        rv['errors'].append(dict(field='artist', msg=str(_('error.the field must not be empty'))))
-    else:
-        values['artist'] = album.get('artist')
-    if album.get('year'):
-        try:
-            values['year'] = int(album.get('year'))
-            if values['year'] < 1900 or values['year'] > 2100:
-                rv['errors'].append(dict(field='year', msg=str(_('error.the field must contain a valid year'))))
-        except (ValueError, TypeError):
-            rv['errors'].append(dict(field='year', msg=str(_('error.the field must contain a number'))))
-    else:
-        values['year'] = None
+    values, errors = validate_album(album)
+    rv = dict(errors=errors)
 
     if not rv['errors']:
         # no validation errors -> save album
         if album_id:
             Album.objects.filter(id=album_id).update(**values)
+            row_cache.invalidate([album_id])
         else:
             Album.objects.create(**values)
     return JsonResponse(rv)
 
 
-def get_albums(year=None):
-    """Returns available albums from the database. Can be optionally filtered by year."""
-    albums = Album.objects.all().order_by('name')
+@csrf_exempt
+def bulk_import(request):
+    """Adds or updates multiple albums at once.
+
+    The request body contains one album per line, either as json object (format *jsonl*, default)
+    or as csv with a header row (format *csv*). The body is read line by line and the albums are
+    validated and saved in batches of *batch_size* rows. Invalid rows are skipped and returned
+    with their line number in the errors list.
+
+    The request is sent by api clients and not by the browser, it must contain the header
+    *Authorization: Bearer <ALBUMS_IMPORT_TOKEN>* (the import is disabled if no token is set).
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest('invalid request method')
+    if not has_valid_token(request, getattr(settings, 'ALBUMS_IMPORT_TOKEN', None)):
+        return HttpResponseForbidden('invalid or missing import token')
+    import_format = request.GET.get('format') or ('csv' if request.content_type == 'text/csv' else 'jsonl')
+    if import_format not in album_import.FORMATS:
+        return HttpResponseBadRequest('invalid format parameter')
+    try:
+        batch_size = int(request.GET.get('batch_size') or album_import.DEFAULT_BATCH_SIZE)
+    except (ValueError, TypeError):
+        return HttpResponseBadRequest('invalid batch_size parameter')
+    if batch_size < 1:
+        return HttpResponseBadRequest('invalid batch_size parameter')
+
+    if import_format == 'csv':
+        rows = album_import.read_csv(request)
+    else:
+        rows = album_import.read_json_lines(request)
+    try:
+        rv = album_import.import_albums(rows, batch_size=batch_size)
+    except (UnicodeDecodeError, csv.Error) as ex:
+        return HttpResponseBadRequest('invalid file: ' + str(ex))
+    return JsonResponse(rv)
+
+
+def get_report_template():
+    """Returns the album report template from the template cache, the template is created if it does not exist."""
+    template = template_cache.get_template('albums_report')
+    if template is None:
+        create_album_report_template()
+        template = template_cache.get_template('albums_report')
+    return template
+
+
+def create_pdf_response(pdf_report):
+    response = HttpResponse(pdf_report, content_type='application/pdf')
+    response['Content-Disposition'] = 'inline; filename="{filename}"'.format(filename='albums.pdf')
+    return response
+
+
+def get_albums(year=None, after=None):
+    """Returns available albums from the database. Can be optionally filtered by year.
+
+    If *after* (name and id of an album) is set only albums sorted after this album are returned.
+    """
+    albums = Album.objects.all().order_by('name', 'id')
     if year is not None:
-        albums = albums.filter(year=year).order_by('name')
-    return albums.values()
+        albums = albums.filter(year=year).order_by('name', 'id')
+    if after is not None:
+        name, album_id = after
+        # name__gte is redundant but allows the db to use the name index to find the first row
+        albums = albums.filter(Q(name__gte=name), Q(name__gt=name) | Q(id__gt=album_id))
+    return albums.values(*ALBUM_FIELDS)
+
+
+async def get_album_page(year=None, limit=MAX_PAGE_SIZE, after=None):
+    """Returns one page of albums and the cursor for the next page (None for the last page).
+
+    The albums are returned as tuples of row_cache.FIELDS, see row_cache.encode_list.
+
+    Keyset pagination is used, i.e. the page starts after the album with the name and id
+    given in *after*, so the database does not need to skip all rows of previous pages.
+    """
+    rows = [row async for row in get_albums(year, after).values_list(*row_cache.FIELDS)[:limit + 1]]
+    next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    return dict(albums=rows[:limit], next=next_cursor)
+
+
+async def get_album_changes(since, year=None, limit=MAX_CHANGES_SIZE):
+    """Returns the albums added, modified and deleted after the change token *since*.
+
+    Returns a dict with the changed *albums* (tuples of row_cache.FIELDS), the ids of *deleted*
+    albums and the *token* which is passed as *since* the next time. If the year is set, changed
+    albums of other years are returned as deleted as well (they might have been moved to another
+    year). *more* is set in case there are more than *limit* changes, the remaining changes are
+    returned for the new token.
+    A client without any albums loaded can pass 0 as token to get all albums.
+    """
+    # rows with a higher change_seq than the current counter are ignored, they are
+    # committed after the counter was read and returned with the next token
+    token = await versions.aget_version(versions.ALBUM_CHANGES)
+    rows = [row async for row in Album.objects.filter(change_seq__gt=since, change_seq__lte=token).
+            order_by('change_seq').values_list(*row_cache.FIELDS)[:limit + 1]]
+    more = len(rows) > limit
+    if more:
+        rows = rows[:limit]
+        token = rows[-1][-1]
+    deleted = [album_id async for album_id in AlbumTombstone.objects.filter(
+        change_seq__gt=since, change_seq__lte=token).values_list('album_id', flat=True)]
+    albums = []
+    year_index = row_cache.FIELDS.index('year')
+    for row in rows:
+        if year is None or row[year_index] == year:
+            albums.append(row)
+        else:
+            deleted.append(row[0])
+    return dict(albums=albums, deleted=deleted, token=str(token), more=more)
+
+
+def stream_albums(year=None):
+    """Yields a json array of all albums in chunks, rows are fetched with a server-side cursor."""
+    yield b'['
+    separator = b''
+    rows = []
+    for row in get_albums(year).values_list(*row_cache.FIELDS).iterator(chunk_size=STREAM_CHUNK_SIZE):
+        rows.append(row)
+        if len(rows) == STREAM_CHUNK_SIZE:
+            yield separator + b','.join(row_cache.encode_rows(rows))
+            separator = b','
+            rows = []
+    yield (separator + b','.join(row_cache.encode_rows(rows)) if rows else b'') + b']'
+
+
+async def astream_albums(year=None):
+    """Same as *stream_albums* for responses served by asgi."""
+    yield b'['
+    separator = b''
+    rows = []
+    # aiterator of a values_list queryset runs the query in the event loop (django 4.2), so dicts are fetched
+    async for album in get_albums(year).values(*row_cache.FIELDS).aiterator(chunk_size=STREAM_CHUNK_SIZE):
+        rows.append(tuple(album.values()))
+        if len(rows) == STREAM_CHUNK_SIZE:
+            yield separator + b','.join(row_cache.encode_rows(rows))
+            separator = b','
+            rows = []
+    yield (separator + b','.join(row_cache.encode_rows(rows)) if rows else b'') + b']'
+
+
+def encode_cursor(name, album_id):
+    value = json.dumps([name, album_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(value).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Returns name and id of the album encoded in the cursor, raises ValueError for an invalid cursor."""
+    try:
+        name, album_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValueError('invalid cursor')
+    if not isinstance(name, str) or not isinstance(album_id, int):
+        raise ValueError('invalid cursor')
+    return name, album_id
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class AlbumsConfig(AppConfig):
     name = 'albums'
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        # registers the signal receiver which configures sqlite connections
+        from . import db  # noqa: F401
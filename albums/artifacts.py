@@ -0,0 +1,63 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+
+# generated report files are stored in this directory, the filename is
+# the sha256 hash of the content so identical files are only stored once
+DEFAULT_ARTIFACT_DIR = os.path.join(settings.BASE_DIR, 'artifacts')
+
+
+def get_artifact_dir():
+    return getattr(settings, 'ALBUMS_ARTIFACT_DIR', DEFAULT_ARTIFACT_DIR)
+
+
+def get_full_path(path):
+    return os.path.join(get_artifact_dir(), path)
+
+
+def store(content):
+    """Stores the given file content and returns the path (relative to the artifact dir) and size."""
+    content_hash = hashlib.sha256(content).hexdigest()
+    path = os.path.join(content_hash[:2], content_hash)
+    full_path = get_full_path(path)
+    if not os.path.exists(full_path):
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # write to a temporary file first so a partially written file is never served
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_filename, full_path)
+    return path, len(content)
+
+
+def delete(paths):
+    """Deletes the files with the given paths, a file which does not exist is ignored.
+
+    The caller must make sure the files are not referenced anymore.
+    """
+    for path in paths:
+        try:
+            os.remove(get_full_path(path))
+        except FileNotFoundError:
+            pass
+
+
+def create_response(path, content_type, filename):
+    """Returns a response to download the stored file without loading it into memory.
+
+    If ALBUMS_ARTIFACT_ACCEL_REDIRECT is set (url prefix of an internal nginx location
+    pointing to the artifact dir) the file is sent by the web server, otherwise
+    FileResponse is used which uses sendfile if supported by the wsgi server.
+    """
+    accel_redirect = getattr(settings, 'ALBUMS_ARTIFACT_ACCEL_REDIRECT', None)
+    if accel_redirect:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_redirect.rstrip('/') + '/' + path.replace(os.sep, '/')
+    else:
+        response = FileResponse(open(get_full_path(path), 'rb'), content_type=content_type)
+    response['Content-Disposition'] = 'inline; filename="{filename}"'.format(filename=filename)
+    return response
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# pragmas executed for every new sqlite connection, WAL allows reading while another
+# connection is writing and synchronous=NORMAL is safe in WAL mode (only the last
+# transactions can be lost on power failure, the db is never corrupted)
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative value: size in KB
+    'busy_timeout': 5000,  # ms
+    'temp_store': 'MEMORY',
+}
+
+# optional databases used by AlbumRouter if they are configured in settings.DATABASES
+READ_DATABASE = 'replica'
+PREVIEW_DATABASE = 'previews'
+
+# the album catalog is read from READ_DATABASE, report previews and jobs are stored in PREVIEW_DATABASE
+CATALOG_MODELS = ('album', 'albumtombstone', 'reportdefinition', 'dataversion')
+PREVIEW_MODELS = ('reportrequest', 'reportrequestdefinition', 'reportjob', 'storageusage', 'renderslot')
+
+
+def get_sqlite_pragmas():
+    """Returns the pragmas (ALBUMS_SQLITE_PRAGMAS) merged with the defaults, a pragma set to None is not executed."""
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+    pragmas.update(getattr(settings, 'ALBUMS_SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+@receiver(connection_created)
+def set_sqlite_pragmas(connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in get_sqlite_pragmas().items():
+            if value is not None:
+                cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+def has_database(alias):
+    return alias in settings.DATABASES
+
+
+class AlbumRouter:
+    """Routes queries of the album app to separate databases if they are configured.
+
+    - READ_DATABASE (replica): read queries of the album catalog, this can be a separate
+      connection to the same sqlite file or a replica of the default database. Queries inside
+      a transaction of the default database are not routed so uncommitted changes are visible.
+    - PREVIEW_DATABASE (previews): report previews, report jobs and their storage usage, so writing
+      previews never locks the catalog. Create its tables with: manage.py migrate --database previews
+
+    All queries use the default database if these databases are not configured.
+    """
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'albums':
+            return None
+        if model._meta.model_name in PREVIEW_MODELS:
+            return PREVIEW_DATABASE if has_database(PREVIEW_DATABASE) else None
+        if model._meta.model_name in CATALOG_MODELS and has_database(READ_DATABASE) and\
+                not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return READ_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'albums' and model._meta.model_name in PREVIEW_MODELS and\
+                has_database(PREVIEW_DATABASE):
+            return PREVIEW_DATABASE
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == READ_DATABASE:
+            # the replica contains the same tables as the default database
+            return False
+        if not has_database(PREVIEW_DATABASE):
+            return None
+        if app_label == 'albums' and model_name in PREVIEW_MODELS:
+            return db == PREVIEW_DATABASE
+        return db != PREVIEW_DATABASE
@@ -0,0 +1,68 @@
+# decorators for async views, the corresponding decorators of django
+# (django.views.decorators) only support async views since django 5.0
+import functools
+
+from asgiref.sync import sync_to_async
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+
+def async_condition(etag_func):
+    """Same as django.views.decorators.http.condition (without last_modified_func).
+
+    *etag_func* is a sync function, it is called in a thread so it can use the db.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag = await sync_to_async(etag_func)(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag else None
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD') and etag:
+                response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+
+def async_cache_control(**kwargs):
+    """Same as django.views.decorators.cache.cache_control."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def inner(request, *args, **kw):
+            response = await view(request, *args, **kw)
+            patch_cache_control(response, **kwargs)
+            return response
+        return inner
+    return decorator
+
+
+def async_csrf_exempt(view):
+    """Same as django.views.decorators.csrf.csrf_exempt."""
+    @functools.wraps(view)
+    async def inner(*args, **kwargs):
+        return await view(*args, **kwargs)
+    inner.csrf_exempt = True
+    return inner
+
+
+def async_ensure_csrf_cookie(view):
+    """Same as django.views.decorators.csrf.ensure_csrf_cookie, the cookie is set by CsrfViewMiddleware."""
+    @functools.wraps(view)
+    async def inner(request, *args, **kwargs):
+        get_token(request)
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+def async_xframe_options_exempt(view):
+    """Same as django.views.decorators.clickjacking.xframe_options_exempt."""
+    @functools.wraps(view)
+    async def inner(*args, **kwargs):
+        response = await view(*args, **kwargs)
+        response.xframe_options_exempt = True
+        return response
+    return inner
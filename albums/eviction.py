@@ -0,0 +1,175 @@
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Max, ProtectedError, Sum
+
+from . import artifacts, versions
+from .models import AlbumTombstone, ReportJob, ReportRequest, ReportRequestDefinition, StorageUsage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREVIEW_EVICTION = {
+    'MAX_SIZE': 1000 * 1024 * 1024,
+    'TTL': 180,
+    'INTERVAL': 30,
+    'BACKGROUND': True,
+}
+
+# name of the StorageUsage row containing the total size of all report request files
+REPORT_REQUEST_USAGE = 'report_request'
+
+# tombstones of deleted albums are kept for this number of seconds, a client must sync
+# its albums within this time (see album_views.get_album_changes)
+DEFAULT_TOMBSTONE_RETENTION = 7 * 24 * 3600
+
+# the running total can drift if report requests are deleted concurrently,
+# it is recalculated after this number of eviction runs
+RESYNC_RUNS = 20
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def get_config():
+    """Returns the eviction settings (ALBUMS_PREVIEW_EVICTION) merged with the defaults."""
+    config = dict(DEFAULT_PREVIEW_EVICTION)
+    config.update(getattr(settings, 'ALBUMS_PREVIEW_EVICTION', {}))
+    return config
+
+
+def add_usage(size):
+    """Adds the size of a stored file to the running total (negative size for deleted files)."""
+    if StorageUsage.objects.filter(name=REPORT_REQUEST_USAGE).update(total_size=F('total_size') + size) == 0:
+        resync()
+
+
+def get_total_size():
+    total_size = StorageUsage.objects.filter(name=REPORT_REQUEST_USAGE).values_list('total_size', flat=True).first()
+    return total_size or 0
+
+
+def resync():
+    """Recalculates the running total from all report requests, this requires a table scan."""
+    sums = ReportRequest.objects.aggregate(Sum('pdf_file_size'), Sum('xlsx_file_size'))
+    total_size = (sums['pdf_file_size__sum'] or 0) + (sums['xlsx_file_size__sum'] or 0)
+    StorageUsage.objects.update_or_create(name=REPORT_REQUEST_USAGE, defaults=dict(total_size=total_size))
+    return total_size
+
+
+def delete_report_requests(report_requests):
+    """Deletes the given report requests, their stored pdf and xlsx files and report definitions.
+
+    A stored file or report definition is only deleted if it is not referenced by another report
+    request (identical files and definitions are only stored once). Returns the number of deleted
+    report requests.
+    """
+    rows = list(report_requests.values_list(
+        'id', 'pdf_file_path', 'pdf_file_size', 'xlsx_file_path', 'xlsx_file_size', 'definition_id'))
+    if not rows:
+        return 0
+    ReportRequest.objects.filter(id__in=[row[0] for row in rows]).delete()
+    add_usage(-sum((row[2] or 0) + (row[4] or 0) for row in rows))
+    paths = set(row[1] for row in rows if row[1]) | set(row[3] for row in rows if row[3])
+    artifacts.delete(get_unreferenced_paths(paths))
+    definition_ids = set(row[5] for row in rows)
+    try:
+        ReportRequestDefinition.objects.filter(id__in=definition_ids).exclude(
+            id__in=ReportRequest.objects.filter(definition_id__in=definition_ids).values('definition_id')).delete()
+    except (IntegrityError, ProtectedError):
+        # a definition is referenced by a report request added in the meantime,
+        # it is deleted once all report requests referencing it are deleted
+        pass
+    return len(rows)
+
+
+def get_unreferenced_paths(paths):
+    """Returns the stored files (paths) which are neither referenced by a report request nor by a report job."""
+    paths = set(paths)
+    if paths:
+        paths -= set(ReportRequest.objects.filter(pdf_file_path__in=paths).values_list('pdf_file_path', flat=True))
+        paths -= set(ReportRequest.objects.filter(xlsx_file_path__in=paths).values_list('xlsx_file_path', flat=True))
+        paths -= set(ReportJob.objects.filter(result_file_path__in=paths).values_list('result_file_path', flat=True))
+    return paths
+
+
+def evict(now=None):
+    """Deletes expired report requests and the oldest ones if the total size exceeds the limit.
+
+    Only the created_on index is used, the size of the table is not relevant.
+    Returns the number of deleted report requests.
+    """
+    config = get_config()
+    if now is None:
+        now = datetime.datetime.now()
+    expired = ReportRequest.objects.filter(created_on__lt=now - datetime.timedelta(seconds=config['TTL']))
+    deleted = delete_report_requests(expired)
+
+    total_size = get_total_size()
+    while total_size > config['MAX_SIZE']:
+        # delete oldest report requests first, in batches until enough space is available
+        oldest = ReportRequest.objects.order_by('created_on').values_list(
+            'id', 'pdf_file_size', 'xlsx_file_size')[:100]
+        ids = []
+        for report_request_id, pdf_file_size, xlsx_file_size in oldest:
+            ids.append(report_request_id)
+            total_size -= (pdf_file_size or 0) + (xlsx_file_size or 0)
+            if total_size <= config['MAX_SIZE']:
+                break
+        if not ids:
+            resync()
+            break
+        deleted += delete_report_requests(ReportRequest.objects.filter(id__in=ids))
+    return deleted
+
+
+def prune_tombstones(now=None):
+    """Deletes the tombstones of albums deleted before the retention time (ALBUMS_TOMBSTONE_RETENTION).
+
+    The highest change sequence number of the deleted tombstones is stored, a client syncing changes
+    with an older token has to load all albums again. Returns the number of deleted tombstones.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    retention = getattr(settings, 'ALBUMS_TOMBSTONE_RETENTION', DEFAULT_TOMBSTONE_RETENTION)
+    expired = AlbumTombstone.objects.filter(deleted_on__lt=now - datetime.timedelta(seconds=retention))
+    max_change_seq = expired.aggregate(Max('change_seq'))['change_seq__max']
+    if max_change_seq is None:
+        return 0
+    with transaction.atomic():
+        versions.raise_version(versions.ALBUM_TOMBSTONES_PRUNED, max_change_seq)
+        deleted, _ = AlbumTombstone.objects.filter(change_seq__lte=max_change_seq).delete()
+    return deleted
+
+
+def start_background_eviction():
+    """Starts a daemon thread which periodically evicts report requests and prunes album tombstones (once per process).
+
+    Does nothing if BACKGROUND is disabled, the evict_report_requests command
+    must then be executed regularly (e.g. by cron).
+    """
+    global _thread
+    if _thread is not None or not get_config()['BACKGROUND']:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name='report-request-eviction', daemon=True)
+            _thread.start()
+
+
+def _run():
+    runs = 0
+    while True:
+        time.sleep(get_config()['INTERVAL'])
+        try:
+            close_old_connections()
+            if runs % RESYNC_RUNS == 0:
+                resync()
+            evict()
+            prune_tombstones()
+        except Exception:
+            logger.exception('report request eviction failed')
+        runs += 1
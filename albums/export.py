@@ -0,0 +1,115 @@
+# export of the album catalog as csv or xlsx file. The albums are fetched with a server-side
+# cursor and written row by row, so the memory usage does not depend on the number of albums.
+import csv
+import tempfile
+
+from asgiref.sync import sync_to_async
+from django.utils.translation import gettext as _
+
+import xlsxwriter
+
+from .utils import ALBUM_FIELDS
+
+# text values starting with one of these characters are interpreted as formula by spreadsheet
+# applications when the exported file is opened (csv/formula injection)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# album values written as text (user input)
+TEXT_FIELDS = ('name', 'artist')
+
+EXPORT_CHUNK_SIZE = 1000  # number of albums fetched from the db and sent at once
+FILE_CHUNK_SIZE = 64 * 1024  # number of bytes read from the xlsx file and sent at once
+# content type and file extension of the export formats
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+
+class Echo:
+    """File-like object which returns the written value instead of buffering it, used for the csv writer."""
+    def write(self, value):
+        return value
+
+
+def get_header():
+    return [_('album.' + field) for field in ALBUM_FIELDS]
+
+
+def escape_formula(value):
+    """Prefixes a text value with ' if it would be interpreted as formula by a spreadsheet application."""
+    if value and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def get_row(album):
+    """Returns the values of the album for a csv row, text values are escaped (see *escape_formula*)."""
+    return [escape_formula(album[field]) if field in TEXT_FIELDS else album[field] for field in ALBUM_FIELDS]
+
+
+def stream_csv(albums):
+    """Yields the csv file of the albums (values queryset) in chunks, the header row is sent immediately."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(get_header())
+    chunk = []
+    for album in albums.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        chunk.append(writer.writerow(get_row(album)))
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+async def astream_csv(albums):
+    """Same as *stream_csv* for responses served by asgi."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(get_header())
+    chunk = []
+    async for album in albums.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        chunk.append(writer.writerow(get_row(album)))
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def create_xlsx(albums):
+    """Writes the albums (values queryset) to a xlsx file and returns the opened file.
+
+    The file is only complete after all rows are written (the zip directory is written last),
+    so it cannot be streamed while it is created. In constant memory mode each row is flushed
+    to a temporary file once the next row is written. The returned file is deleted when it is closed.
+    """
+    output = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(output, dict(constant_memory=True, tmpdir=tempfile.gettempdir()))
+    worksheet = workbook.add_worksheet()
+    bold = workbook.add_format(dict(bold=True))
+    worksheet.write_row(0, 0, get_header(), bold)
+    worksheet.set_column(1, 2, 40)
+    for i, album in enumerate(albums.iterator(chunk_size=EXPORT_CHUNK_SIZE), start=1):
+        for col, field in enumerate(ALBUM_FIELDS):
+            if field in TEXT_FIELDS:
+                # always written as string, write() would convert values starting with = to a formula
+                worksheet.write_string(i, col, album[field] or '')
+            else:
+                worksheet.write(i, col, album[field])
+    workbook.close()
+    output.seek(0)
+    return output
+
+
+async def astream_file(output):
+    """Yields the content of the file in chunks and closes it.
+
+    Used instead of FileResponse which reads the whole file into memory when served by asgi.
+    """
+    try:
+        while True:
+            chunk = await sync_to_async(output.read, thread_sensitive=False)(FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        output.close()
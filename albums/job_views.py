@@ -0,0 +1,99 @@
+import datetime
+import json
+
+from django.http import HttpResponseBadRequest, HttpResponse, Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+
+from . import artifacts, jobs, template_cache
+from .album_views import get_albums
+from .models import ReportJob
+from .rendering import CONTENT_TYPES
+from .utils import create_album_report_template
+
+
+def album_report(request):
+    """Adds a job to print a pdf file with all available albums.
+
+    Same as *album_views.report* but the pdf file is generated in a worker process,
+    the returned job key is used to get the job status and to download the file.
+    The albums can be optionally filtered by year.
+    """
+    if not jobs.get_config()['ENABLED']:
+        raise Http404('report jobs not enabled')
+    if request.method != 'POST':
+        return HttpResponseBadRequest('invalid request method')
+    year = request.GET.get('year')
+    if year:
+        try:
+            year = int(year)
+        except (ValueError, TypeError):
+            return HttpResponseBadRequest('invalid year parameter')
+    else:
+        year = None
+
+    template = template_cache.get_template('albums_report')
+    if template is None:
+        create_album_report_template()
+        template = template_cache.get_template('albums_report')
+    if template.errors:
+        return JsonResponse(dict(errors=template.errors))
+
+    params = dict(year=year, albums=list(get_albums(year)), current_date=datetime.datetime.now())
+    return submit_job(template.report_definition, params, False, 'pdf', 'albums.pdf')
+
+
+@csrf_exempt
+def preview(request):
+    """Adds a job to generate a report for preview.
+
+    Expects the same values as the PUT request of *report_views.run*.
+    """
+    if not jobs.get_config()['ENABLED']:
+        raise Http404('report jobs not enabled')
+    if request.method != 'PUT':
+        return HttpResponseBadRequest('invalid request method')
+    json_data = json.loads(request.body.decode('utf-8'))
+    if not isinstance(json_data, dict) or not isinstance(json_data.get('report'), dict) or\
+            not isinstance(json_data.get('data'), dict) or not isinstance(json_data.get('isTestData'), bool):
+        return HttpResponseBadRequest('invalid report values')
+
+    output_format = json_data.get('outputFormat')
+    if output_format not in ('pdf', 'xlsx'):
+        return HttpResponseBadRequest('outputFormat parameter missing or invalid')
+    return submit_job(
+        json_data.get('report'), json_data.get('data'), json_data.get('isTestData'), output_format,
+        'report.' + output_format)
+
+
+def status(request, key):
+    """Returns the status of a report job, once the job is finished the file can be downloaded."""
+    job = jobs.get_job(key)
+    if job is None:
+        raise Http404('report job not found')
+    rv = dict(key=job.key, status=job.status, errors=json.loads(job.errors) if job.errors else [])
+    if job.status == ReportJob.STATUS_FINISHED:
+        rv['url'] = reverse('albums:report_job_file', args=[job.key])
+    return JsonResponse(rv)
+
+
+def download(request, key):
+    """Returns the generated file of a finished report job."""
+    job = ReportJob.objects.filter(key=key, status=ReportJob.STATUS_FINISHED).first()
+    if job is None:
+        raise Http404('report job not found or not finished')
+    try:
+        # stream the stored file without reading it into memory
+        return artifacts.create_response(job.result_file_path, CONTENT_TYPES[job.output_format], job.filename)
+    except FileNotFoundError:
+        raise Http404('report job file not found')
+
+
+def submit_job(report_definition, data, is_test_data, output_format, filename):
+    try:
+        job = jobs.submit(report_definition, data, is_test_data, output_format, filename)
+    except jobs.QueueFullError:
+        response = HttpResponse('too many pending report jobs', status=503)
+        response['Retry-After'] = '10'
+        return response
+    return JsonResponse(dict(key=job.key, status=job.status, url=reverse('albums:report_job', args=[job.key])))
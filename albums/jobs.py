@@ -0,0 +1,140 @@
+import concurrent.futures
+import datetime
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from . import admission, artifacts, eviction, render_pool, rendering
+from .models import ReportJob
+
+DEFAULT_REPORT_JOBS = {
+    'ENABLED': False,
+    'POOL_SIZE': 2,
+    'MAX_QUEUE_DEPTH': 20,
+    'TIMEOUT': 600,
+    'RETENTION': 3600,
+}
+
+# interval in seconds to check for a free render slot while a job waits
+BUSY_RETRY_INTERVAL = 0.5
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def get_config():
+    """Returns the job settings (ALBUMS_REPORT_JOBS) merged with the defaults."""
+    config = dict(DEFAULT_REPORT_JOBS)
+    config.update(getattr(settings, 'ALBUMS_REPORT_JOBS', {}))
+    return config
+
+
+def get_executor():
+    """Returns the thread pool running the jobs, POOL_SIZE is the max. number of jobs rendered at once.
+
+    The reports are rendered by the worker processes of the render pool (see albums.render_pool)
+    and each job takes a render slot like any other report request (see albums.admission).
+    A job waits (and stays pending) until a render slot is free, it does not take a place in the
+    queue of report requests so waiting jobs never cause report requests to be rejected.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=get_config()['POOL_SIZE'], thread_name_prefix='albums-report-job')
+    return _executor
+
+
+def submit(report_definition, data, is_test_data, output_format, filename, additional_fonts=None):
+    """Adds a report job and starts rendering the report in a worker process.
+
+    Returns the created ReportJob, raises QueueFullError in case too many jobs are pending.
+    """
+    config = get_config()
+    now = datetime.datetime.now()
+    # delete old jobs, the generated files are only kept for a limited time
+    delete_jobs(ReportJob.objects.filter(created_on__lt=now - datetime.timedelta(seconds=config['RETENTION'])))
+
+    pending_jobs = ReportJob.objects.filter(
+        status=ReportJob.STATUS_PENDING,
+        created_on__gte=now - datetime.timedelta(seconds=config['TIMEOUT'])).count()
+    if pending_jobs >= config['MAX_QUEUE_DEPTH']:
+        raise QueueFullError()
+
+    job = ReportJob.objects.create(
+        key=str(uuid.uuid4()), status=ReportJob.STATUS_PENDING, output_format=output_format,
+        filename=filename, created_on=now)
+    get_executor().submit(
+        _run_job, job.key, now + datetime.timedelta(seconds=config['TIMEOUT']),
+        report_definition, data, is_test_data, output_format, additional_fonts)
+    return job
+
+
+def delete_jobs(report_jobs):
+    """Deletes the given report jobs and their stored files, returns the number of deleted jobs.
+
+    A stored file is only deleted if it is not referenced by another job or a report preview
+    (identical files are only stored once).
+    """
+    rows = list(report_jobs.values_list('id', 'result_file_path'))
+    if not rows:
+        return 0
+    ReportJob.objects.filter(id__in=[row[0] for row in rows]).delete()
+    artifacts.delete(eviction.get_unreferenced_paths(row[1] for row in rows if row[1]))
+    return len(rows)
+
+
+def get_job(key):
+    """Returns the job for the given key or None if it does not exist (anymore).
+
+    Jobs which are pending longer than the configured timeout are marked as failed,
+    this can happen if the process which submitted the job was terminated.
+    """
+    job = ReportJob.objects.filter(key=key).first()
+    if job is not None and job.status == ReportJob.STATUS_PENDING:
+        timeout = datetime.timedelta(seconds=get_config()['TIMEOUT'])
+        if job.created_on < datetime.datetime.now() - timeout:
+            job.status = ReportJob.STATUS_FAILED
+            job.errors = json.dumps([dict(msg_key='job timed out')])
+            ReportJob.objects.filter(key=key, status=ReportJob.STATUS_PENDING).update(
+                status=job.status, errors=job.errors)
+    return job
+
+
+def _run_job(key, timeout_on, *args):
+    # called in a thread of the web server process, waits until the report is rendered in a worker process
+    try:
+        while True:
+            try:
+                rv = render_pool.render(rendering.render_report, *args, wait=False)
+                break
+            except admission.RenderBusyError:
+                # all render slots are busy, the job stays pending until a slot is free
+                if datetime.datetime.now() >= timeout_on:
+                    rv = dict(errors=[dict(msg_key='job timed out')])
+                    break
+                time.sleep(BUSY_RETRY_INTERVAL)
+    except Exception as ex:
+        # e.g. the worker process was terminated
+        rv = dict(errors=[dict(msg_key='job exception', info=str(ex))])
+
+    now = datetime.datetime.now()
+    if 'file' in rv:
+        # only the path of the stored file is saved so a status query does not load the file
+        result_file_path, result_file_size = artifacts.store(rv['file'])
+        if ReportJob.objects.filter(key=key).update(
+                status=ReportJob.STATUS_FINISHED, result_file_path=result_file_path,
+                result_file_size=result_file_size, finished_on=now) == 0:
+            # job was deleted in the meantime
+            artifacts.delete(eviction.get_unreferenced_paths([result_file_path]))
+    else:
+        ReportJob.objects.filter(key=key).update(
+            status=ReportJob.STATUS_FAILED, errors=json.dumps(rv['errors']), finished_on=now)
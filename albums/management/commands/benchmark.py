@@ -0,0 +1,171 @@
+import datetime
+import json
+import os
+import platform
+import resource
+import tempfile
+from timeit import default_timer as timer
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from albums import render_pool
+from albums.management.utils import temporary_database
+from albums.models import Album
+
+
+class Command(BaseCommand):
+    help = 'Measures latency and throughput of the album and report endpoints for different catalog sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--albums', type=int, nargs='+', default=[100, 1000, 10000],
+            help='catalog sizes, a temporary database is seeded with this number of albums for each run')
+        parser.add_argument('--iterations', type=int, default=20, help='measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=2, help='requests per endpoint which are not measured')
+        parser.add_argument('--endpoints', nargs='+', help='only run the given endpoints')
+        parser.add_argument('--output', help='write results as json to this file')
+
+    def handle(self, *args, **options):
+        results = []
+        setup_test_environment()
+        try:
+            # previews are stored in a temporary directory, caches are disabled unless
+            # an endpoint explicitly measures cached responses
+            with tempfile.TemporaryDirectory() as artifact_dir, override_settings(
+                    ALBUMS_ARTIFACT_DIR=artifact_dir, ALBUMS_PREVIEW_EVICTION=dict(BACKGROUND=False)):
+                for album_count in options['albums']:
+                    results.extend(self.run(album_count, options))
+        finally:
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(dict(
+                    created_on=datetime.datetime.now().isoformat(), python=platform.python_version(),
+                    django=django.get_version(), iterations=options['iterations'], results=results), f, indent=2)
+            self.stdout.write('results written to ' + options['output'])
+
+    def run(self, album_count, options):
+        with temporary_database():
+            Album.objects.bulk_create((
+                Album(name='Album %d' % i, artist='Artist %d' % (i % 1000), year=1950 + i % 70,
+                      best_of_compilation=i % 10 == 0)
+                for i in range(album_count)), batch_size=5000)
+
+            self.stdout.write('%d albums' % album_count)
+            self.stdout.write('  %-22s %9s %9s %9s %9s %11s %12s' % (
+                'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'mean ms', 'req/s', 'peak rss kb'))
+            results = []
+            client = Client()
+            for name, func, endpoint_settings in self.get_endpoints(client):
+                if options['endpoints'] and name not in options['endpoints']:
+                    continue
+                with override_settings(**endpoint_settings):
+                    result = self.measure(func, options['warmup'], options['iterations'])
+                result.update(albums=album_count, endpoint=name)
+                results.append(result)
+                self.stdout.write('  %-22s %9.2f %9.2f %9.2f %9.2f %11.1f %12d' % (
+                    name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['mean_ms'],
+                    result['throughput'], result['peak_rss_kb']))
+            workers_peak_rss_kb = self.get_workers_peak_rss_kb()
+            for result in results:
+                result['workers_peak_rss_kb'] = workers_peak_rss_kb
+            self.stdout.write(
+                '  peak rss kb of render pool workers: %d (peak rss kb above: benchmark process only)' %
+                workers_peak_rss_kb)
+            return results
+
+    @staticmethod
+    def measure(func, warmup, iterations):
+        for i in range(warmup):
+            func(-1 - i)
+        durations = []
+        start = timer()
+        for i in range(iterations):
+            request_start = timer()
+            func(i)
+            durations.append(timer() - request_start)
+        total = timer() - start
+        durations.sort()
+
+        def percentile(p):
+            # nearest-rank method
+            return durations[max(int(round(p / 100 * len(durations))) - 1, 0)] * 1000
+
+        return dict(
+            iterations=iterations, p50_ms=percentile(50), p95_ms=percentile(95), p99_ms=percentile(99),
+            mean_ms=sum(durations) / len(durations) * 1000, throughput=iterations / total if total else 0,
+            # maximum resident set size of this process so far (in kilobytes on linux), this does not
+            # include the worker processes of the render pool, see *get_workers_peak_rss_kb*
+            peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    @staticmethod
+    def get_workers_peak_rss_kb():
+        """Returns the maximum resident set size of all render pool worker processes so far.
+
+        The usage of a child process is only available after it terminated, so the
+        worker processes are stopped (they are started again by the next report).
+        """
+        render_pool.shutdown()
+        return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    @staticmethod
+    def get_endpoints(client):
+        """Returns name, function (called with the iteration number) and settings for all endpoints."""
+        with open(os.path.join(settings.BASE_DIR, 'albums', 'static', 'report_definition.json')) as f:
+            report_definition = json.load(f)
+        preview_albums = [dict(name='Album %d' % i, artist='Artist', year=2000, best_of_compilation=False)
+                          for i in range(100)]
+        no_pdf_cache = dict(ALBUMS_PDF_CACHE=None)
+        no_prerender = dict(ALBUMS_PREVIEW_PRERENDER_XLSX=False)
+        preview_key = dict()
+
+        def check(response):
+            if response.status_code != 200:
+                raise Exception('request failed with status %d: %s' % (response.status_code, response.content[:200]))
+            if response.streaming:
+                # consume response so the time for sending the whole content is measured
+                for _ in response.streaming_content:
+                    pass
+            return response
+
+        def preview_put(i):
+            # test data is different for every request so the preview is not reused
+            data = dict(albums=preview_albums + [dict(name='Run %d' % i, artist='', year=2000)])
+            response = check(client.put(reverse('albums:report_run'), json.dumps(dict(
+                report=report_definition, data=data, isTestData=True, outputFormat='pdf')),
+                content_type='application/json'))
+            preview_key['key'] = response.content.decode('utf-8')[4:]
+
+        def preview_get(output_format):
+            def get(i):
+                if 'key' not in preview_key:
+                    preview_put(-100)
+                check(client.get(
+                    reverse('albums:report_run'), dict(key=preview_key['key'], outputFormat=output_format)))
+            return get
+
+        return (
+            ('album/data', lambda i: check(client.get(reverse('albums:album_data'))), {}),
+            ('album/data?year', lambda i: check(client.get(reverse('albums:album_data'), dict(year=2000))), {}),
+            ('album/data?limit', lambda i: check(client.get(reverse('albums:album_data'), dict(limit=100))), {}),
+            ('album/data?stream', lambda i: check(client.get(reverse('albums:album_data'), dict(stream=1))), {}),
+            ('album/search', lambda i: check(
+                client.get(reverse('albums:album_search'), dict(q='album %d' % (i % 100), limit=100))), {}),
+            ('album/export csv', lambda i: check(client.get(reverse('albums:album_export'))), {}),
+            ('album/export xlsx', lambda i: check(client.get(reverse('albums:album_export'), dict(format='xlsx'))), {}),
+            ('album/index', lambda i: check(client.get(reverse('albums:album_index'))), {}),
+            ('album/report', lambda i: check(client.get(reverse('albums:album_report'))), no_pdf_cache),
+            ('album/report?year', lambda i: check(
+                client.get(reverse('albums:album_report'), dict(year=2000))), no_pdf_cache),
+            ('album/report cached', lambda i: check(client.get(reverse('albums:album_report'))), {}),
+            ('report/run PUT', preview_put, no_prerender),
+            ('report/run GET pdf', preview_get('pdf'), no_prerender),
+            # xlsx is not prerendered, so this measures rendering the xlsx file during download
+            ('report/run GET xlsx', preview_get('xlsx'), no_prerender),
+        )
@@ -0,0 +1,59 @@
+import datetime
+import json
+from timeit import default_timer as timer
+
+from django.core.management.base import BaseCommand
+from reportbro import Report
+
+from albums import template_cache
+from albums.models import ReportDefinition
+from albums.utils import create_album_report_template
+
+
+class Command(BaseCommand):
+    help = 'Compares report initialization with and without the report template cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--albums', type=int, default=10, help='number of album rows passed to the report')
+
+    def handle(self, *args, **options):
+        if ReportDefinition.objects.filter(report_type='albums_report').count() == 0:
+            create_album_report_template()
+
+        iterations = options['iterations']
+        albums = [dict(id=i, name='Album %d' % i, artist='Artist %d' % i, year=2000 + i % 20,
+                       best_of_compilation=i % 5 == 0) for i in range(options['albums'])]
+
+        def get_params():
+            return dict(year=None, albums=albums, current_date=datetime.datetime.now())
+
+        def uncached():
+            # report initialization as it is done without template cache
+            ReportDefinition.objects.filter(report_type='albums_report').count()
+            report_definition = ReportDefinition.objects.get(report_type='albums_report')
+            Report(json.loads(report_definition.report_definition), get_params())
+
+        def cached():
+            template = template_cache.get_template('albums_report')
+            Report(template.report_definition, get_params())
+
+        template_cache.invalidate()
+        template_cache.get_template('albums_report')  # warm up cache
+        definition_size = len(ReportDefinition.objects.get(report_type='albums_report').report_definition)
+        self.stdout.write('report definition: %d bytes, %d albums, %d iterations' % (
+            definition_size, len(albums), iterations))
+
+        results = dict()
+        for name, func in (('uncached', uncached), ('cached', cached)):
+            start = timer()
+            for _ in range(iterations):
+                func()
+            results[name] = (timer() - start) / iterations
+            self.stdout.write('%-10s %.3f ms per request' % (name, results[name] * 1000))
+
+        saved = results['uncached'] - results['cached']
+        self.stdout.write('saved      %.3f ms per request (%.1f%%)' % (
+            saved * 1000, saved / results['uncached'] * 100 if results['uncached'] else 0))
+        self.stdout.write('cache stats: %d hits, %d misses' % (
+            template_cache.stats['hits'], template_cache.stats['misses']))
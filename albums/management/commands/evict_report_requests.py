@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from albums import eviction
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired report previews and the oldest ones if the size limit is exceeded, ' \
+           'deletes old tombstones of deleted albums'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--resync', action='store_true', help='recalculate the total size of stored files before eviction')
+
+    def handle(self, *args, **options):
+        if options['resync']:
+            eviction.resync()
+        deleted = eviction.evict()
+        self.stdout.write('deleted %d report requests, total size %d bytes' % (deleted, eviction.get_total_size()))
+        self.stdout.write('deleted %d album tombstones' % eviction.prune_tombstones())
@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from albums import album_import
+
+
+class Command(BaseCommand):
+    help = 'Imports albums from a json lines (one json object per line) or csv file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename')
+        parser.add_argument(
+            '--format', choices=album_import.FORMATS,
+            help='file format, determined by the file extension if not set (.csv for csv, jsonl otherwise)')
+        parser.add_argument('--batch-size', type=int, default=album_import.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        import_format = options['format']
+        if import_format is None:
+            import_format = 'csv' if os.path.splitext(options['filename'])[1].lower() == '.csv' else 'jsonl'
+        if options['batch_size'] < 1:
+            raise CommandError('invalid batch size')
+
+        with open(options['filename'], encoding='utf-8', newline='') as f:
+            if import_format == 'csv':
+                rows = album_import.read_csv(f)
+            else:
+                rows = album_import.read_json_lines(f)
+            rv = album_import.import_albums(rows, batch_size=options['batch_size'])
+
+        for error in rv['errors']:
+            self.stderr.write('line %d: %s%s' % (
+                error['line'], error['field'] + ': ' if error['field'] else '', error['msg']))
+        self.stdout.write('%d albums created, %d albums updated, %d errors' % (
+            rv['created'], rv['updated'], len(rv['errors'])))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from albums import artifacts
+from albums.models import ReportRequest
+
+
+class Command(BaseCommand):
+    help = 'Moves pdf files of report requests stored in the db to the artifact store'
+
+    def handle(self, *args, **options):
+        count = 0
+        ids = list(ReportRequest.objects.filter(pdf_file__isnull=False).values_list('id', flat=True))
+        for report_request_id in ids:
+            # load one pdf file at a time to keep memory usage low
+            pdf_file = ReportRequest.objects.filter(id=report_request_id).values_list('pdf_file', flat=True).first()
+            if pdf_file is None:
+                continue
+            pdf_file_path, pdf_file_size = artifacts.store(bytes(pdf_file))
+            ReportRequest.objects.filter(id=report_request_id).update(
+                pdf_file=None, pdf_file_path=pdf_file_path, pdf_file_size=pdf_file_size)
+            count += 1
+        self.stdout.write('moved %d pdf files to %s' % (count, artifacts.get_artifact_dir()))
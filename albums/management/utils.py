@@ -0,0 +1,28 @@
+import contextlib
+import os
+import tempfile
+
+from django.db import connections
+from django.test.utils import setup_databases, teardown_databases
+
+
+@contextlib.contextmanager
+def temporary_database():
+    """Creates temporary sqlite database files with all migrations applied.
+
+    A temporary database is created for every configured database (except test mirrors),
+    the configured databases are not modified and used again when the context is left.
+    """
+    test_names = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        for alias in connections:
+            test_settings = connections[alias].settings_dict.setdefault('TEST', {})
+            test_names[alias] = test_settings.get('NAME')
+            test_settings['NAME'] = os.path.join(directory, alias + '.sqlite')
+        old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            for alias, test_name in test_names.items():
+                connections[alias].settings_dict['TEST']['NAME'] = test_name
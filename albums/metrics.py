@@ -0,0 +1,200 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+from timeit import default_timer as timer
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))  # 1KB - 64MB
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+# timings of the request currently processed in this thread (or task), set by MetricsMiddleware
+_current = contextvars.ContextVar('albums_request_metrics', default=None)
+
+
+class Histogram:
+    """Histogram in the Prometheus text format, values are kept in memory of the current process."""
+    def __init__(self, name, description, buckets, label_names):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label_names = label_names
+        self.values = dict()  # label values -> [counts per bucket, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * len(self.buckets), 0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.description), '# TYPE %s histogram' % self.name]
+        with self.lock:
+            values = sorted((labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self.values.items())
+        for label_values, (counts, total, count) in values:
+            labels = format_labels(zip(self.label_names, label_values))
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket{%s} %d' % (self.name, join_labels(labels, 'le="%s"' % bucket), cumulative))
+            lines.append('%s_bucket{%s} %d' % (self.name, join_labels(labels, 'le="+Inf"'), count))
+            lines.append('%s_sum%s %s' % (self.name, '{%s}' % labels if labels else '', repr(float(total))))
+            lines.append('%s_count%s %d' % (self.name, '{%s}' % labels if labels else '', count))
+        return lines
+
+
+class RequestMetrics:
+    """Timing breakdown of a single request, phase -> duration in seconds."""
+    def __init__(self):
+        self.timings = dict()
+        self.db_queries = 0
+
+    def add(self, phase, duration):
+        self.timings[phase] = self.timings.get(phase, 0) + duration
+
+
+REQUEST_DURATION = Histogram(
+    'albums_request_duration_seconds', 'Time until the response is returned by the view.',
+    DURATION_BUCKETS, ('view', 'status'))
+RESPONSE_SIZE = Histogram(
+    'albums_response_size_bytes', 'Size of the response content (if known before it is sent).',
+    SIZE_BUCKETS, ('view',))
+DB_QUERIES = Histogram(
+    'albums_request_db_queries', 'Number of database queries per request.', COUNT_BUCKETS, ('view',))
+PHASE_DURATION = Histogram(
+    'albums_phase_duration_seconds',
+    'Time spent per phase: db, json_decode, template_init (reportbro.Report), render (pdf/xlsx).',
+    DURATION_BUCKETS, ('phase',))
+
+HISTOGRAMS = (REQUEST_DURATION, RESPONSE_SIZE, DB_QUERIES, PHASE_DURATION)
+
+
+def format_labels(labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels)
+
+
+def join_labels(*labels):
+    return ','.join(label for label in labels if label)
+
+
+def get_request_metrics():
+    """Returns the metrics of the current request, None if the request is not measured."""
+    return _current.get()
+
+
+def record(phase, duration):
+    """Adds the duration of a phase to the histogram and to the timings of the current request."""
+    PHASE_DURATION.observe(duration, phase)
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.add(phase, duration)
+
+
+@contextlib.contextmanager
+def timed(phase):
+    """Measures the duration of the enclosed block, e.g. with timed('render'): report.generate_pdf()"""
+    start = timer()
+    try:
+        yield
+    finally:
+        record(phase, timer() - start)
+
+
+def _record_query(execute, sql, params, many, context):
+    start = timer()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', timer() - start)
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.db_queries += 1
+
+
+def install_query_wrapper(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def measure_queries(sender, connection, **kwargs):
+    # queries of async views are executed in other threads (sync_to_async) with their own
+    # connections, so every connection measures its queries. The queries are added to the
+    # request of the current context which is copied to the thread executing the query.
+    install_query_wrapper(connection)
+
+
+class MetricsMiddleware:
+    """Measures every request and logs its timing breakdown.
+
+    The breakdown contains the db query count and time and the phases measured with *timed*.
+    The time for sending a streaming response is not included. Works with sync and async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = timer()
+        try:
+            # connections opened before this module was loaded
+            for connection in connections.all(initialized_only=True):
+                install_query_wrapper(connection)
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, request_metrics, timer() - start)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = timer()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, request_metrics, timer() - start)
+        return response
+
+    def finish(self, request, response, request_metrics, duration):
+        view = request.resolver_match.view_name if request.resolver_match else 'unknown'
+        size = None
+        if response.has_header('Content-Length'):
+            size = int(response['Content-Length'])
+        elif not response.streaming:
+            size = len(response.content)
+        REQUEST_DURATION.observe(duration, view, response.status_code)
+        DB_QUERIES.observe(request_metrics.db_queries, view)
+        if size is not None:
+            RESPONSE_SIZE.observe(size, view)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(dict(
+                method=request.method, path=request.path, view=view, status=response.status_code,
+                duration=round(duration, 6), db_queries=request_metrics.db_queries, response_size=size,
+                **{phase: round(value, 6) for phase, value in request_metrics.timings.items()})))
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import admission, metrics as albums_metrics, pdf_cache, previews, row_cache, template_cache, warmup
+from .utils import has_valid_token
+
+DEFAULT_METRICS = {
+    # clients with these ip addresses (REMOTE_ADDR) can read the metrics without login. Empty by default,
+    # behind a reverse proxy on the same host REMOTE_ADDR of all clients would be localhost
+    'ALLOWED_IPS': (),
+    # clients sending the header Authorization: Bearer <TOKEN> can read the metrics without login
+    'TOKEN': None,
+}
+
+
+def get_config():
+    """Returns the metrics settings (ALBUMS_METRICS) merged with the defaults."""
+    config = dict(DEFAULT_METRICS)
+    config.update(getattr(settings, 'ALBUMS_METRICS', {}))
+    return config
+
+
+def is_allowed(request):
+    """Returns True if the metrics may be read: allowed ip address, valid token or logged in staff user."""
+    config = get_config()
+    if request.META.get('REMOTE_ADDR') in config['ALLOWED_IPS'] or has_valid_token(request, config['TOKEN']):
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+def get_counters():
+    """Returns name, description and value of the counters of the report caches."""
+    counters = [
+        ('albums_template_cache_hits_total', 'Report definitions served from the template cache.',
+         template_cache.stats['hits']),
+        ('albums_template_cache_misses_total', 'Report definitions loaded and validated.',
+         template_cache.stats['misses']),
+    ]
+    cache = pdf_cache.get_cache()
+    if cache is not None:
+        for name, value in sorted(cache.stats.items()):
+            counters.append(('albums_pdf_cache_%s_total' % name, 'Album report pdf cache %s.' % name, value))
+    counters.append(('albums_row_cache_hits_total', 'Albums served from the json row cache.', row_cache.stats['hits']))
+    counters.append(('albums_row_cache_misses_total', 'Albums encoded as json.', row_cache.stats['misses']))
+    for name, value in sorted(previews.xlsx_stats.items()):
+        counters.append(('albums_xlsx_prerender_%s_total' % name, 'Preview xlsx files %s.' % name, value))
+    counters.append(('albums_render_admitted_total', 'Report requests which got a render slot.',
+                     admission.stats['admitted']))
+    counters.append(('albums_render_rejected_total', 'Report requests rejected because all render slots were busy.',
+                     admission.stats['rejected']))
+    return counters
+
+
+def get_gauges():
+    """Returns name, description and value of the gauges of the render slots."""
+    slots = admission.get_slots()
+    return [
+        ('albums_render_slots', 'Number of render slots of this process.', slots.size),
+        ('albums_render_slots_used', 'Render slots in use.', slots.used),
+        ('albums_render_queue_depth', 'Report requests waiting for a render slot.', slots.get_queue_depth()),
+    ]
+
+
+def metrics(request):
+    """Returns all metrics of the current process in the Prometheus text format.
+
+    Each server process keeps its own metrics, the values of all processes
+    must be aggregated by the monitoring system. Only available for the clients allowed
+    in ALBUMS_METRICS and for staff users.
+    """
+    if not is_allowed(request):
+        return HttpResponseForbidden('metrics not allowed for this client')
+    lines = []
+    for histogram in albums_metrics.HISTOGRAMS:
+        lines.extend(histogram.expose())
+    for name, description, value in get_counters():
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s counter' % name)
+        lines.append('%s %d' % (name, value))
+    for name, description, value in get_gauges():
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s %d' % (name, value))
+    if warmup.duration is not None:
+        lines.append('# HELP albums_warm_start_duration_seconds Time needed for the warm start of this process.')
+        lines.append('# TYPE albums_warm_start_duration_seconds gauge')
+        lines.append('albums_warm_start_duration_seconds %s' % repr(warmup.duration))
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
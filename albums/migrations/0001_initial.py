@@ -0,0 +1,103 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, unique=True)),
+                ('version', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'data_version',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReportDefinition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_definition', models.TextField()),
+                ('report_type', models.CharField(max_length=30, unique=True)),
+                ('remark', models.TextField(null=True)),
+                ('last_modified_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'report_definition',
+            },
+        ),
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, unique=True)),
+                ('total_size', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'storage_usage',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReportRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=36, unique=True)),
+                ('report_definition', models.TextField()),
+                ('data', models.TextField()),
+                ('is_test_data', models.BooleanField()),
+                ('pdf_file', models.BinaryField(null=True)),
+                ('pdf_file_path', models.CharField(db_index=True, max_length=100, null=True)),
+                ('pdf_file_size', models.IntegerField(null=True)),
+                ('xlsx_file_path', models.CharField(db_index=True, max_length=100, null=True)),
+                ('xlsx_file_size', models.IntegerField(null=True)),
+                ('request_hash', models.CharField(max_length=64, null=True)),
+                ('created_on', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'report_request',
+                'indexes': [models.Index(fields=['request_hash', 'created_on'], name='report_request_hash_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=36, unique=True)),
+                ('status', models.CharField(max_length=10)),
+                ('output_format', models.CharField(max_length=4)),
+                ('filename', models.CharField(max_length=100)),
+                ('result_file', models.BinaryField(null=True)),
+                ('result_file_size', models.IntegerField(null=True)),
+                ('errors', models.TextField(null=True)),
+                ('created_on', models.DateTimeField()),
+                ('finished_on', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'report_job',
+                'indexes': [models.Index(fields=['status', 'created_on'], name='report_job_status_idx'), models.Index(fields=['created_on'], name='report_job_created_on_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Album',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('artist', models.CharField(max_length=100)),
+                ('year', models.IntegerField(null=True)),
+                ('best_of_compilation', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'album',
+                'indexes': [models.Index(fields=['name'], name='album_name_idx'), models.Index(fields=['year', 'name'], name='album_year_name_idx')],
+            },
+        ),
+    ]
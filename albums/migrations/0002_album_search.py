@@ -0,0 +1,56 @@
+# full-text search index of albums (see albums/search.py)
+
+from django.db import migrations
+
+# external content table, only the index is stored and the album table is not duplicated.
+# Prefix indexes for 2 and 3 characters make short prefix queries (typeahead) fast.
+CREATE_SQL = [
+    """CREATE VIRTUAL TABLE album_fts USING fts5(
+        name, artist, content='album', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    # the index is updated by triggers so it is in sync for every write,
+    # including bulk_create, bulk_update and queryset updates
+    """CREATE TRIGGER album_fts_insert AFTER INSERT ON album BEGIN
+        INSERT INTO album_fts(rowid, name, artist) VALUES (new.id, new.name, new.artist);
+    END""",
+    """CREATE TRIGGER album_fts_delete AFTER DELETE ON album BEGIN
+        INSERT INTO album_fts(album_fts, rowid, name, artist) VALUES ('delete', old.id, old.name, old.artist);
+    END""",
+    """CREATE TRIGGER album_fts_update AFTER UPDATE OF name, artist ON album BEGIN
+        INSERT INTO album_fts(album_fts, rowid, name, artist) VALUES ('delete', old.id, old.name, old.artist);
+        INSERT INTO album_fts(rowid, name, artist) VALUES (new.id, new.name, new.artist);
+    END""",
+    # index existing albums
+    "INSERT INTO album_fts(album_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS album_fts_insert',
+    'DROP TRIGGER IF EXISTS album_fts_delete',
+    'DROP TRIGGER IF EXISTS album_fts_update',
+    'DROP TABLE IF EXISTS album_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is only available for sqlite, search is not supported by other databases
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREATE_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index, hints={'model_name': 'album'}),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:50
+
+from django.db import migrations, models
+
+# every added, modified and deleted album gets the next sequence number of the album_changes
+# counter (data_version table), modified albums store it in change_seq and deleted albums
+# are added to album_tombstone. Writers are serialized by sqlite, so a sequence number
+# is never visible before all lower numbers are committed.
+CREATE_SQL = [
+    "UPDATE album SET change_seq = id",
+    """INSERT INTO data_version(name, version) SELECT 'album_changes', coalesce(max(id), 0) FROM album
+        WHERE NOT EXISTS (SELECT 1 FROM data_version WHERE name = 'album_changes')""",
+    """CREATE TRIGGER album_change_insert AFTER INSERT ON album BEGIN
+        INSERT OR IGNORE INTO data_version(name, version) VALUES ('album_changes', 0);
+        UPDATE data_version SET version = version + 1 WHERE name = 'album_changes';
+        UPDATE album SET change_seq = (SELECT version FROM data_version WHERE name = 'album_changes')
+            WHERE id = new.id;
+    END""",
+    """CREATE TRIGGER album_change_update AFTER UPDATE OF name, artist, year, best_of_compilation ON album BEGIN
+        INSERT OR IGNORE INTO data_version(name, version) VALUES ('album_changes', 0);
+        UPDATE data_version SET version = version + 1 WHERE name = 'album_changes';
+        UPDATE album SET change_seq = (SELECT version FROM data_version WHERE name = 'album_changes')
+            WHERE id = new.id;
+    END""",
+    """CREATE TRIGGER album_change_delete AFTER DELETE ON album BEGIN
+        INSERT OR IGNORE INTO data_version(name, version) VALUES ('album_changes', 0);
+        UPDATE data_version SET version = version + 1 WHERE name = 'album_changes';
+        INSERT INTO album_tombstone(album_id, change_seq)
+            VALUES (old.id, (SELECT version FROM data_version WHERE name = 'album_changes'));
+    END""",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS album_change_insert',
+    'DROP TRIGGER IF EXISTS album_change_update',
+    'DROP TRIGGER IF EXISTS album_change_delete',
+    "DELETE FROM data_version WHERE name = 'album_changes'",
+]
+
+
+def get_change_seq_field():
+    field = models.BigIntegerField(default=0, editable=False)
+    field.set_attributes_from_name('change_seq')
+    return field
+
+
+def add_change_seq(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        # django would rebuild the album table to add a column with a default value,
+        # this would drop the triggers of the search index (0002_album_search)
+        schema_editor.execute('ALTER TABLE album ADD COLUMN change_seq bigint NOT NULL DEFAULT 0')
+    else:
+        schema_editor.add_field(apps.get_model('albums', 'Album'), get_change_seq_field())
+
+
+def remove_change_seq(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('ALTER TABLE album DROP COLUMN change_seq')
+    else:
+        schema_editor.remove_field(apps.get_model('albums', 'Album'), get_change_seq_field())
+
+
+def create_change_triggers(apps, schema_editor):
+    # triggers are only supported for sqlite, see 0002_album_search
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREATE_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_change_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0002_album_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('album_id', models.IntegerField()),
+                ('change_seq', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'album_tombstone',
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_change_seq, remove_change_seq, hints={'model_name': 'album'}),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='album',
+                    name='change_seq',
+                    field=models.BigIntegerField(default=0, editable=False),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['change_seq'], name='album_change_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='albumtombstone',
+            index=models.Index(fields=['change_seq'], name='album_tombstone_seq_idx'),
+        ),
+        migrations.RunPython(create_change_triggers, drop_change_triggers, hints={'model_name': 'album'}),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:52
+
+import hashlib
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def compress_report_requests(apps, schema_editor):
+    """Moves report definitions of existing report requests to the definition table and compresses the data."""
+    ReportRequest = apps.get_model('albums', 'ReportRequest')
+    ReportRequestDefinition = apps.get_model('albums', 'ReportRequestDefinition')
+    db_alias = schema_editor.connection.alias
+    definition_ids = dict()
+    for report_request in ReportRequest.objects.using(db_alias).only('id', 'report_definition', 'data').iterator():
+        report_definition = report_request.report_definition.encode('utf-8')
+        definition_hash = hashlib.sha256(report_definition).hexdigest()
+        if definition_hash not in definition_ids:
+            definition_ids[definition_hash] = ReportRequestDefinition.objects.using(db_alias).create(
+                definition_hash=definition_hash, report_definition=zlib.compress(report_definition)).id
+        ReportRequest.objects.using(db_alias).filter(id=report_request.id).update(
+            definition_id=definition_ids[definition_hash],
+            compressed_data=zlib.compress(report_request.data.encode('utf-8')))
+
+
+def decompress_report_requests(apps, schema_editor):
+    ReportRequest = apps.get_model('albums', 'ReportRequest')
+    db_alias = schema_editor.connection.alias
+    for report_request in ReportRequest.objects.using(db_alias).select_related('definition').iterator():
+        ReportRequest.objects.using(db_alias).filter(id=report_request.id).update(
+            report_definition=zlib.decompress(report_request.definition.report_definition).decode('utf-8'),
+            data=zlib.decompress(report_request.compressed_data).decode('utf-8'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0003_album_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportRequestDefinition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('definition_hash', models.CharField(max_length=64, unique=True)),
+                ('report_definition', models.BinaryField()),
+            ],
+            options={
+                'db_table': 'report_request_definition',
+            },
+        ),
+        migrations.AddField(
+            model_name='reportrequest',
+            name='definition',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.PROTECT, to='albums.reportrequestdefinition'),
+        ),
+        migrations.AddField(
+            model_name='reportrequest',
+            name='compressed_data',
+            field=models.BinaryField(null=True),
+        ),
+        # nullable so the fields can be added again (and filled) when the migration is reversed
+        migrations.AlterField(
+            model_name='reportrequest',
+            name='report_definition',
+            field=models.TextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='reportrequest',
+            name='data',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(
+            compress_report_requests, decompress_report_requests, hints={'model_name': 'reportrequest'}),
+        migrations.RemoveField(
+            model_name='reportrequest',
+            name='report_definition',
+        ),
+        migrations.RemoveField(
+            model_name='reportrequest',
+            name='data',
+        ),
+        migrations.RenameField(
+            model_name='reportrequest',
+            old_name='compressed_data',
+            new_name='data',
+        ),
+        migrations.AlterField(
+            model_name='reportrequest',
+            name='data',
+            field=models.BinaryField(),
+        ),
+        migrations.AlterField(
+            model_name='reportrequest',
+            name='definition',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='albums.reportrequestdefinition'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0004_report_request_definition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.IntegerField(unique=True)),
+                ('holder', models.CharField(max_length=36, null=True)),
+                ('acquired_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'render_slot',
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:25
+
+import datetime
+from django.db import migrations, models
+
+# the delete trigger (see 0003_album_changes) sets the time a tombstone is added, old tombstones
+# are deleted after a retention time. Naive local time is stored, same as django does with USE_TZ=False.
+# The trigger is dropped while album_tombstone is rebuilt to add the column, sqlite fails
+# to rename the rebuilt table while a trigger references the dropped table
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS album_change_delete',
+]
+
+CREATE_SQL = [
+    """CREATE TRIGGER album_change_delete AFTER DELETE ON album BEGIN
+        INSERT OR IGNORE INTO data_version(name, version) VALUES ('album_changes', 0);
+        UPDATE data_version SET version = version + 1 WHERE name = 'album_changes';
+        INSERT INTO album_tombstone(album_id, change_seq, deleted_on)
+            VALUES (old.id, (SELECT version FROM data_version WHERE name = 'album_changes'),
+                    strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'));
+    END""",
+]
+
+# trigger created by 0003_album_changes
+CREATE_PREVIOUS_SQL = [
+    """CREATE TRIGGER album_change_delete AFTER DELETE ON album BEGIN
+        INSERT OR IGNORE INTO data_version(name, version) VALUES ('album_changes', 0);
+        UPDATE data_version SET version = version + 1 WHERE name = 'album_changes';
+        INSERT INTO album_tombstone(album_id, change_seq)
+            VALUES (old.id, (SELECT version FROM data_version WHERE name = 'album_changes'));
+    END""",
+]
+
+
+def execute_sqlite(schema_editor, statements):
+    # triggers are only supported for sqlite, see 0002_album_search
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in statements:
+            schema_editor.execute(sql)
+
+
+def drop_delete_trigger(apps, schema_editor):
+    execute_sqlite(schema_editor, DROP_SQL)
+
+
+def create_delete_trigger(apps, schema_editor):
+    execute_sqlite(schema_editor, CREATE_SQL)
+
+
+def create_previous_delete_trigger(apps, schema_editor):
+    execute_sqlite(schema_editor, CREATE_PREVIOUS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0005_render_slot'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_delete_trigger, create_previous_delete_trigger, hints={'model_name': 'album'}),
+        migrations.AddField(
+            model_name='albumtombstone',
+            name='deleted_on',
+            field=models.DateTimeField(default=datetime.datetime.now),
+        ),
+        migrations.AddIndex(
+            model_name='albumtombstone',
+            index=models.Index(fields=['deleted_on'], name='album_tombstone_deleted_idx'),
+        ),
+        migrations.RunPython(create_delete_trigger, drop_delete_trigger, hints={'model_name': 'album'}),
+    ]
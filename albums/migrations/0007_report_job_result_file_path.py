@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:50
+
+from django.db import migrations, models
+
+# the generated file of a report job is stored in the artifact dir instead of the report_job table.
+# Jobs are only kept for a short time (ALBUMS_REPORT_JOBS RETENTION), existing jobs are deleted
+# instead of moving their files
+
+
+def delete_jobs(apps, schema_editor):
+    apps.get_model('albums', 'ReportJob').objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0006_album_tombstone_deleted_on'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_jobs, migrations.RunPython.noop, hints={'model_name': 'reportjob'}),
+        migrations.RemoveField(
+            model_name='reportjob',
+            name='result_file',
+        ),
+        migrations.AddField(
+            model_name='reportjob',
+            name='result_file_path',
+            field=models.CharField(db_index=True, max_length=100, null=True),
+        ),
+    ]
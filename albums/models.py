@@ -1,19 +1,47 @@
+import datetime
+
 from django.db import models
 
 
+# report definitions of report requests, a definition is only stored once for all report
+# requests with an identical definition (e.g. all previews while a report is edited in
+# ReportBro Designer). The definition is stored as zlib compressed json (see previews.py).
+class ReportRequestDefinition(models.Model):
+    # sha256 of the report definition json
+    definition_hash = models.CharField(max_length=64, unique=True)
+    report_definition = models.BinaryField()
+
+    class Meta:
+        db_table = 'report_request_definition'
+
+
 # store report requests for testing, used by ReportBro Designer
 # for preview of pdf and xlsx
 class ReportRequest(models.Model):
-    key = models.CharField(max_length=36)
-    report_definition = models.TextField()
-    data = models.TextField()
+    key = models.CharField(max_length=36, unique=True)
+    definition = models.ForeignKey(ReportRequestDefinition, on_delete=models.PROTECT)
+    # zlib compressed json (see previews.py)
+    data = models.BinaryField()
     is_test_data = models.BooleanField()
+    # generated pdf file is stored in the artifact dir (see artifacts.py),
+    # pdf_file is only set for rows created before the artifact store was introduced
+    # and can be moved to the store with the migrate_report_files command
     pdf_file = models.BinaryField(null=True)
+    pdf_file_path = models.CharField(max_length=100, null=True, db_index=True)
     pdf_file_size = models.IntegerField(null=True)
-    created_on = models.DateTimeField()
+    # xlsx file is rendered in the background after the pdf file was generated
+    xlsx_file_path = models.CharField(max_length=100, null=True, db_index=True)
+    xlsx_file_size = models.IntegerField(null=True)
+    # hash of report definition, data and output format to find identical previews
+    request_hash = models.CharField(max_length=64, null=True)
+    created_on = models.DateTimeField(db_index=True)
 
     class Meta:
         db_table = 'report_request'
+        indexes = [
+            # find the latest preview with a given hash
+            models.Index(fields=['request_hash', 'created_on'], name='report_request_hash_idx'),
+        ]
 
 
 # report definition for our album report which is used for printing
@@ -21,7 +49,7 @@ class ReportRequest(models.Model):
 # in ReportBro Designer it will be stored in this table.
 class ReportDefinition(models.Model):
     report_definition = models.TextField()
-    report_type = models.CharField(max_length=30)
+    report_type = models.CharField(max_length=30, unique=True)
     remark = models.TextField(null=True)
     last_modified_at = models.DateTimeField()
 
@@ -42,9 +70,93 @@ class Album(models.Model):
     artist = models.CharField(max_length=100)
     year = models.IntegerField(null=True)
     best_of_compilation = models.BooleanField(default=False)
+    # sequence number of the last change, set by a db trigger whenever the album is
+    # added or modified (see migration 0003_album_changes), used for delta sync
+    change_seq = models.BigIntegerField(default=0, editable=False)
 
     class Meta:
         db_table = 'album'
+        indexes = [
+            # albums are always sorted by name (and id), optionally filtered by year
+            models.Index(fields=['name'], name='album_name_idx'),
+            models.Index(fields=['year', 'name'], name='album_year_name_idx'),
+            # albums changed after a given change_seq
+            models.Index(fields=['change_seq'], name='album_change_seq_idx'),
+        ]
 
     def __str__(self):
-        return self.name + self.artist
\ No newline at end of file
+        return self.name + self.artist
+
+
+# deleted albums, a row is added by a db trigger whenever an album is deleted
+# so clients syncing changes (see Album.change_seq) can remove the album as well.
+# Tombstones are deleted after a retention time, see eviction.prune_tombstones
+class AlbumTombstone(models.Model):
+    album_id = models.IntegerField()
+    change_seq = models.BigIntegerField()
+    deleted_on = models.DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        db_table = 'album_tombstone'
+        indexes = [
+            models.Index(fields=['change_seq'], name='album_tombstone_seq_idx'),
+            models.Index(fields=['deleted_on'], name='album_tombstone_deleted_idx'),
+        ]
+
+
+# version counters of application data, a counter is incremented whenever
+# the corresponding data is modified (e.g. an album is saved). The version
+# is used as part of cache keys so cached data is never outdated.
+class DataVersion(models.Model):
+    name = models.CharField(max_length=30, unique=True)
+    version = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'data_version'
+
+
+# asynchronous report jobs, the report is rendered in a separate process and the generated
+# file is stored in the artifact dir (see artifacts.py) until the job is deleted
+class ReportJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_FINISHED = 'finished'
+    STATUS_FAILED = 'failed'
+
+    key = models.CharField(max_length=36, unique=True)
+    status = models.CharField(max_length=10)
+    output_format = models.CharField(max_length=4)
+    filename = models.CharField(max_length=100)
+    result_file_path = models.CharField(max_length=100, null=True, db_index=True)
+    result_file_size = models.IntegerField(null=True)
+    errors = models.TextField(null=True)
+    created_on = models.DateTimeField()
+    finished_on = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'report_job'
+        indexes = [
+            # count pending jobs and delete old jobs
+            models.Index(fields=['status', 'created_on'], name='report_job_status_idx'),
+            models.Index(fields=['created_on'], name='report_job_created_on_idx'),
+        ]
+
+
+# running total of the size of stored files, updated whenever a file is
+# added or deleted so the total size is known without a table scan
+class StorageUsage(models.Model):
+    name = models.CharField(max_length=30, unique=True)
+    total_size = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'storage_usage'
+
+
+# render slots shared by all web server processes (ALBUMS_RENDER_POOL SHARED_SLOTS),
+# a slot is taken by setting the holder, see albums.admission
+class RenderSlot(models.Model):
+    slot = models.IntegerField(unique=True)
+    holder = models.CharField(max_length=36, null=True)
+    acquired_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'render_slot'
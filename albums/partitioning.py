@@ -0,0 +1,171 @@
+import copy
+import io
+import json
+
+from django.conf import settings
+
+from . import render_pool, rendering
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+DEFAULT_PARTITIONED_RENDERING = {
+    'ENABLED': False,
+    # reports with less rows are rendered in the web server process as usual
+    'MIN_ROWS': 5000,
+    'CHUNK_SIZE': 2000,
+}
+
+
+def get_config():
+    """Returns the partitioned rendering settings (ALBUMS_PARTITIONED_RENDERING) merged with the defaults."""
+    config = dict(DEFAULT_PARTITIONED_RENDERING)
+    config.update(getattr(settings, 'ALBUMS_PARTITIONED_RENDERING', {}))
+    return config
+
+
+def is_enabled(row_count):
+    config = get_config()
+    return config['ENABLED'] and pypdf is not None and row_count >= config['MIN_ROWS']
+
+
+def get_partition_definitions(report_definition, parameter):
+    """Returns the report definitions for the first, middle and last part of a partitioned report.
+
+    The rows of *parameter* must be shown in a table of the content band. Elements above the table
+    are only printed in the first part, elements below the table only in the last part.
+    Returns None if the report cannot be partitioned, e.g. because the table is inside a frame
+    or the page header/footer is not printed on the first page.
+    """
+    document_properties = report_definition.get('documentProperties') or dict()
+    if document_properties.get('headerDisplay') == 'not_on_first_page' or\
+            document_properties.get('footerDisplay') == 'not_on_first_page':
+        # the layout of the first page of each part would differ from the layout of the whole report
+        return None
+    tables = [doc_element for doc_element in report_definition.get('docElements') or []
+              if doc_element.get('elementType') == 'table' and doc_element.get('containerId') == '0_content' and
+              doc_element.get('dataSource', '').strip() == '${%s}' % parameter]
+    if len(tables) != 1:
+        return None
+    table_id = tables[0].get('id')
+    table_y = int(tables[0].get('y') or 0)
+
+    def create_definition(before_table, after_table):
+        definition = copy.deepcopy(report_definition)
+        doc_elements = []
+        for doc_element in definition['docElements']:
+            if doc_element.get('id') == table_id:
+                if not before_table:
+                    doc_element['y'] = 0
+                    # the table header is printed in the first part only unless it is repeated on each page
+                    if not (doc_element.get('headerData') or dict()).get('repeatHeader'):
+                        doc_element['header'] = False
+            elif doc_element.get('containerId') == '0_content':
+                y = int(doc_element.get('y') or 0)
+                if y < table_y and not before_table or y > table_y and not after_table:
+                    continue
+                if not before_table:
+                    doc_element['y'] = y - table_y
+            doc_elements.append(doc_element)
+        definition['docElements'] = doc_elements
+        return definition
+
+    return dict(
+        table_id=int(table_id), first=create_definition(True, False), middle=create_definition(False, False),
+        last=create_definition(False, True))
+
+
+def get_chunk_sizes(row_count, chunk_size, first_page_rows, page_rows):
+    """Returns the number of rows of each chunk, every chunk except the last one ends with a full page.
+
+    *first_page_rows* is the number of rows printed on the first page, *page_rows* the number of rows
+    printed on each following page (both None if unknown). Chunks contain at most *chunk_size* rows
+    unless a single page contains more rows.
+    """
+    if not first_page_rows or not page_rows:
+        return [min(chunk_size, row_count - i) for i in range(0, row_count, chunk_size)]
+    chunk_sizes = [first_page_rows + page_rows * max(0, (chunk_size - first_page_rows) // page_rows)]
+    middle_chunk_size = page_rows * max(1, chunk_size // page_rows)
+    while sum(chunk_sizes) < row_count:
+        chunk_sizes.append(min(middle_chunk_size, row_count - sum(chunk_sizes)))
+    return chunk_sizes
+
+
+def render_pdf(report_definition, data, parameter, additional_fonts=None):
+    """Renders the report in parallel by splitting the rows of *parameter* into chunks.
+
+    Each chunk is rendered in a worker process of the render pool and the resulting pdf files are merged.
+    Every chunk starts on a new page, so the rows are split at page breaks: the first chunk of rows is
+    rendered first (as first part and as middle part) to get the number of rows printed on the first
+    page and on the following pages. This assumes all table rows have the same height, otherwise
+    a chunk can end with a page which is not filled completely. Page numbers and page count are
+    correct for the whole document, in case the report uses page numbers all chunks are rendered
+    twice, the first time to get the number of pages of each chunk.
+    The render slot for the report must be acquired by the caller (see admission.render_slot).
+
+    Returns a dict with either *file* or *errors* set (same as rendering.render_report).
+    """
+    config = get_config()
+    rows = data[parameter]
+    chunk_size = config['CHUNK_SIZE']
+    partition_definitions = None
+    if len(rows) > chunk_size:
+        partition_definitions = get_partition_definitions(report_definition, parameter)
+    executor = render_pool.get_executor()
+
+    def render_report():
+        return executor.submit(
+            rendering.render_report, report_definition, data, False, 'pdf', additional_fonts).result()
+
+    if partition_definitions is None:
+        return render_report()
+
+    def render_chunks(definitions, chunk_data, page_offsets, page_count, table_id=None):
+        results = list(executor.map(
+            rendering.render_partition, definitions, chunk_data, [False] * len(definitions), page_offsets,
+            [page_count] * len(definitions), [additional_fonts] * len(definitions), [table_id] * len(definitions)))
+        return next((rv for rv in results if 'errors' in rv), None), results
+
+    # the first rows are rendered as first and as middle part to get the number of rows per page,
+    # the number of rows on the last page of a part is not used (the page is not filled completely in general)
+    sample_data = dict(data, **{parameter: rows[:chunk_size]})
+    error, results = render_chunks(
+        [partition_definitions['first'], partition_definitions['middle']], [sample_data] * 2, [0, 0], None,
+        partition_definitions['table_id'])
+    if error:
+        return error
+    first_page_rows, page_rows = [rv['page_rows'][0] if len(rv['page_rows']) > 1 else None for rv in results]
+    chunk_sizes = get_chunk_sizes(len(rows), chunk_size, first_page_rows, page_rows)
+    if len(chunk_sizes) == 1:
+        return render_report()
+
+    chunk_data = []
+    start = 0
+    for size in chunk_sizes:
+        chunk_data.append(dict(data, **{parameter: rows[start:start + size]}))
+        start += size
+    definitions = [partition_definitions['first']] +\
+        [partition_definitions['middle']] * (len(chunk_data) - 2) + [partition_definitions['last']]
+    error, results = render_chunks(definitions, chunk_data, [0] * len(chunk_data), None)
+    if error:
+        return error
+
+    doc_elements = json.dumps(report_definition.get('docElements'))
+    if 'page_number' in doc_elements or 'page_count' in doc_elements:
+        page_offsets = []
+        page_count = 0
+        for rv in results:
+            page_offsets.append(page_count)
+            page_count += rv['page_count']
+        error, results = render_chunks(definitions, chunk_data, page_offsets, page_count)
+        if error:
+            return error
+
+    writer = pypdf.PdfWriter()
+    for rv in results:
+        writer.append(pypdf.PdfReader(io.BytesIO(rv['file'])))
+    output = io.BytesIO()
+    writer.write(output)
+    return dict(file=output.getvalue())
@@ -0,0 +1,157 @@
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+DEFAULT_PDF_CACHE = {
+    'BACKEND': 'albums.pdf_cache.LocMemBackend',
+    'OPTIONS': {'max_size': 100 * 1024 * 1024},
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class LocMemBackend:
+    """Keeps rendered files in memory of the current process.
+
+    Entries are evicted in least recently used order as soon as the total size
+    of all cached files exceeds *max_size* bytes.
+    """
+    def __init__(self, max_size=100 * 1024 * 1024):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.total_size = 0
+        self.stats = dict(hits=0, misses=0, evictions=0)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_size -= len(previous)
+            self.entries[key] = value
+            self.total_size += len(value)
+            while self.total_size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_size -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+
+
+class FileSystemBackend:
+    """Stores rendered files in a directory so the cache is shared by all processes.
+
+    The modification time of a file is updated whenever it is read, the files
+    with the oldest modification time are deleted as soon as the total size
+    of the directory exceeds *max_size* bytes.
+    """
+    def __init__(self, directory=None, max_size=500 * 1024 * 1024):
+        self.directory = directory or os.path.join(settings.BASE_DIR, 'pdf_cache')
+        self.max_size = max_size
+        self.stats = dict(hits=0, misses=0, evictions=0)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_filename(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.bin')
+
+    def get(self, key):
+        filename = self.get_filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                value = f.read()
+            os.utime(filename)
+        except FileNotFoundError:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+        # write to a temporary file first so other processes never read a partially written file
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_filename, self.get_filename(key))
+        self.evict()
+
+    def evict(self):
+        files = []
+        total_size = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.bin'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                self.stats['evictions'] += 1
+            except FileNotFoundError:
+                pass  # already evicted by another process
+            total_size -= size
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.bin'):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+
+def get_cache():
+    """Returns the configured pdf cache backend or None if the cache is disabled.
+
+    The backend is configured with the ALBUMS_PDF_CACHE setting.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = getattr(settings, 'ALBUMS_PDF_CACHE', DEFAULT_PDF_CACHE)
+                if not config or not config.get('BACKEND'):
+                    return None
+                _cache = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _cache
+
+
+def get_key(*parts):
+    return ':'.join(str(part) for part in parts)
+
+
+@receiver(setting_changed)
+def reset_cache(setting, **kwargs):
+    """Creates the cache backend again when the settings are changed (e.g. by override_settings)."""
+    global _cache
+    if setting == 'ALBUMS_PDF_CACHE':
+        _cache = None
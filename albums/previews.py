@@ -0,0 +1,206 @@
+import concurrent.futures
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+
+from . import admission, artifacts, eviction, render_pool, rendering
+from .models import ReportRequest, ReportRequestDefinition
+from .utils import json_default
+
+logger = logging.getLogger(__name__)
+
+# identical preview requests which are currently rendered in this process,
+# request hash -> event which is set when rendering is finished
+_rendering = dict()
+_rendering_lock = threading.Lock()
+
+# max. time in seconds to wait for an identical preview request to finish
+RENDER_WAIT_TIMEOUT = 60
+
+# max. number of xlsx files rendered or waiting to be rendered in the background,
+# no further xlsx files are rendered in advance until the queue is shorter again
+MAX_XLSX_QUEUE = 10
+
+# xlsx files rendered in the background, report request key -> future
+_xlsx_futures = dict()
+_xlsx_lock = threading.Lock()
+_xlsx_executor = None
+
+# counters to check if rendering xlsx files in advance pays off:
+# rendered: xlsx files rendered in the background, failed: background rendering failed,
+# skipped: not rendered in the background because all render slots were busy or too many xlsx
+# files were queued, cancelled: download was requested before background rendering was started,
+# used: xlsx downloads served from a file rendered in the background (waited: download had
+# to wait until background rendering was finished), missed: xlsx rendered during download
+xlsx_stats = dict(rendered=0, failed=0, skipped=0, cancelled=0, used=0, waited=0, missed=0)
+
+
+def get_request_hash(report_definition, data, is_test_data, output_format):
+    """Returns a hash of all values which influence the generated preview.
+
+    Must be called before a reportbro.Report instance is created because the
+    report definition is modified when it is converted to the current version.
+    """
+    content = json.dumps(
+        [report_definition, data, is_test_data, output_format],
+        sort_keys=True, separators=(',', ':'), default=json_default)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def compress_json(value):
+    """Compresses a json string for storing it in the db (report definition and data of a report request)."""
+    return zlib.compress(value.encode('utf-8'))
+
+
+def decompress_json(value):
+    return zlib.decompress(value).decode('utf-8')
+
+
+def get_definition_id(report_definition):
+    """Returns the id of the stored report definition (json string), it is added if it is not stored yet."""
+    definition_hash = hashlib.sha256(report_definition.encode('utf-8')).hexdigest()
+    definition, _ = ReportRequestDefinition.objects.get_or_create(
+        definition_hash=definition_hash,
+        defaults=dict(report_definition=lambda: compress_json(report_definition)))
+    return definition.id
+
+
+def add_report_request(key, report_definition, data, is_test_data, **values):
+    """Adds a report request, report definition and data must be passed as json strings.
+
+    The report definition is only stored once for all report requests with the same
+    definition (see ReportRequestDefinition), data is stored compressed.
+    """
+    values.update(key=key, data=compress_json(data), is_test_data=is_test_data)
+    try:
+        ReportRequest.objects.create(definition_id=get_definition_id(report_definition), **values)
+    except IntegrityError:
+        # the definition was deleted in the meantime by the eviction because it was not referenced anymore
+        ReportRequest.objects.create(definition_id=get_definition_id(report_definition), **values)
+
+
+def find_preview(request_hash):
+    """Returns the key of an existing preview for the given request hash or None.
+
+    The creation date of the preview is updated so it is not evicted right away.
+    """
+    row = ReportRequest.objects.filter(request_hash=request_hash).exclude(pdf_file_path=None).\
+        order_by('-created_on').values_list('id', 'key', 'pdf_file_path').first()
+    if row is None or not os.path.exists(artifacts.get_full_path(row[2])):
+        return None
+    ReportRequest.objects.filter(id=row[0]).update(created_on=datetime.datetime.now())
+    return row[1]
+
+
+@contextlib.contextmanager
+def render_lock(request_hash):
+    """Makes sure identical preview requests are not rendered at the same time in this process.
+
+    Yields False if the caller acquired the lock and must render the preview. Yields True
+    if an identical request was rendered while waiting, the caller should then look
+    up the existing preview (and only render it if it is not available).
+    """
+    with _rendering_lock:
+        event = _rendering.get(request_hash)
+        if event is None:
+            event = _rendering[request_hash] = threading.Event()
+            acquired = True
+        else:
+            acquired = False
+
+    if not acquired:
+        event.wait(RENDER_WAIT_TIMEOUT)
+        yield True
+        return
+
+    try:
+        yield False
+    finally:
+        with _rendering_lock:
+            _rendering.pop(request_hash, None)
+        event.set()
+
+
+def prerender_xlsx(key, report_definition, data, is_test_data, additional_fonts):
+    """Renders the xlsx file of a preview in a background thread (by a worker process of the render pool).
+
+    Report definition and data must be passed as json strings (as stored in the
+    report_request table) because the original values are modified by reportbro.
+    Does nothing if ALBUMS_PREVIEW_PRERENDER_XLSX is disabled.
+    """
+    global _xlsx_executor
+    if not getattr(settings, 'ALBUMS_PREVIEW_PRERENDER_XLSX', True):
+        return
+    with _xlsx_lock:
+        if len(_xlsx_futures) >= MAX_XLSX_QUEUE:
+            # background rendering does not keep up, the xlsx file is rendered when it is requested
+            xlsx_stats['skipped'] += 1
+            return
+        if _xlsx_executor is None:
+            _xlsx_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='xlsx-preview')
+        _xlsx_futures[key] = _xlsx_executor.submit(
+            _render_xlsx, key, report_definition, data, is_test_data, additional_fonts)
+
+
+def wait_for_xlsx(key):
+    """Waits until the xlsx file of the preview is rendered in case it is currently rendered in the background.
+
+    If background rendering was not started yet it is cancelled, the caller renders the xlsx file
+    right away instead of waiting for other xlsx files queued before.
+    Returns True if the xlsx file was rendered in the background.
+    """
+    with _xlsx_lock:
+        future = _xlsx_futures.get(key)
+        if future is None:
+            return False
+        if future.cancel():
+            # _render_xlsx is never called for the cancelled future
+            del _xlsx_futures[key]
+            xlsx_stats['cancelled'] += 1
+            return False
+    if not future.done():
+        xlsx_stats['waited'] += 1
+    try:
+        return future.result(RENDER_WAIT_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        return False
+
+
+def _render_xlsx(key, report_definition, data, is_test_data, additional_fonts):
+    try:
+        close_old_connections()
+        # does not wait for a render slot, so report requests are never queued or rejected because of prerendering
+        rv = render_pool.render(
+            rendering.render_report, json.loads(report_definition), json.loads(data), is_test_data, 'xlsx',
+            additional_fonts, wait=False)
+        if 'file' not in rv:
+            xlsx_stats['failed'] += 1
+            return False
+        xlsx_file_path, xlsx_file_size = artifacts.store(rv['file'])
+        if ReportRequest.objects.filter(key=key).update(
+                xlsx_file_path=xlsx_file_path, xlsx_file_size=xlsx_file_size) == 0:
+            # preview was deleted in the meantime
+            artifacts.delete(eviction.get_unreferenced_paths([xlsx_file_path]))
+            return False
+        eviction.add_usage(xlsx_file_size)
+        xlsx_stats['rendered'] += 1
+        return True
+    except admission.RenderBusyError:
+        # all render slots are busy, the xlsx file is rendered when it is requested
+        xlsx_stats['skipped'] += 1
+        return False
+    except Exception:
+        xlsx_stats['failed'] += 1
+        logger.exception('rendering xlsx preview failed')
+        return False
+    finally:
+        with _xlsx_lock:
+            _xlsx_futures.pop(key, None)
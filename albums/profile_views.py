@@ -0,0 +1,29 @@
+import os
+
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+
+from . import profiling
+
+
+@staff_member_required
+def index(request):
+    """Lists the latest request profiles with links to download them, see albums.profiling."""
+    context = admin.site.each_context(request)
+    context['title'] = 'Request profiles'
+    context['enabled'] = profiling.get_config()['ENABLED']
+    context['profiles'] = profiling.get_profiles()
+    return render(request, 'albums/profile/index.html', context)
+
+
+@staff_member_required
+def download(request, profile_id, profile_format):
+    """Returns a stored profile in pstats or collapsed stack format."""
+    path = profiling.get_profile_path(profile_id, profile_format)
+    if path is None or not os.path.isfile(path):
+        raise Http404('profile not found')
+    return FileResponse(
+        open(path, 'rb'), as_attachment=True, filename=os.path.basename(path),
+        content_type=profiling.FORMATS[profile_format])
@@ -0,0 +1,75 @@
+# profiler used for requests (see albums.profiling) and in worker processes of the render pool,
+# this module must not depend on django. The code is profiled with cProfile (call counts and
+# times, pstats format) and sampled periodically to record whole call stacks (collapsed format).
+import cProfile
+import collections
+import os
+import sys
+import threading
+
+
+class StatsData:
+    """Holds the data of a pstats.Stats object so it can be transferred from a worker process."""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        # called by pstats.Stats when the data is loaded
+        pass
+
+
+class Profiler:
+    """Profiles the code executed by the current thread while the profiler is active (with statement)."""
+    def __init__(self, sample_interval):
+        self.sample_interval = sample_interval
+        self.profile = cProfile.Profile()
+        self.stacks = collections.Counter()  # collapsed call stack -> number of samples
+        self.thread_id = None
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.sampler = threading.Thread(target=self.sample, name='albums-profiler', daemon=True)
+        self.sampler.start()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self.stopped.set()
+        self.sampler.join()
+
+    def sample(self):
+        while not self.stopped.wait(self.sample_interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[get_stack(frame)] += 1
+
+    def get_stats(self):
+        """Returns the cProfile data, use pstats.Stats(StatsData(data)) to load it."""
+        self.profile.create_stats()
+        return self.profile.stats
+
+
+def get_stack(frame):
+    """Returns the call stack of the frame in collapsed format (outermost frame first, separated by ';')."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def format_collapsed(stacks):
+    """Returns the sampled stacks in collapsed format (one stack and its sample count per line).
+
+    The format can be loaded by flamegraph.pl or speedscope.
+    """
+    return ''.join('%s %d\n' % (stack, count) for stack, count in sorted(stacks.items()))
+
+
+def merge_stats(stats, data):
+    """Adds cProfile data (e.g. of a worker process) to the pstats.Stats object."""
+    stats.add(StatsData(data))
@@ -0,0 +1,248 @@
+# on-demand profiling of single requests, e.g. to find out why a specific report is slow in production.
+# A request is profiled if profiling is enabled (ALBUMS_PROFILING) and the request contains the
+# query parameter *profile* or the header X-Albums-Profile, set to 1 for a logged in staff user or
+# to the configured token. The profile is stored in pstats and collapsed stack format, reports
+# rendered by the render pool for the request are profiled in the worker process as well.
+# Under wsgi django executes async views in an event loop in another thread, views decorated with
+# *profile_async_view* are profiled in this thread as well.
+import collections
+import contextvars
+import datetime
+import functools
+import glob
+import hmac
+import json
+import os
+import pstats
+import re
+import threading
+import uuid
+from timeit import default_timer as timer
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from . import metrics
+from .profiler import Profiler, StatsData, format_collapsed, merge_stats
+
+DEFAULT_PROFILING = {
+    'ENABLED': False,
+    # requests with this value in the profile parameter/header are profiled without login
+    'TOKEN': None,
+    # directory where the profiles are stored
+    'DIR': os.path.join(settings.BASE_DIR, 'profiles'),
+    # only the latest profiles are kept
+    'MAX_PROFILES': 50,
+    # interval in seconds to sample the call stack
+    'SAMPLE_INTERVAL': 0.005,
+}
+
+QUERY_PARAMETER = 'profile'
+HEADER = 'HTTP_X_ALBUMS_PROFILE'
+# response header containing the id of the stored profile
+RESPONSE_HEADER = 'X-Albums-Profile-Id'
+# file extension (and download format) -> content type
+FORMATS = {
+    'pstats': 'application/octet-stream',
+    'collapsed': 'text/plain; charset=utf-8',
+}
+
+_id_re = re.compile(r'^[0-9a-f]{32}$')
+# profile of the request currently processed in this thread (or task)
+_current = contextvars.ContextVar('albums_request_profile', default=None)
+# cProfile can only profile one request at a time, further requests are not profiled meanwhile
+_lock = threading.Lock()
+
+
+class RequestProfile:
+    def __init__(self, sample_interval):
+        self.id = uuid.uuid4().hex
+        self.sample_interval = sample_interval
+        self.profiler = Profiler(sample_interval)
+        # thread profiled by *profiler* (where the request is processed)
+        self.thread_id = threading.get_ident()
+        self.thread_stats = []
+        self.thread_stacks = collections.Counter()
+        self.worker_stats = []
+        self.worker_stacks = collections.Counter()
+
+    def add_thread_profile(self, profiler):
+        """Adds the profile of code executed for the request in another thread (see *profile_async_view*)."""
+        self.thread_stats.append(profiler.get_stats())
+        self.thread_stacks.update(profiler.stacks)
+
+    def add_worker_profile(self, stats, stacks):
+        """Adds the profile of a report rendered in a worker process (rendering.profile)."""
+        self.worker_stats.append(stats)
+        for stack, count in stacks.items():
+            self.worker_stacks['render_pool;' + stack] += count
+
+
+def get_config():
+    """Returns the profiling settings (ALBUMS_PROFILING) merged with the defaults."""
+    config = dict(DEFAULT_PROFILING)
+    config.update(getattr(settings, 'ALBUMS_PROFILING', {}))
+    return config
+
+
+def get_current():
+    """Returns the profile of the current request, None if the request is not profiled."""
+    return _current.get()
+
+
+def get_requested_value(request):
+    return request.GET.get(QUERY_PARAMETER) or request.META.get(HEADER)
+
+
+def is_allowed(request, value):
+    """Returns True if the request may be profiled, this might query the db (session and user)."""
+    token = get_config()['TOKEN']
+    if token and hmac.compare_digest(value.encode('utf-8'), token.encode('utf-8')):
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+def profile_async_view(view):
+    """Profiles the async view in the thread executing it if this is not the thread profiled for the request.
+
+    Under wsgi django runs async views with async_to_sync, the view is executed in an event loop in
+    another thread while the request thread only executes the db queries (thread sensitive sync_to_async).
+    Under asgi the view is executed in the profiled event loop thread anyway.
+    """
+    @functools.wraps(view)
+    async def inner(request, *args, **kwargs):
+        profile = get_current()  # the context of the request is copied to the event loop thread
+        if profile is None or profile.thread_id == threading.get_ident():
+            return await view(request, *args, **kwargs)
+        profiler = Profiler(profile.sample_interval)
+        try:
+            with profiler:
+                return await view(request, *args, **kwargs)
+        finally:
+            profile.add_thread_profile(profiler)
+    return inner
+
+
+def save_profile(profile, request, response, duration):
+    """Stores the profile in pstats and collapsed stack format.
+
+    A json file contains the request data and its timing breakdown (see metrics.RequestMetrics).
+    """
+    config = get_config()
+    directory = config['DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, profile.id)
+
+    stats = pstats.Stats(StatsData(profile.profiler.get_stats()))
+    for data in profile.thread_stats + profile.worker_stats:
+        merge_stats(stats, data)
+    stats.dump_stats(path + '.pstats')
+    with open(path + '.collapsed', 'w', encoding='utf-8') as f:
+        f.write(format_collapsed(profile.profiler.stacks + profile.thread_stacks + profile.worker_stacks))
+
+    request_metrics = metrics.get_request_metrics()
+    info = dict(
+        id=profile.id, created_on=datetime.datetime.now().isoformat(timespec='seconds'),
+        method=request.method, path=request.get_full_path(),
+        view=request.resolver_match.view_name if request.resolver_match else None,
+        status=response.status_code, duration=round(duration, 6),
+        db_queries=request_metrics.db_queries if request_metrics else None,
+        timings={phase: round(value, 6) for phase, value in request_metrics.timings.items()}
+        if request_metrics else dict())
+    # the json file is written last, a profile is listed once it is complete
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    delete_old_profiles(directory, config['MAX_PROFILES'])
+
+
+def delete_old_profiles(directory, max_profiles):
+    paths = sorted(glob.glob(os.path.join(directory, '*.json')), key=os.path.getmtime, reverse=True)
+    for path in paths[max_profiles:]:
+        base_path = path[:-len('.json')]
+        for extension in ('.json',) + tuple('.' + profile_format for profile_format in FORMATS):
+            try:
+                os.remove(base_path + extension)
+            except FileNotFoundError:
+                pass
+
+
+def get_profiles():
+    """Returns the data of the stored profiles (see *save_profile*), latest profile first."""
+    profiles = []
+    for path in glob.glob(os.path.join(get_config()['DIR'], '*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass  # deleted or not completely written yet
+    profiles.sort(key=lambda profile: profile['created_on'], reverse=True)
+    return profiles
+
+
+def get_profile_path(profile_id, profile_format):
+    """Returns the path of the stored profile file, None for an invalid id or format."""
+    if not _id_re.match(profile_id) or profile_format not in FORMATS:
+        return None
+    return os.path.join(get_config()['DIR'], profile_id + '.' + profile_format)
+
+
+class ProfilingMiddleware:
+    """Profiles a request if requested and allowed, the id of the profile is returned in a response header.
+
+    Must be added after AuthenticationMiddleware. Under asgi everything executed in the event loop
+    thread while the request is processed is profiled (including other requests processed
+    concurrently), code executed in other threads (e.g. db queries) is not profiled, the db time
+    is part of the timing breakdown stored with the profile. Under wsgi the request thread is
+    profiled, async views must be decorated with *profile_async_view* to profile the event loop
+    thread executing them. The time for sending a streaming response is not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        value = get_requested_value(request)
+        if not value or not get_config()['ENABLED'] or not is_allowed(request, value) or\
+                not _lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profile = RequestProfile(get_config()['SAMPLE_INTERVAL'])
+            token = _current.set(profile)
+            start = timer()
+            try:
+                with profile.profiler:
+                    response = self.get_response(request)
+            finally:
+                _current.reset(token)
+            save_profile(profile, request, response, timer() - start)
+        finally:
+            _lock.release()
+        response[RESPONSE_HEADER] = profile.id
+        return response
+
+    async def __acall__(self, request):
+        value = get_requested_value(request)
+        if not value or not get_config()['ENABLED'] or not await sync_to_async(is_allowed)(request, value) or\
+                not _lock.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            profile = RequestProfile(get_config()['SAMPLE_INTERVAL'])
+            token = _current.set(profile)
+            start = timer()
+            try:
+                with profile.profiler:
+                    response = await self.get_response(request)
+            finally:
+                _current.reset(token)
+            await sync_to_async(save_profile, thread_sensitive=False)(profile, request, response, timer() - start)
+        finally:
+            _lock.release()
+        response[RESPONSE_HEADER] = profile.id
+        return response
@@ -0,0 +1,101 @@
+import asyncio
+import atexit
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import threading
+
+from . import admission, profiling, rendering
+
+_executor = None
+_executor_lock = threading.Lock()
+# True if the worker processes were started in advance (see *start*)
+_started = False
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                config = admission.get_config()
+                # spawn worker processes instead of forking the (multi-threaded) web server process,
+                # the workers only import the rendering module and never access the db
+                _executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=config['POOL_SIZE'], mp_context=multiprocessing.get_context('spawn'),
+                    initializer=rendering.warm_up)
+                # stop the worker processes before the interpreter shuts down
+                atexit.register(_executor.shutdown)
+    return _executor
+
+
+def start(wait=True):
+    """Starts all worker processes of the render pool, otherwise they are started by the first reports.
+
+    Each worker process imports reportbro and renders an empty pdf when it is started (rendering.warm_up),
+    if *wait* is set this returns once all worker processes are ready.
+    """
+    global _started
+    executor = get_executor()
+    pool_size = admission.get_config()['POOL_SIZE'] or os.cpu_count() or 1
+    # the executor starts a new worker process for every job submitted while no worker process is idle
+    futures = [executor.submit(os.getpid) for i in range(pool_size)]
+    _started = True
+    if wait:
+        concurrent.futures.wait(futures)
+
+
+def shutdown():
+    """Stops all worker processes and waits until they are terminated, they are started again by the next report."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def _shutdown_before_fork():
+    # worker processes cannot be used by a forked process (e.g. gunicorn --preload forks the web server
+    # workers after the warm start), they are stopped and started again in the forked process
+    shutdown()
+
+
+def _start_after_fork():
+    if _started:
+        start(wait=False)
+
+
+os.register_at_fork(before=_shutdown_before_fork, after_in_child=_start_after_fork)
+
+
+def render(func, *args, wait=True):
+    """Calls *func* (a function of the rendering module) in a worker process and returns its result.
+
+    Blocks until the result is available, so reports are rendered in parallel
+    on all cpus no matter how many threads the web server uses.
+    If the current request is profiled (see albums.profiling) the function is profiled in the worker process.
+    Raises admission.RenderBusyError if no render slot is available (see admission.render_slot for *wait*).
+    """
+    executor = get_executor()
+    profile = profiling.get_current()
+    with admission.render_slot(wait):
+        if profile is not None:
+            rv, stats, stacks = executor.submit(rendering.profile, profile.sample_interval, func, *args).result()
+            profile.add_worker_profile(stats, stacks)
+            return rv
+        return executor.submit(func, *args).result()
+
+
+async def arender(func, *args):
+    """Same as *render* but does not block the event loop (and no thread) while the report is rendered."""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    profile = profiling.get_current()
+    async with admission.arender_slot():
+        if profile is not None:
+            rv, stats, stacks = await loop.run_in_executor(
+                executor, functools.partial(rendering.profile, profile.sample_interval, func, *args))
+            profile.add_worker_profile(stats, stacks)
+            return rv
+        return await loop.run_in_executor(executor, functools.partial(func, *args))
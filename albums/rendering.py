@@ -0,0 +1,99 @@
+# functions in this module are executed in worker processes and therefore
+# must not depend on django, all arguments and return values must be picklable.
+# reportbro is imported on first use so importing this module is cheap
+
+CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# report without any elements, rendered by *warm_up*
+EMPTY_REPORT_DEFINITION = dict(
+    docElements=[], parameters=[], styles=[], version=4,
+    documentProperties=dict(pageFormat='A4', orientation='portrait', patternLocale='en'))
+
+
+def warm_up():
+    """Imports reportbro and renders an empty pdf, called when a worker process of the render pool is started.
+
+    This way the first report rendered by a worker process is not slower than the following ones.
+    """
+    try:
+        from reportbro import Report
+
+        Report(EMPTY_REPORT_DEFINITION, dict()).generate_pdf()
+    except Exception:
+        # an exception in the initializer breaks the whole pool, the error is reported
+        # once a report is rendered instead
+        pass
+
+
+def render_report(report_definition, data, is_test_data, output_format, additional_fonts=None):
+    """Generates a pdf or xlsx file and returns a dict with either *file* or *errors* set.
+
+    Errors are returned instead of raising a ReportBroError because the exception
+    cannot be transferred from a worker process.
+    """
+    from reportbro import Report, ReportBroError
+
+    try:
+        report = Report(report_definition, data, is_test_data, additional_fonts=additional_fonts)
+        if report.errors:
+            return dict(errors=[dict(error) for error in report.errors])
+        if output_format == 'pdf':
+            return dict(file=bytes(report.generate_pdf()))
+        return dict(file=bytes(report.generate_xlsx()))
+    except ReportBroError as err:
+        return dict(errors=[dict(err.error)])
+
+
+def render_partition(report_definition, data, is_test_data, page_offset=0, page_count=None, additional_fonts=None,
+                     table_id=None):
+    """Generates the pdf file for a part of a report, returns a dict with *file* and *page_count* or *errors*.
+
+    Pages are numbered starting after *page_offset*. If *page_count* is set it is used as total
+    number of pages instead of the number of pages of this part, this way page numbers are
+    correct once all parts are merged into one document. If *table_id* is set the number of
+    rows of this table printed on each page is returned as *page_rows*.
+    """
+    from reportbro import Report, ReportBroError
+
+    try:
+        report = Report(report_definition, data, is_test_data, additional_fonts=additional_fonts)
+        if report.errors:
+            return dict(errors=[dict(error) for error in report.errors])
+        # reportbro keeps the current page number and the page count in the data of the report context,
+        # the page count is set by the renderer once all pages are laid out
+        context = report.context
+        context.root_data['page_number'] = page_offset
+        if page_count is not None:
+            context.set_page_count = lambda _: context.root_data.__setitem__('page_count', page_count)
+        page_rows = []
+        if table_id is not None:
+            # the table creates one render element for each page it is printed on
+            table = next(doc_element for doc_element in report.content.doc_elements if doc_element.id == table_id)
+            get_next_render_element = table.get_next_render_element
+
+            def get_page_render_element(*args, **kwargs):
+                row_index = table.row_index
+                rv = get_next_render_element(*args, **kwargs)
+                if table.row_index > row_index:
+                    page_rows.append(table.row_index - row_index)
+                return rv
+            table.get_next_render_element = get_page_render_element
+        pdf_file = bytes(report.generate_pdf())
+        return dict(file=pdf_file, page_count=context.get_page_number() - page_offset, page_rows=page_rows)
+    except ReportBroError as err:
+        return dict(errors=[dict(err.error)])
+
+
+def profile(sample_interval, func, *args):
+    """Calls *func* (a function of this module) with a profiler, see albums.profiler.
+
+    Returns the result of the function, the cProfile data and the sampled call stacks.
+    """
+    from .profiler import Profiler
+
+    with Profiler(sample_interval) as profiler:
+        rv = func(*args)
+    return rv, profiler.get_stats(), dict(profiler.stacks)
@@ -1,21 +1,20 @@
 import datetime
 import json
+import os
 import uuid
 
-from django.db.models import Sum
+from asgiref.sync import sync_to_async
 from django.http import HttpResponseBadRequest, HttpResponse, Http404
 from django.shortcuts import render
 from django.utils.safestring import SafeString
-from django.views.decorators.clickjacking import xframe_options_exempt
-from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
-from reportbro import Report, ReportBroError
-from timeit import default_timer as timer
+from django.views.decorators.csrf import ensure_csrf_cookie
 
+from . import admission, artifacts, eviction, metrics, previews, render_pool, rendering, template_cache
+from .decorators import async_cache_control, async_condition, async_csrf_exempt, async_xframe_options_exempt
 from .models import ReportDefinition, ReportRequest
+from .profiling import profile_async_view
 from .utils import create_album_report_template, json_default, get_menu_items
 
-MAX_CACHE_SIZE = 1000 * 1024 * 1024  # keep max. 1000 MB of generated pdf files in db
-
 
 @ensure_csrf_cookie
 def edit(request):
@@ -38,14 +37,35 @@ def edit(request):
     return render(request, 'albums/report/edit.html', context)
 
 
-@xframe_options_exempt
-@csrf_exempt
-def run(request):
+def get_preview_etag(request):
+    """Returns the ETag of a report preview download (GET with key), this is the hash of the stored file.
+
+    Returns None for all other requests and if the file is not stored (yet).
+    """
+    key = request.GET.get('key')
+    output_format = request.GET.get('outputFormat')
+    if request.method != 'GET' or not key or len(key) != 36 or output_format not in ('pdf', 'xlsx'):
+        return None
+    path = ReportRequest.objects.filter(key=key).values_list(output_format + '_file_path', flat=True).first()
+    if path is None and output_format == 'xlsx' and previews.wait_for_xlsx(key):
+        # xlsx file was rendered in the background in the meantime
+        path = ReportRequest.objects.filter(key=key).values_list('xlsx_file_path', flat=True).first()
+    # files are stored by the hash of their content (see artifacts.store)
+    return os.path.basename(path) if path else None
+
+
+@profile_async_view
+@async_xframe_options_exempt
+@async_csrf_exempt
+@async_cache_control(private=True, no_cache=True)
+@async_condition(get_preview_etag)
+async def run(request):
     """Generates a report for preview.
 
     This method is called by ReportBro Designer when the Preview button is clicked,
     the url is defined when initializing the Designer, see *reportServerUrl*
     in templates/albums/report/edit.html
+    Reports are rendered in a worker process of the render pool.
     """
     now = datetime.datetime.now()
 
@@ -67,7 +87,8 @@ def run(request):
         # the format (pdf or xlsx), the report itself (report_definition), the data (test data
         # defined within parameters in the Designer) and is_test_data flag (always True
         # when request is sent from Designer)
-        json_data = json.loads(request.body.decode('utf-8'))
+        with metrics.timed('json_decode'):
+            json_data = json.loads(request.body.decode('utf-8'))
         if not isinstance(json_data, dict) or not isinstance(json_data.get('report'), dict) or\
                 not isinstance(json_data.get('data'), dict) or not isinstance(json_data.get('isTestData'), bool):
             return HttpResponseBadRequest('invalid report values')
@@ -79,45 +100,15 @@ def run(request):
         report_definition = json_data.get('report')
         data = json_data.get('data')
         is_test_data = json_data.get('isTestData')
-        try:
-            report = Report(report_definition, data, is_test_data, additional_fonts=additional_fonts)
-        except Exception as e:
-            return HttpResponseBadRequest('failed to initialize report: ' + str(e))
-
-        if report.errors:
-            # return list of errors in case report contains errors, e.g. duplicate parameters.
-            # with this information ReportBro Designer can select object containing errors,
-            # highlight erroneous fields and display error messages
-            return HttpResponse(json.dumps(dict(errors=report.errors)))
-        try:
-            # delete old reports (older than 3 minutes) to avoid table getting too big
-            ReportRequest.objects.filter(created_on__lt=(now - datetime.timedelta(minutes=3))).delete()
-
-            total_size = ReportRequest.objects.aggregate(Sum('pdf_file_size'))
-            if total_size['pdf_file_size__sum'] and total_size['pdf_file_size__sum'] > MAX_CACHE_SIZE:
-                # delete all reports older than 10 seconds to reduce db size for cached pdf files
-                ReportRequest.objects.filter(created_on__lt=(now - datetime.timedelta(seconds=10))).delete()
-
-            start = timer()
-            report_file = report.generate_pdf()
-            end = timer()
-            print('pdf generated in %.3f seconds' % (end-start))
-
-            key = str(uuid.uuid4())
-            # add report request into sqlite db, this enables downloading the report by url
-            # (the report is identified by the key) without any post parameters.
-            # This is needed for pdf and xlsx preview.
-            ReportRequest.objects.create(
-                key=key, report_definition=json.dumps(report_definition, default=json_default),
-                data=json.dumps(data, default=json_default), is_test_data=is_test_data,
-                pdf_file=report_file, pdf_file_size=len(report_file), created_on=now)
 
+        # identical previews (same report definition and data) are only rendered once, the key
+        # of an existing preview is returned as long as its pdf file is available
+        request_hash = previews.get_request_hash(report_definition, data, is_test_data, output_format)
+        key = await sync_to_async(previews.find_preview)(request_hash)
+        if key is not None:
             return HttpResponse('key:' + key)
-        except ReportBroError as err:
-            # in case an error occurs during report generation a ReportBroError exception is thrown
-            # to stop processing. We return this error within a list so the error can be
-            # processed by ReportBro Designer.
-            return HttpResponse(json.dumps(dict(errors=[err.error])))
+        return await sync_to_async(add_preview)(
+            report_definition, data, is_test_data, request_hash, additional_fonts, now)
 
     elif request.method == 'GET':
         output_format = request.GET.get('outputFormat')
@@ -125,29 +116,55 @@ def run(request):
             return HttpResponseBadRequest('outputFormat parameter missing or invalid')
         key = request.GET.get('key')
 
-        report = None
         report_file = None
         if key and len(key) == 36:
             # the report is identified by a key which was saved
             # in a table during report preview with a PUT request
-            try:
-                report_request = ReportRequest.objects.get(key=key)
-            except ReportRequest.DoesNotExist:
+            report_request = await ReportRequest.objects.defer('pdf_file').select_related('definition').\
+                filter(key=key).afirst()
+            if report_request is None:
                 return HttpResponseBadRequest(
                     'report not found (preview probably too old), update report preview and try again')
-            if output_format == 'pdf' and report_request.pdf_file:
-                report_file = report_request.pdf_file
-            else:
-                report_definition = json.loads(report_request.report_definition)
-                data = json.loads(report_request.data)
+            if output_format == 'pdf' and report_request.pdf_file_path:
+                # stream the stored file without reading it into memory
+                try:
+                    return artifacts.create_response(
+                        report_request.pdf_file_path, 'application/pdf', 'report-' + str(now) + '.pdf')
+                except FileNotFoundError:
+                    pass  # file was deleted in the meantime, the report is generated again
+            elif output_format == 'pdf':
+                # report request saved before pdf files were moved to the artifact store,
+                # the deferred field cannot be loaded on access in an async view
+                report_file = await ReportRequest.objects.filter(key=key).\
+                    values_list('pdf_file', flat=True).afirst()
+            elif output_format == 'xlsx':
+                # xlsx file is rendered in the background after the preview was added,
+                # wait in case it is not finished yet
+                xlsx_file_path = report_request.xlsx_file_path
+                if xlsx_file_path is None and\
+                        await sync_to_async(previews.wait_for_xlsx, thread_sensitive=False)(key):
+                    xlsx_file_path = await ReportRequest.objects.filter(key=key).\
+                        values_list('xlsx_file_path', flat=True).afirst()
+                if xlsx_file_path:
+                    try:
+                        response = artifacts.create_response(
+                            xlsx_file_path, rendering.CONTENT_TYPES['xlsx'], 'report-' + str(now) + '.xlsx')
+                        previews.xlsx_stats['used'] += 1
+                        return response
+                    except FileNotFoundError:
+                        pass  # file was deleted in the meantime, the report is generated again
+                previews.xlsx_stats['missed'] += 1
+            if report_file is None:
+                with metrics.timed('json_decode'):
+                    report_definition = json.loads(previews.decompress_json(
+                        report_request.definition.report_definition))
+                    data = json.loads(previews.decompress_json(report_request.data))
                 is_test_data = report_request.is_test_data
-                report = Report(report_definition, data, is_test_data, additional_fonts=additional_fonts)
-                if report.errors:
-                    return HttpResponseBadRequest(reason='error generating report')
         else:
             # in case there is a GET request without a key we expect all report data to be available.
             # this is NOT used by ReportBro Designer and only added for the sake of completeness.
-            json_data = json.loads(request.body.decode('utf-8'))
+            with metrics.timed('json_decode'):
+                json_data = json.loads(request.body.decode('utf-8'))
             if not isinstance(json_data, dict) or not isinstance(json_data.get('report'), dict) or\
                     not isinstance(json_data.get('data'), dict) or not isinstance(json_data.get('isTestData'), bool):
                 return HttpResponseBadRequest('invalid report values')
@@ -156,37 +173,97 @@ def run(request):
             is_test_data = json_data.get('isTestData')
             if not isinstance(report_definition, dict) or not isinstance(data, dict):
                 return HttpResponseBadRequest('report_definition or data missing')
-            report = Report(report_definition, data, is_test_data, additional_fonts=additional_fonts)
-            if report.errors:
-                return HttpResponseBadRequest(reason='error generating report')
-
-        try:
-            # once we have the reportbro.Report instance we can generate
-            # the report (pdf or xlsx) and return it
-            if output_format == 'pdf':
-                if report_file is None:
-                    # as it is currently implemented the pdf file is always stored in the
-                    # report_request table along the other report data. Therefor report_file
-                    # will always be set. The generate_pdf call here is only needed in case
-                    # the code is changed to clear report_request.pdf_file column when the
-                    # data in this table gets too big (currently whole table rows are deleted)
-                    report_file = report.generate_pdf()
-                response = HttpResponse(
-                    report_file, content_type='application/pdf')
-                response['Content-Disposition'] = 'inline; filename="{filename}"'.format(
-                    filename='report-' + str(now) + '.pdf')
-            else:
-                report_file = report.generate_xlsx()
-                response = HttpResponse(
-                    report_file, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                response['Content-Disposition'] = 'inline; filename="{filename}"'.format(
-                    filename='report-' + str(now) + '.xlsx')
-            return response
-        except ReportBroError:
-            return HttpResponseBadRequest('error generating report')
+
+        # generate the report (pdf or xlsx) and return it
+        if output_format == 'pdf':
+            if report_file is None:
+                # as it is currently implemented the pdf file is always stored in the
+                # artifact dir when the report request is added. Rendering the report here
+                # is only needed in case the stored file was deleted in the meantime
+                try:
+                    with metrics.timed('render'):
+                        rv = await render_pool.arender(
+                            rendering.render_report, report_definition, data, is_test_data, 'pdf', additional_fonts)
+                except admission.RenderBusyError:
+                    return admission.create_busy_response()
+                if 'errors' in rv:
+                    return HttpResponseBadRequest('error generating report')
+                report_file = rv['file']
+            response = HttpResponse(
+                report_file, content_type='application/pdf')
+            response['Content-Disposition'] = 'inline; filename="{filename}"'.format(
+                filename='report-' + str(now) + '.pdf')
+        else:
+            try:
+                with metrics.timed('render'):
+                    rv = await render_pool.arender(
+                        rendering.render_report, report_definition, data, is_test_data, 'xlsx', additional_fonts)
+            except admission.RenderBusyError:
+                return admission.create_busy_response()
+            if 'errors' in rv:
+                return HttpResponseBadRequest('error generating report')
+            response = HttpResponse(
+                rv['file'], content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            response['Content-Disposition'] = 'inline; filename="{filename}"'.format(
+                filename='report-' + str(now) + '.xlsx')
+        return response
     return None
 
 
+def add_preview(report_definition, data, is_test_data, request_hash, additional_fonts, now):
+    """Adds a report preview unless an identical preview was rendered concurrently."""
+    with previews.render_lock(request_hash) as rendered_concurrently:
+        if rendered_concurrently:
+            # an identical preview was rendered while this request was waiting
+            key = previews.find_preview(request_hash)
+            if key is not None:
+                return HttpResponse('key:' + key)
+        return create_preview(report_definition, data, is_test_data, request_hash, additional_fonts, now)
+
+
+def create_preview(report_definition, data, is_test_data, request_hash, additional_fonts, now):
+    """Generates the pdf file for a report preview and stores it for download.
+
+    Returns a response containing the key of the added report request
+    or a list of errors in case the report contains errors.
+    """
+    # old reports are deleted periodically in a background thread
+    # (or by the evict_report_requests command) to avoid table getting too big
+    eviction.start_background_eviction()
+    try:
+        with metrics.timed('render'):
+            rv = render_pool.render(
+                rendering.render_report, report_definition, data, is_test_data, 'pdf', additional_fonts)
+    except admission.RenderBusyError:
+        return admission.create_busy_response()
+    except Exception as e:
+        return HttpResponseBadRequest('failed to initialize report: ' + str(e))
+
+    if 'errors' in rv:
+        # return list of errors in case report contains errors, e.g. duplicate parameters.
+        # with this information ReportBro Designer can select object containing errors,
+        # highlight erroneous fields and display error messages. A ReportBroError raised
+        # during report generation is returned within the list as well.
+        return HttpResponse(json.dumps(dict(errors=rv['errors'])))
+
+    key = str(uuid.uuid4())
+    # the pdf file is stored in the artifact dir, only its path is saved in the db
+    pdf_file_path, pdf_file_size = artifacts.store(rv['file'])
+    report_definition_json = json.dumps(report_definition, default=json_default)
+    data_json = json.dumps(data, default=json_default)
+    # add report request into sqlite db, this enables downloading the report by url
+    # (the report is identified by the key) without any post parameters.
+    # This is needed for pdf and xlsx preview.
+    previews.add_report_request(
+        key, report_definition_json, data_json, is_test_data,
+        pdf_file_path=pdf_file_path, pdf_file_size=pdf_file_size, request_hash=request_hash, created_on=now)
+    eviction.add_usage(pdf_file_size)
+    # render xlsx file in advance so it is immediately available when the preview is switched to xlsx
+    previews.prerender_xlsx(key, report_definition_json, data_json, is_test_data, additional_fonts)
+
+    return HttpResponse('key:' + key)
+
+
 def save(request, report_type):
     """Save report_definition in our db table.
 
@@ -215,4 +292,9 @@ def save(request, report_type):
             report_definition=report_definition, last_modified_at=now) == 0:
         ReportDefinition.objects.create(
             report_type=report_type, report_definition=report_definition, last_modified_at=now)
+    # cached album pdf files are invalidated as well because
+    # last_modified_at is part of their cache key
+    template_cache.invalidate(report_type)
     return HttpResponse('ok')
+
+
@@ -0,0 +1,157 @@
+# cache of albums encoded as json, responses containing albums are assembled from the cached
+# json fragments instead of encoding every album again. A fragment is only used if the change_seq
+# of the album (incremented by a trigger whenever the album is modified, see migration
+# 0003_album_changes) matches, so modifications by other processes or bulk writes are detected.
+# The least recently used albums are evicted when the cache is full, but albums used within the last
+# MAX_SIZE lookups are kept (new albums are not cached then), so listing more albums than fit into
+# the cache again and again still gets hits for most of them.
+import collections
+import json
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+
+from .utils import ALBUM_FIELDS, json_default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_ROW_CACHE = {
+    # max. number of cached albums (per process), 0 disables the cache
+    'MAX_SIZE': 100000,
+    # json encoder: 'orjson' or 'json', None: orjson if it is installed
+    'ENCODER': None,
+}
+
+# fields of the album rows (values_list) passed to *encode_rows*, the change_seq must be last
+FIELDS = ALBUM_FIELDS + ('change_seq',)
+
+# json.dumps creates a new encoder for every call if any option is set
+_json_encoder = json.JSONEncoder(default=json_default, separators=(',', ':'))
+_cache = collections.OrderedDict()  # album id -> (change_seq, json fragment, lookup count of last use)
+_cache_lock = threading.Lock()
+_lookups = 0  # number of cache lookups (in this process)
+_config = None
+_config_lock = threading.Lock()
+
+stats = dict(hits=0, misses=0)
+
+
+def get_config():
+    """Returns the row cache settings (ALBUMS_ROW_CACHE) merged with the defaults."""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                config = dict(DEFAULT_ROW_CACHE)
+                config.update(getattr(settings, 'ALBUMS_ROW_CACHE', {}))
+                if config['ENCODER'] is None:
+                    config['ENCODER'] = 'orjson' if orjson is not None else 'json'
+                _config = config
+    return _config
+
+
+@receiver(setting_changed)
+def reset_cache(setting, **kwargs):
+    """Clears the cache and reads the config again when the settings are changed (e.g. by override_settings)."""
+    global _config
+    if setting == 'ALBUMS_ROW_CACHE':
+        _config = None
+        clear()
+
+
+def dumps(value):
+    """Returns *value* encoded as json (bytes), decimal and date values are supported."""
+    if get_config()['ENCODER'] == 'orjson':
+        return orjson.dumps(value, default=json_default)
+    return _json_encoder.encode(value).encode('utf-8')
+
+
+def is_enabled(using='default'):
+    # the change_seq is only maintained by the triggers created for sqlite
+    return get_config()['MAX_SIZE'] > 0 and connections[using].vendor == 'sqlite'
+
+
+def encode_rows(rows):
+    """Returns the json fragments of the album rows (tuples of *FIELDS*)."""
+    config = get_config()
+    max_size = config['MAX_SIZE'] if is_enabled() else 0
+    if not max_size:
+        fragments = [dumps(dict(zip(ALBUM_FIELDS, row))) for row in rows]
+        stats['misses'] += len(fragments)
+        return fragments
+    fragments = []
+    hits = 0
+    for row in rows:
+        with _cache_lock:
+            entry = _lookup(row[0])
+        if entry is not None and entry[0] == row[-1]:
+            fragments.append(entry[1])
+            hits += 1
+            continue
+        fragment = dumps(dict(zip(ALBUM_FIELDS, row)))
+        with _cache_lock:
+            _add(row[0], row[-1], fragment, max_size)
+        fragments.append(fragment)
+    stats['hits'] += hits
+    stats['misses'] += len(fragments) - hits
+    return fragments
+
+
+def _lookup(album_id):
+    # must be called with _cache_lock held, marks the album as most recently used
+    global _lookups
+    _lookups += 1
+    entry = _cache.get(album_id)
+    if entry is not None:
+        entry = _cache[album_id] = (entry[0], entry[1], _lookups)
+        _cache.move_to_end(album_id)
+    return entry
+
+
+def _add(album_id, change_seq, fragment, max_size):
+    # must be called with _cache_lock held, directly after the album was looked up
+    if album_id not in _cache and len(_cache) >= max_size:
+        oldest_id, oldest_entry = next(iter(_cache.items()))
+        if _lookups - oldest_entry[2] <= max_size:
+            # even the least recently used album was used recently, it would be needed again
+            # before the new album in case the same albums are listed again
+            return
+        del _cache[oldest_id]
+    _cache[album_id] = (change_seq, fragment, _lookups)
+    _cache.move_to_end(album_id)
+
+
+def encode_list(rows):
+    """Returns the album rows (tuples of *FIELDS*) as json array (bytes)."""
+    return b'[' + b','.join(encode_rows(rows)) + b']'
+
+
+def encode_object(albums, **values):
+    """Returns a json object (bytes) containing the album rows (tuples of *FIELDS*) as *albums* and *values*."""
+    content = b'{"albums":' + encode_list(albums)
+    if values:
+        content += b',' + dumps(values)[1:]
+    else:
+        content += b'}'
+    return content
+
+
+def invalidate(album_ids):
+    """Removes the albums from the cache of this process.
+
+    Outdated albums are detected anyway (by change_seq), this frees the memory right away.
+    """
+    with _cache_lock:
+        for album_id in album_ids:
+            _cache.pop(album_id, None)
+
+
+def clear():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,42 @@
+import re
+
+from .models import Album
+from .utils import ALBUM_FIELDS
+
+# max. number of words of the search text which are used
+MAX_TERMS = 10
+
+_term_re = re.compile(r'\w+')
+
+
+def get_match_query(text):
+    """Returns the FTS5 query for the search text entered by the user, None if it does not contain any word.
+
+    All words must be contained in name or artist. The last word is used as prefix so
+    matching albums can be shown while the text is typed.
+    """
+    terms = _term_re.findall(text)[:MAX_TERMS]
+    if not terms:
+        return None
+    # each word is quoted so it is never interpreted as FTS5 operator (AND, OR, NEAR, column filter)
+    return ' '.join('"%s"' % term for term in terms) + '*'
+
+
+def search_albums(text, year=None, limit=100, offset=0):
+    """Returns albums matching the search text, best matches first. Can be optionally filtered by year.
+
+    The full-text index (album_fts, see migration 0002_album_search) is used to find matching
+    albums, so no table scan is needed. Albums are returned as dicts (same as *get_albums*).
+    """
+    match_query = get_match_query(text)
+    if match_query is None:
+        return []
+    sql = 'SELECT album.* FROM album_fts JOIN album ON album.id = album_fts.rowid WHERE album_fts MATCH %s'
+    params = [match_query]
+    if year is not None:
+        sql += ' AND album.year = %s'
+        params.append(year)
+    # rank is the bm25 score of the match, albums with the same score are sorted by id
+    sql += ' ORDER BY album_fts.rank, album.id LIMIT %s OFFSET %s'
+    params += [limit, offset]
+    return [{field: getattr(album, field) for field in ALBUM_FIELDS} for album in Album.objects.raw(sql, params)]
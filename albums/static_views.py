@@ -0,0 +1,65 @@
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+
+# files with the hash of their content in the filename never change
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# content encoding -> suffix of the precompressed file, in order of preference
+PRECOMPRESSED_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+
+def get_accepted_encodings(request):
+    """Returns the encodings of the Accept-Encoding header, encodings with q=0 are not accepted."""
+    encodings = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        encoding, _, params = item.partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def serve(request, path):
+    """Serves a static file collected in STATIC_ROOT (collectstatic), only used if ALBUMS_SERVE_STATIC is set.
+
+    The precompressed variant (see albums.storage) is sent if the client accepts its encoding.
+    Fingerprinted files (filename contains the hash of the content) are cached forever by the client.
+    Usually static files are served by the web server, this is meant for deployments without one.
+    """
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('invalid path')
+    if not os.path.isfile(full_path):
+        raise Http404('file not found')
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    content_encoding = None
+    accepted_encodings = get_accepted_encodings(request)
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+        if encoding in accepted_encodings and os.path.isfile(full_path + suffix):
+            content_encoding = encoding
+            full_path += suffix
+            break
+
+    response = FileResponse(open(full_path, 'rb'), content_type=content_type or 'application/octet-stream')
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if path in getattr(staticfiles_storage, 'hashed_files', dict()).values():
+        response['Cache-Control'] = 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
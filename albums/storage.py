@@ -0,0 +1,59 @@
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# only text files are compressed, images and woff/woff2 fonts are already compressed
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.ttf', '.txt', '.json', '.ico')
+# smaller files are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Stores static files with the hash of their content in the filename (see ManifestStaticFilesStorage).
+
+    Additionally a gzip (.gz) and brotli (.br, only if brotli is installed) compressed variant
+    of each text file is created by collectstatic, so a web server can send the precompressed
+    file instead of compressing it for every request (e.g. nginx with gzip_static and brotli_static).
+
+    Files which are not collected yet (e.g. collectstatic was not run before the tests) are
+    referenced with their original name instead of raising an error.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # file not found in STATIC_ROOT
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run=dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            if hashed_name.endswith(COMPRESSED_EXTENSIONS):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            content = f.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content, quality=11)))
+        for suffix, compressed_content in variants:
+            if len(compressed_content) < len(content):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed_content)
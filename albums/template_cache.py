@@ -0,0 +1,74 @@
+import json
+import threading
+
+from . import metrics
+from .models import ReportDefinition
+
+# per-process cache of parsed and validated report definitions, the key is
+# the report_type and an entry is only used as long as last_modified_at of the
+# report_definition row is unchanged (so changes saved by other processes are detected)
+_templates = dict()
+_lock = threading.Lock()
+
+# cache hit/miss counters, can be used for monitoring
+stats = dict(hits=0, misses=0)
+
+
+class CachedTemplate:
+    """Parsed report definition together with the result of its validation.
+
+    The report_definition dict is shared between requests and must not be modified.
+    reportbro.Report only converts the definition to the current version in place,
+    this is done once when the template is validated before it is added to the cache.
+    """
+    def __init__(self, report_type, last_modified_at, report_definition, errors):
+        self.report_type = report_type
+        self.last_modified_at = last_modified_at
+        self.report_definition = report_definition
+        self.errors = errors
+
+
+def get_template(report_type):
+    """Returns the cached template for the given report type.
+
+    Only the modification timestamp of the report definition is queried in case
+    the template is already cached, the report definition itself is loaded, parsed
+    and validated otherwise. Returns None if there is no report definition for
+    the report type.
+    """
+    last_modified_at = ReportDefinition.objects.filter(report_type=report_type).\
+        values_list('last_modified_at', flat=True).first()
+    if last_modified_at is None:
+        return None
+
+    template = _templates.get(report_type)
+    if template is not None and template.last_modified_at == last_modified_at:
+        stats['hits'] += 1
+        return template
+
+    from reportbro import Report  # imported on first use, see album_views.report
+
+    stats['misses'] += 1
+    row = ReportDefinition.objects.filter(report_type=report_type).\
+        values_list('report_definition', 'last_modified_at').first()
+    if row is None:
+        return None
+    with metrics.timed('json_decode'):
+        report_definition = json.loads(row[0])
+    # validate the report definition once without any data, errors in the template itself
+    # (e.g. duplicate parameters or invalid element positions) are detected this way
+    with metrics.timed('template_init'):
+        errors = Report(report_definition, dict()).errors
+    template = CachedTemplate(report_type, row[1], report_definition, errors)
+    with _lock:
+        _templates[report_type] = template
+    return template
+
+
+def invalidate(report_type=None):
+    """Removes the template for the given report type (or all templates) from the cache."""
+    with _lock:
+        if report_type is None:
+            _templates.clear()
+        else:
+            _templates.pop(report_type, None)
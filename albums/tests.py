@@ -0,0 +1,1187 @@
+import asyncio
+import concurrent.futures
+import csv
+import datetime
+import io
+import json
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import uuid
+import warnings
+import zipfile
+from unittest import skipIf
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from . import admission, album_import, artifacts, db, eviction, jobs, partitioning, pdf_cache, previews, profiling,\
+    render_pool, rendering, row_cache, search, template_cache, versions, warmup
+from .album_views import get_albums, get_report_etag
+from .management.commands import benchmark
+from .models import Album, AlbumTombstone, DataVersion, ReportDefinition, ReportJob, ReportRequest,\
+    ReportRequestDefinition, StorageUsage
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+
+class SqlitePragmasTest(TestCase):
+    def get_pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        self.assertEqual(self.get_pragma('busy_timeout'), 5000)
+        self.assertEqual(self.get_pragma('cache_size'), -64 * 1024)
+        self.assertEqual(self.get_pragma('temp_store'), 2)  # memory
+
+    @override_settings(ALBUMS_SQLITE_PRAGMAS=dict(mmap_size=None, cache_size=-1024))
+    def test_settings(self):
+        pragmas = db.get_sqlite_pragmas()
+        self.assertEqual(pragmas['cache_size'], -1024)
+        self.assertIsNone(pragmas['mmap_size'])
+        self.assertEqual(pragmas['journal_mode'], 'WAL')
+
+
+class DatabaseRouterTest(SimpleTestCase):
+    def setUp(self):
+        databases = dict(settings.DATABASES)
+        databases[db.READ_DATABASE] = dict(databases['default'])
+        databases[db.PREVIEW_DATABASE] = dict(databases['default'])
+        settings_override = override_settings(DATABASES=databases)
+        with warnings.catch_warnings():
+            # the connections are not changed, only the router reads the setting
+            warnings.simplefilter('ignore')
+            settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.router = db.AlbumRouter()
+
+    def test_catalog_is_read_from_replica(self):
+        self.assertEqual(self.router.db_for_read(Album), db.READ_DATABASE)
+        self.assertIsNone(self.router.db_for_write(Album))
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_previews_database(self):
+        for model in (ReportRequest, ReportJob, StorageUsage):
+            self.assertEqual(self.router.db_for_read(model), db.PREVIEW_DATABASE)
+            self.assertEqual(self.router.db_for_write(model), db.PREVIEW_DATABASE)
+
+    def test_allow_migrate(self):
+        self.assertFalse(self.router.allow_migrate(db.READ_DATABASE, 'albums', 'album'))
+        self.assertTrue(self.router.allow_migrate(db.PREVIEW_DATABASE, 'albums', 'reportjob'))
+        self.assertFalse(self.router.allow_migrate('default', 'albums', 'reportjob'))
+        self.assertFalse(self.router.allow_migrate(db.PREVIEW_DATABASE, 'albums', 'album'))
+        self.assertTrue(self.router.allow_migrate('default', 'albums', 'album'))
+
+
+class QueryPlanTest(TestCase):
+    """Verifies that no frequently used query requires a table scan or a temporary b-tree for sorting."""
+    album_count = 20000
+    report_request_count = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        now = datetime.datetime.now()
+        Album.objects.bulk_create((
+            Album(name='Album %d' % (i % (cls.album_count // 3 + 1)), artist='Artist %d' % (i % 1000),
+                  year=1950 + i % 70, best_of_compilation=i % 10 == 0)
+            for i in range(cls.album_count)), batch_size=5000)
+        definitions = ReportRequestDefinition.objects.bulk_create(
+            ReportRequestDefinition(definition_hash='%064x' % i, report_definition=b'{}') for i in range(10))
+        ReportRequest.objects.bulk_create((
+            ReportRequest(
+                key='%036d' % i, definition=definitions[i % 10], data=b'{}', is_test_data=True,
+                pdf_file_path='%064x' % i, pdf_file_size=1000, xlsx_file_path='%063xx' % i, xlsx_file_size=1000,
+                request_hash='%064x' % (i % (cls.report_request_count // 2 + 1)),
+                created_on=now - datetime.timedelta(seconds=i))
+            for i in range(cls.report_request_count)), batch_size=5000)
+        ReportJob.objects.bulk_create((
+            ReportJob(key='%036d' % i, status=ReportJob.STATUS_FINISHED if i % 10 else ReportJob.STATUS_PENDING,
+                      output_format='pdf', filename='albums.pdf', created_on=now - datetime.timedelta(seconds=i))
+            for i in range(cls.report_request_count)), batch_size=5000)
+        ReportDefinition.objects.create(report_type='albums_report', report_definition='{}', last_modified_at=now)
+        DataVersion.objects.update_or_create(name=versions.ALBUM_CHANGES, defaults=dict(version=1))
+        StorageUsage.objects.update_or_create(name='report_request', defaults=dict(total_size=0))
+
+    @classmethod
+    def get_queries(cls):
+        now = datetime.datetime.now()
+        paths = ['%064x' % i for i in range(10)]
+        max_change_seq = Album.objects.order_by('-change_seq').values_list('change_seq', flat=True)[0]
+        return (
+            ('albums sorted by name', get_albums()),
+            ('albums filtered by year', get_albums(2000)),
+            ('album page after cursor', get_albums(None, ('Album 5', 100))[:101]),
+            ('album page filtered by year after cursor', get_albums(2000, ('Album 5', 100))[:101]),
+            ('albums changed after token', Album.objects.filter(
+                change_seq__gt=max_change_seq - 10, change_seq__lte=max_change_seq).order_by('change_seq')[:5001]),
+            ('albums deleted after token', AlbumTombstone.objects.filter(
+                change_seq__gt=max_change_seq - 10, change_seq__lte=max_change_seq)),
+            ('expired album tombstones', AlbumTombstone.objects.filter(
+                deleted_on__lt=now - datetime.timedelta(days=7))),
+            ('pruned album tombstones', AlbumTombstone.objects.filter(change_seq__lte=max_change_seq - 10)),
+            ('report definition by report_type', ReportDefinition.objects.filter(report_type='albums_report')),
+            ('data version by name', DataVersion.objects.filter(name=versions.ALBUM_CHANGES)),
+            ('storage usage by name', StorageUsage.objects.filter(name='report_request')),
+            ('report request by key', ReportRequest.objects.filter(key='%036d' % 5)),
+            ('latest report request by hash', ReportRequest.objects.filter(request_hash='%064x' % 5).exclude(
+                pdf_file_path=None).order_by('-created_on')[:1]),
+            ('expired report requests', ReportRequest.objects.filter(
+                created_on__lt=now - datetime.timedelta(minutes=3))),
+            ('oldest report requests', ReportRequest.objects.order_by('created_on')[:100]),
+            ('report requests by pdf file', ReportRequest.objects.filter(pdf_file_path__in=paths)),
+            ('report requests by xlsx file', ReportRequest.objects.filter(xlsx_file_path__in=paths)),
+            ('report request definition by hash', ReportRequestDefinition.objects.filter(definition_hash='%064x' % 5)),
+            ('report requests by definition', ReportRequest.objects.filter(definition_id__in=[1, 2])),
+            ('report job by key', ReportJob.objects.filter(key='%036d' % 5)),
+            ('pending report jobs', ReportJob.objects.filter(
+                status=ReportJob.STATUS_PENDING, created_on__gte=now - datetime.timedelta(minutes=10))),
+            ('old report jobs', ReportJob.objects.filter(created_on__lt=now - datetime.timedelta(hours=1))),
+        )
+
+    def assertPlanUsesIndex(self, name, plan):
+        """Fails if a table is scanned without an index or rows are sorted without an index.
+
+        A scan using an index is allowed because it returns rows in index order (e.g. all albums
+        sorted by name) and can stop early if the query has a limit.
+        """
+        for line in plan.splitlines():
+            self.assertNotIn('TEMP B-TREE', line, '%s sorts without index:\n%s' % (name, plan))
+            if ' SCAN ' in ' ' + line + ' ':
+                self.assertIn('USING', line, '%s scans a table:\n%s' % (name, plan))
+
+    def check_query_plans(self):
+        for name, queryset in self.get_queries():
+            with self.subTest(query=name):
+                self.assertPlanUsesIndex(name, queryset.explain())
+
+    def test_query_plans(self):
+        self.check_query_plans()
+
+    def test_query_plans_after_analyze(self):
+        # the planner uses the statistics collected by ANALYZE instead of its default estimates
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.check_query_plans()
+
+
+@override_settings(ALBUMS_IMPORT_TOKEN='import-token')
+class AlbumImportTest(TestCase):
+    def post_import(self, content, content_type='application/jsonl', token='import-token', **params):
+        url = reverse('albums:album_import')
+        if params:
+            url += '?' + '&'.join('%s=%s' % item for item in params.items())
+        headers = dict(HTTP_AUTHORIZATION='Bearer ' + token) if token else dict()
+        return self.client.post(url, content, content_type=content_type, **headers)
+
+    def test_import_json_lines(self):
+        album = Album.objects.create(name='Old name', artist='Artist', year=2000)
+        content = '\n'.join(json.dumps(album) for album in (
+            dict(name='Album 1', artist='Artist 1', year=2001, best_of_compilation=True),
+            dict(name='Album 2', artist='Artist 2'),
+            dict(id=album.id, name='New name', artist='Artist', year='2002')))
+        response = self.post_import(content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), dict(created=2, updated=1, errors=[]))
+        album.refresh_from_db()
+        self.assertEqual((album.name, album.year), ('New name', 2002))
+        self.assertFalse(Album.objects.get(name='Album 2').best_of_compilation)
+
+    def test_invalid_rows_are_skipped(self):
+        content = '\n'.join((
+            json.dumps(dict(name='Valid', artist='Artist', best_of_compilation=False)),
+            json.dumps(dict(name='Invalid', artist='Artist', best_of_compilation='yes')),
+            json.dumps(dict(name='', artist='Artist')),
+            json.dumps(dict(name='Invalid year', artist='Artist', year='abc')),
+            json.dumps(dict(id=999999, name='Missing', artist='Artist')),
+            'no json',
+            json.dumps(['no', 'object'])))
+        response = self.post_import(content, batch_size=2)
+        self.assertEqual(response.status_code, 200)
+        rv = response.json()
+        self.assertEqual(rv['created'], 1)
+        self.assertEqual(rv['updated'], 0)
+        self.assertEqual(
+            sorted((error['line'], error['field']) for error in rv['errors']),
+            [(2, 'best_of_compilation'), (3, 'name'), (4, 'year'), (5, 'id'), (6, None), (7, None)])
+        self.assertEqual(list(Album.objects.values_list('name', flat=True)), ['Valid'])
+
+    def test_import_csv(self):
+        content = 'name,artist,year,best_of_compilation\nAlbum 1,Artist 1,1999,yes\nAlbum 2,,2000,\n'
+        response = self.post_import(content, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        rv = response.json()
+        self.assertEqual(rv['created'], 1)
+        self.assertEqual([(error['line'], error['field']) for error in rv['errors']], [(3, 'artist')])
+        self.assertTrue(Album.objects.get(name='Album 1').best_of_compilation)
+
+    def test_import_requires_token(self):
+        content = json.dumps(dict(name='Album', artist='Artist'))
+        self.assertEqual(self.post_import(content, token=None).status_code, 403)
+        self.assertEqual(self.post_import(content, token='wrong').status_code, 403)
+        with override_settings(ALBUMS_IMPORT_TOKEN=None):
+            self.assertEqual(self.post_import(content).status_code, 403)
+        self.assertFalse(Album.objects.exists())
+
+    def test_import_without_csrf_token(self):
+        self.client = self.client_class(enforce_csrf_checks=True)
+        response = self.post_import(json.dumps(dict(name='Album', artist='Artist')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+
+    def test_import_albums(self):
+        rows = album_import.read_csv(['name,artist,best_of_compilation', 'Album,Artist,x', 'Album 2,Artist,no'])
+        rv = album_import.import_albums(rows, batch_size=1)
+        self.assertEqual(rv, dict(created=2, updated=0, errors=[]))
+        self.assertEqual(
+            list(Album.objects.order_by('name').values_list('best_of_compilation', flat=True)), [True, False])
+
+
+class MetricsAccessTest(TestCase):
+    @override_settings(ALBUMS_METRICS={})
+    def test_localhost_not_allowed_by_default(self):
+        # e.g. all clients of a reverse proxy on the same host
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    @override_settings(ALBUMS_METRICS=dict(ALLOWED_IPS=('10.0.0.1',)))
+    def test_allowed_ip(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'albums_render_admitted_total', response.content)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(ALBUMS_METRICS=dict(ALLOWED_IPS=(), TOKEN='metrics-token'))
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer metrics-token')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ALBUMS_METRICS=dict(ALLOWED_IPS=()))
+    def test_staff_user(self):
+        user = User.objects.create_user('user')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class PageTest(TestCase):
+    def test_pages_without_collected_static_files(self):
+        # tests run with DEBUG=False, static file urls are created by CompressedManifestStaticFilesStorage
+        for name in ('albums:album_index', 'albums:album_edit', 'albums:report_edit'):
+            with self.subTest(page=name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b'/static/', response.content)
+
+
+def get_report_definition():
+    with open(os.path.join(settings.BASE_DIR, 'albums', 'static', 'report_definition.json')) as f:
+        return json.load(f)
+
+
+class TemplateCacheTest(TestCase):
+    def setUp(self):
+        template_cache.invalidate()
+        self.addCleanup(template_cache.invalidate)
+
+    def test_template_is_parsed_once_until_modified(self):
+        self.assertIsNone(template_cache.get_template('albums_report'))
+        report_definition = get_report_definition()
+        ReportDefinition.objects.create(
+            report_type='albums_report', report_definition=json.dumps(report_definition),
+            last_modified_at=datetime.datetime(2020, 1, 1))
+        template = template_cache.get_template('albums_report')
+        self.assertEqual(template.errors, [])
+        hits = template_cache.stats['hits']
+        self.assertIs(template_cache.get_template('albums_report'), template)
+        self.assertEqual(template_cache.stats['hits'], hits + 1)
+
+        # modified by another process
+        report_definition['documentProperties']['marginLeft'] = '20'
+        ReportDefinition.objects.filter(report_type='albums_report').update(
+            report_definition=json.dumps(report_definition), last_modified_at=datetime.datetime(2020, 1, 2))
+        modified_template = template_cache.get_template('albums_report')
+        self.assertIsNot(modified_template, template)
+        self.assertEqual(modified_template.report_definition['documentProperties']['marginLeft'], '20')
+
+
+class WarmStartTest(TransactionTestCase):
+    # the db connections are closed by the warm start
+
+    def setUp(self):
+        template_cache.invalidate()
+        self.addCleanup(template_cache.invalidate)
+        self.addCleanup(setattr, warmup, 'duration', warmup.duration)
+
+    def test_warm_up(self):
+        warmup.warm_up()
+        self.assertIsNotNone(warmup.duration)
+        # the report template was created and is cached
+        self.assertTrue(ReportDefinition.objects.filter(report_type='albums_report').exists())
+        hits = template_cache.stats['hits']
+        self.assertIsNotNone(template_cache.get_template('albums_report'))
+        self.assertEqual(template_cache.stats['hits'], hits + 1)
+        # the worker processes of the render pool are started
+        self.assertTrue(render_pool._started)
+        self.assertIsNotNone(render_pool._executor)
+
+
+@override_settings(ALBUMS_REPORT_JOBS=dict(ENABLED=True))
+class ReportJobTest(TransactionTestCase):
+    # the job status is updated by another thread, so the test data must be committed
+
+    def setUp(self):
+        artifact_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(artifact_dir.cleanup)
+        settings_override = override_settings(ALBUMS_ARTIFACT_DIR=artifact_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def submit_job(self):
+        response = self.client.put(reverse('albums:report_run_job'), json.dumps(dict(
+            report=get_report_definition(), data=dict(albums=[dict(name='Album', artist='Artist', year=2000)]),
+            isTestData=True, outputFormat='pdf')), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['url']
+
+    def wait_for_job(self, status_url):
+        for _i in range(300):
+            rv = self.client.get(status_url).json()
+            if rv['status'] != 'pending':
+                return rv
+            time.sleep(0.1)
+        self.fail('job not finished')
+
+    def test_job_is_rendered_by_render_pool(self):
+        admitted = admission.stats['admitted']
+        rv = self.wait_for_job(self.submit_job())
+        self.assertEqual(rv['status'], 'finished', rv)
+        self.assertEqual(admission.stats['admitted'], admitted + 1)
+        # the file is stored in the artifact dir, only its path is saved with the job
+        job = ReportJob.objects.get(key=rv['key'])
+        self.assertTrue(os.path.exists(artifacts.get_full_path(job.result_file_path)))
+        response = self.client.get(rv['url'])
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertEqual(len(content), job.result_file_size)
+
+        # the stored file is deleted together with the job
+        self.assertEqual(jobs.delete_jobs(ReportJob.objects.filter(key=rv['key'])), 1)
+        self.assertFalse(os.path.exists(artifacts.get_full_path(job.result_file_path)))
+
+    @override_settings(ALBUMS_RENDER_POOL=dict(MAX_PENDING=1, MAX_QUEUE=0))
+    def test_job_waits_for_render_slot(self):
+        rejected = admission.stats['rejected']
+        slots = admission.get_slots()
+        slots.acquire(0)
+        try:
+            status_url = self.submit_job()
+            time.sleep(2 * jobs.BUSY_RETRY_INTERVAL)
+            self.assertEqual(self.client.get(status_url).json()['status'], 'pending')
+        finally:
+            slots.release()
+        self.assertEqual(self.wait_for_job(status_url)['status'], 'finished')
+        self.assertEqual(admission.stats['rejected'], rejected)
+
+
+class PaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # albums with the same name are ordered by id
+        for name, year in (('B', 2000), ('A', 2001), ('C', 2000), ('B', 2001), ('B', 2000)):
+            Album.objects.create(name=name, artist='Artist', year=year)
+        cls.album_ids = list(Album.objects.order_by('name', 'id').values_list('id', flat=True))
+
+    def get_all_pages(self, **params):
+        ids = []
+        rv = dict(next=None)
+        while True:
+            if rv['next']:
+                params['after'] = rv['next']
+            response = self.client.get(reverse('albums:album_data'), params)
+            self.assertEqual(response.status_code, 200)
+            rv = response.json()
+            self.assertLessEqual(len(rv['albums']), params['limit'])
+            ids.extend(album['id'] for album in rv['albums'])
+            if rv['next'] is None:
+                return ids
+
+    def test_next_cursor(self):
+        self.assertEqual(self.get_all_pages(limit=2), self.album_ids)
+        self.assertEqual(self.get_all_pages(limit=5), self.album_ids)
+        self.assertEqual(
+            self.get_all_pages(limit=1, year=2000),
+            list(Album.objects.filter(year=2000).order_by('name', 'id').values_list('id', flat=True)))
+
+    def test_album_added_between_pages(self):
+        rv = self.client.get(reverse('albums:album_data'), dict(limit=2)).json()
+        # a page starts after the last album of the previous page, no album is skipped or returned twice
+        album = Album.objects.create(name='A', artist='Artist', year=2000)
+        ids = [album['id'] for album in rv['albums']] + self.get_all_pages(limit=2, after=rv['next'])
+        self.assertEqual(ids, self.album_ids)
+        self.assertNotIn(album.id, ids)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('albums:album_data'), dict(limit=2, after='invalid'))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('albums:album_data'), dict(limit=0))
+        self.assertEqual(response.status_code, 400)
+
+    def test_stream(self):
+        response = self.client.get(reverse('albums:album_data'), dict(stream=1))
+        self.assertTrue(response.streaming)
+        albums = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([album['id'] for album in albums], self.album_ids)
+
+
+class DeltaSyncTest(TestCase):
+    def get_changes(self, since, **params):
+        params['since'] = since
+        return self.client.get(reverse('albums:album_data'), params)
+
+    def test_changes_since_token(self):
+        album1 = Album.objects.create(name='Album 1', artist='Artist', year=2000)
+        album2 = Album.objects.create(name='Album 2', artist='Artist', year=2000)
+        token = self.get_changes(0).json()['token']
+        Album.objects.filter(id=album1.id).update(name='Album 1 modified')
+        Album.objects.filter(id=album2.id).delete()
+        album3 = Album.objects.create(name='Album 3', artist='Artist', year=2001)
+
+        rv = self.get_changes(token).json()
+        self.assertEqual(sorted(album['id'] for album in rv['albums']), [album1.id, album3.id])
+        self.assertEqual(rv['deleted'], [album2.id])
+        self.assertFalse(rv['more'])
+        self.assertEqual(int(rv['token']), versions.get_version(versions.ALBUM_CHANGES))
+        self.assertEqual(
+            self.get_changes(rv['token']).json(), dict(albums=[], deleted=[], token=rv['token'], more=False))
+
+        # albums of other years are returned as deleted
+        rv = self.get_changes(token, year=2000).json()
+        self.assertEqual([album['id'] for album in rv['albums']], [album1.id])
+        self.assertEqual(sorted(rv['deleted']), sorted([album2.id, album3.id]))
+
+    def test_changes_in_pages(self):
+        token = self.get_changes(0).json()['token']
+        albums = [Album.objects.create(name='Album %d' % i, artist='Artist') for i in range(3)]
+        ids = []
+        rv = dict(token=token, more=True)
+        while rv['more']:
+            rv = self.get_changes(rv['token'], limit=2).json()
+            ids.extend(album['id'] for album in rv['albums'])
+        self.assertEqual(ids, [album.id for album in albums])
+
+    def test_prune_tombstones(self):
+        album1 = Album.objects.create(name='Album 1', artist='Artist')
+        album2 = Album.objects.create(name='Album 2', artist='Artist')
+        old_token = self.get_changes(0).json()['token']
+        Album.objects.filter(id=album1.id).delete()
+        deleted_on = AlbumTombstone.objects.get(album_id=album1.id).deleted_on
+        self.assertLess(abs(deleted_on - datetime.datetime.now()), datetime.timedelta(minutes=1))
+        token = self.get_changes(old_token).json()['token']
+        Album.objects.filter(id=album2.id).delete()
+
+        # tombstones within the retention time are kept
+        self.assertEqual(eviction.prune_tombstones(), 0)
+        self.assertEqual(self.get_changes(old_token).json()['deleted'], [album1.id, album2.id])
+
+        with override_settings(ALBUMS_TOMBSTONE_RETENTION=60):
+            AlbumTombstone.objects.filter(album_id=album1.id).update(
+                deleted_on=datetime.datetime.now() - datetime.timedelta(seconds=120))
+            self.assertEqual(eviction.prune_tombstones(), 1)
+        self.assertEqual(list(AlbumTombstone.objects.values_list('album_id', flat=True)), [album2.id])
+
+        # the client with the old token missed the deletion of album1 and must load all albums again
+        response = self.get_changes(old_token)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(int(response.json()['token']), versions.get_version(versions.ALBUM_CHANGES))
+        self.assertEqual(self.get_changes(token).json()['deleted'], [album2.id])
+        self.assertEqual(self.get_changes(0).status_code, 200)
+
+
+class ConditionalRequestTest(TestCase):
+    def test_data_etag_changes_when_album_is_deleted(self):
+        album1 = Album.objects.create(name='Album 1', artist='Artist')
+        Album.objects.create(name='Album 2', artist='Artist')
+        response = self.client.get(reverse('albums:album_data'))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(reverse('albums:album_data'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # deleted directly in the db, the change counter is incremented by a trigger
+        Album.objects.filter(id=album1.id).delete()
+        response = self.client.get(reverse('albums:album_data'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([album['name'] for album in response.json()], ['Album 2'])
+
+    def test_report_etag_changes_when_album_is_deleted(self):
+        ReportDefinition.objects.create(
+            report_type='albums_report', report_definition=json.dumps(get_report_definition()),
+            last_modified_at=datetime.datetime.now())
+        album = Album.objects.create(name='Album', artist='Artist')
+        etag = get_report_etag(None)
+        Album.objects.filter(id=album.id).delete()
+        self.assertNotEqual(get_report_etag(None), etag)
+
+    def test_report_not_modified(self):
+        ReportDefinition.objects.create(
+            report_type='albums_report', report_definition=json.dumps(get_report_definition()),
+            last_modified_at=datetime.datetime.now())
+        Album.objects.create(name='Album', artist='Artist')
+        response = self.client.get(reverse('albums:album_report'))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('albums:album_report'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_preview_etag(self):
+        artifact_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(artifact_dir.cleanup)
+        with override_settings(ALBUMS_ARTIFACT_DIR=artifact_dir.name):
+            key = str(uuid.uuid4())
+            path, size = artifacts.store(b'%PDF preview')
+            previews.add_report_request(
+                key, '{}', '{}', True, pdf_file_path=path, pdf_file_size=size, created_on=datetime.datetime.now())
+            params = dict(key=key, outputFormat='pdf')
+            response = self.client.get(reverse('albums:report_run'), params)
+            self.assertEqual(response.status_code, 200)
+            # the hash of the stored file
+            self.assertEqual(response['ETag'], '"%s"' % os.path.basename(path))
+            response = self.client.get(reverse('albums:report_run'), params, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(reverse('albums:report_run'), params, HTTP_IF_NONE_MATCH='"other"')
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(ALBUMS_PDF_CACHE=dict(BACKEND='albums.pdf_cache.LocMemBackend'))
+class PdfCacheTest(TestCase):
+    def test_cached_report_is_invalidated_when_album_changes(self):
+        album = Album.objects.create(name='Album', artist='Artist', year=2000)
+        stats = pdf_cache.get_cache().stats
+        response = self.client.get(reverse('albums:album_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats, dict(hits=0, misses=1, evictions=0))
+        self.assertEqual(self.client.get(reverse('albums:album_report')).content, response.content)
+        self.assertEqual(stats['hits'], 1)
+        # the report of another year is cached separately
+        self.assertEqual(self.client.get(reverse('albums:album_report'), dict(year=2000)).status_code, 200)
+        self.assertEqual(stats['misses'], 2)
+
+        # modified directly in the db, the change counter is incremented by a trigger
+        Album.objects.filter(id=album.id).update(name='Album modified')
+        self.assertEqual(self.client.get(reverse('albums:album_report')).status_code, 200)
+        self.assertEqual(stats, dict(hits=1, misses=3, evictions=0))
+        self.assertEqual(self.client.get(reverse('albums:album_report')).status_code, 200)
+        self.assertEqual(stats['hits'], 2)
+
+        Album.objects.filter(id=album.id).delete()
+        self.assertEqual(self.client.get(reverse('albums:album_report')).status_code, 200)
+        self.assertEqual(stats, dict(hits=2, misses=4, evictions=0))
+
+
+class PreviewStorageTest(TestCase):
+    def setUp(self):
+        artifact_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(artifact_dir.cleanup)
+        self.artifact_dir = artifact_dir.name
+        settings_override = override_settings(
+            ALBUMS_ARTIFACT_DIR=self.artifact_dir, ALBUMS_PREVIEW_EVICTION=dict(TTL=180, MAX_SIZE=10000))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def add_preview(self, key, report_definition, content, created_on=None):
+        pdf_file_path, pdf_file_size = artifacts.store(content)
+        previews.add_report_request(
+            key, report_definition, '{"albums": []}', True, pdf_file_path=pdf_file_path,
+            pdf_file_size=pdf_file_size, created_on=created_on or datetime.datetime.now())
+        eviction.add_usage(pdf_file_size)
+        return pdf_file_path
+
+    def test_definition_is_stored_once(self):
+        self.add_preview('1', '{"version": 1}', b'pdf 1')
+        self.add_preview('2', '{"version": 1}', b'pdf 2')
+        self.add_preview('3', '{"version": 2}', b'pdf 3')
+        self.assertEqual(ReportRequestDefinition.objects.count(), 2)
+        report_request = ReportRequest.objects.select_related('definition').get(key='2')
+        self.assertEqual(report_request.definition, ReportRequest.objects.get(key='1').definition)
+        self.assertEqual(previews.decompress_json(report_request.definition.report_definition), '{"version": 1}')
+        self.assertEqual(previews.decompress_json(report_request.data), '{"albums": []}')
+
+    def test_evict_expired_previews(self):
+        old = datetime.datetime.now() - datetime.timedelta(seconds=600)
+        shared_path = self.add_preview('1', '{"version": 1}', b'pdf', created_on=old)
+        self.add_preview('2', '{"version": 1}', b'pdf')
+        old_path = self.add_preview('3', '{"version": 2}', b'old pdf', created_on=old)
+
+        self.assertEqual(eviction.evict(), 2)
+        self.assertEqual(list(ReportRequest.objects.values_list('key', flat=True)), ['2'])
+        # definition and file still referenced by the remaining preview are kept
+        self.assertEqual(ReportRequestDefinition.objects.count(), 1)
+        self.assertTrue(os.path.exists(artifacts.get_full_path(shared_path)))
+        self.assertFalse(os.path.exists(artifacts.get_full_path(old_path)))
+        self.assertEqual(eviction.get_total_size(), eviction.resync())
+
+    def test_evict_oldest_previews_above_max_size(self):
+        now = datetime.datetime.now()
+        for i in range(5):
+            self.add_preview(
+                str(i), '{"version": %d}' % i, b'%d' % i * 3000, created_on=now - datetime.timedelta(seconds=i))
+        self.assertEqual(eviction.get_total_size(), 15000)
+        self.assertEqual(eviction.evict(), 2)
+        self.assertEqual(sorted(ReportRequest.objects.values_list('key', flat=True)), ['0', '1', '2'])
+        self.assertEqual(ReportRequestDefinition.objects.count(), 3)
+        self.assertEqual(eviction.get_total_size(), 9000)
+
+    def test_find_preview(self):
+        now = datetime.datetime.now()
+        path = self.add_preview('1', '{"version": 1}', b'pdf', created_on=now - datetime.timedelta(seconds=100))
+        ReportRequest.objects.filter(key='1').update(request_hash='hash')
+        self.assertEqual(previews.find_preview('hash'), '1')
+        # the found preview is not evicted right away
+        self.assertGreaterEqual(ReportRequest.objects.get(key='1').created_on, now)
+        self.assertIsNone(previews.find_preview('other hash'))
+        artifacts.delete([path])
+        self.assertIsNone(previews.find_preview('hash'))
+
+
+@override_settings(ALBUMS_PREVIEW_EVICTION=dict(TTL=180, MAX_SIZE=10000))
+class EvictionTest(TestCase):
+    def setUp(self):
+        artifact_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(artifact_dir.cleanup)
+        settings_override = override_settings(ALBUMS_ARTIFACT_DIR=artifact_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def add_preview(self, key, content):
+        pdf_file_path, pdf_file_size = artifacts.store(content)
+        previews.add_report_request(
+            key, '{}', '{}', True, pdf_file_path=pdf_file_path, pdf_file_size=pdf_file_size,
+            created_on=datetime.datetime.now())
+        eviction.add_usage(pdf_file_size)
+        return pdf_file_path
+
+    def test_running_total(self):
+        self.add_preview('1', b'1' * 3000)
+        self.add_preview('2', b'2' * 2000)
+        self.assertEqual(eviction.get_total_size(), 5000)
+        self.assertEqual(eviction.delete_report_requests(ReportRequest.objects.filter(key='1')), 1)
+        self.assertEqual(eviction.get_total_size(), 2000)
+        # nothing to evict below the size limit
+        self.assertEqual(eviction.evict(), 0)
+
+    def test_drifted_total_is_resynced(self):
+        self.add_preview('1', b'1' * 3000)
+        # e.g. a preview was deleted without updating the total
+        ReportRequest.objects.filter(key='1').delete()
+        eviction.add_usage(20000)
+        self.assertEqual(eviction.get_total_size(), 23000)
+        # there is nothing left to evict, the total is recalculated
+        self.assertEqual(eviction.evict(), 0)
+        self.assertEqual(eviction.get_total_size(), 0)
+
+    def test_file_referenced_by_job_is_kept(self):
+        path = self.add_preview('1', b'pdf')
+        ReportJob.objects.create(
+            key='job', status=ReportJob.STATUS_FINISHED, output_format='pdf', filename='report.pdf',
+            result_file_path=path, result_file_size=3, created_on=datetime.datetime.now())
+        eviction.delete_report_requests(ReportRequest.objects.all())
+        self.assertTrue(os.path.exists(artifacts.get_full_path(path)))
+        jobs.delete_jobs(ReportJob.objects.all())
+        self.assertFalse(os.path.exists(artifacts.get_full_path(path)))
+
+    def test_command(self):
+        self.add_preview('1', b'1' * 3000)
+        ReportRequest.objects.filter(key='1').update(created_on=datetime.datetime.now() - datetime.timedelta(hours=1))
+        out = io.StringIO()
+        call_command('evict_report_requests', '--resync', stdout=out)
+        self.assertIn('deleted 1 report requests, total size 0 bytes', out.getvalue())
+        self.assertEqual(ReportRequest.objects.count(), 0)
+
+
+@override_settings(ALBUMS_PREVIEW_EVICTION=dict(BACKGROUND=False))
+class PreviewDedupTest(TransactionTestCase):
+    # the xlsx file of a preview is rendered by another thread, so the test data must be committed
+
+    def setUp(self):
+        artifact_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(artifact_dir.cleanup)
+        settings_override = override_settings(ALBUMS_ARTIFACT_DIR=artifact_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def add_preview(self, albums):
+        response = self.client.put(reverse('albums:report_run'), json.dumps(dict(
+            report=get_report_definition(), data=dict(albums=albums), isTestData=True, outputFormat='pdf')),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        key = response.content.decode('utf-8')[len('key:'):]
+        # the xlsx file must be rendered before the test data is deleted
+        self.addCleanup(previews.wait_for_xlsx, key)
+        return key
+
+    def test_identical_preview_is_reused(self):
+        albums = [dict(name='Album', artist='Artist', year=2000)]
+        key = self.add_preview(albums)
+        self.assertEqual(self.add_preview(albums), key)
+        self.assertEqual(ReportRequest.objects.count(), 1)
+        self.assertNotEqual(self.add_preview([dict(name='Other Album', artist='Artist', year=2000)]), key)
+        self.assertEqual(ReportRequest.objects.count(), 2)
+
+    def test_request_hash(self):
+        self.assertEqual(
+            previews.get_request_hash(dict(a=1, b=2), dict(albums=[]), True, 'pdf'),
+            previews.get_request_hash(dict(b=2, a=1), dict(albums=[]), True, 'pdf'))
+        self.assertNotEqual(
+            previews.get_request_hash(dict(a=1), dict(albums=[]), True, 'pdf'),
+            previews.get_request_hash(dict(a=1), dict(albums=[]), False, 'pdf'))
+
+    def test_identical_request_waits_for_render_lock(self):
+        rendered_concurrently = []
+        with previews.render_lock('hash') as rendered:
+            self.assertFalse(rendered)
+            thread = threading.Thread(target=self.wait_for_render_lock, args=(rendered_concurrently,))
+            thread.start()
+            time.sleep(0.1)
+            self.assertEqual(rendered_concurrently, [])
+        thread.join()
+        self.assertEqual(rendered_concurrently, [True])
+
+    def wait_for_render_lock(self, rendered_concurrently):
+        with previews.render_lock('hash') as rendered:
+            rendered_concurrently.append(rendered)
+
+
+class ArtifactStoreTest(TestCase):
+    def setUp(self):
+        artifact_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(artifact_dir.cleanup)
+        self.artifact_dir = artifact_dir.name
+        settings_override = override_settings(ALBUMS_ARTIFACT_DIR=self.artifact_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get_download(self, key):
+        return self.client.get(reverse('albums:report_run'), dict(key=key, outputFormat='pdf'))
+
+    def test_identical_files_are_stored_once(self):
+        path, size = artifacts.store(b'pdf')
+        self.assertEqual(artifacts.store(b'pdf'), (path, size))
+        self.assertEqual(size, 3)
+        self.assertNotEqual(artifacts.store(b'other pdf')[0], path)
+        self.assertEqual(sorted(len(files) for _, _, files in os.walk(self.artifact_dir) if files), [1, 1])
+        with open(artifacts.get_full_path(path), 'rb') as f:
+            self.assertEqual(f.read(), b'pdf')
+        artifacts.delete([path, path])
+        self.assertFalse(os.path.exists(artifacts.get_full_path(path)))
+
+    def test_stored_file_is_streamed(self):
+        key = str(uuid.uuid4())
+        path, size = artifacts.store(b'%PDF stored')
+        previews.add_report_request(
+            key, '{}', '{}', True, pdf_file_path=path, pdf_file_size=size, created_on=datetime.datetime.now())
+        response = self.get_download(key)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF stored')
+
+        # sent by the web server
+        with override_settings(ALBUMS_ARTIFACT_ACCEL_REDIRECT='/artifacts/'):
+            response = self.get_download(key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/artifacts/' + path.replace(os.sep, '/'))
+        self.assertEqual(response.content, b'')
+
+
+class XlsxPrerenderTest(TestCase):
+    def setUp(self):
+        # the background thread is blocked, so all prerendered xlsx files are queued
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        self.blocked = threading.Event()
+        self.addCleanup(self.blocked.set)
+        executor.submit(self.blocked.wait)
+        self.addCleanup(setattr, previews, '_xlsx_executor', previews._xlsx_executor)
+        previews._xlsx_executor = executor
+
+    def prerender(self, key):
+        previews.prerender_xlsx(key, '{}', '{}', False, None)
+
+    def test_queued_xlsx_is_not_waited_for(self):
+        stats = dict(previews.xlsx_stats)
+        self.prerender('1')
+        start = time.monotonic()
+        self.assertFalse(previews.wait_for_xlsx('1'))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(previews.xlsx_stats['cancelled'], stats['cancelled'] + 1)
+        self.assertEqual(previews.xlsx_stats['waited'], stats['waited'])
+        self.assertFalse(previews.wait_for_xlsx('1'))
+
+    def test_queue_is_bounded(self):
+        stats = dict(previews.xlsx_stats)
+        keys = [str(i) for i in range(previews.MAX_XLSX_QUEUE + 2)]
+        for key in keys:
+            self.prerender(key)
+        self.assertEqual(previews.xlsx_stats['skipped'], stats['skipped'] + 2)
+        for key in keys:
+            self.assertFalse(previews.wait_for_xlsx(key))
+        self.assertEqual(previews.xlsx_stats['cancelled'], stats['cancelled'] + previews.MAX_XLSX_QUEUE)
+
+    def test_prerendered_xlsx_is_downloaded(self):
+        artifact_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(artifact_dir.cleanup)
+        key = str(uuid.uuid4())
+        report_definition = json.dumps(get_report_definition())
+        data = json.dumps(dict(albums=[dict(name='Album', artist='Artist', year=2000)]))
+        stats = dict(previews.xlsx_stats)
+        with override_settings(ALBUMS_ARTIFACT_DIR=artifact_dir.name):
+            previews.add_report_request(key, report_definition, data, True, created_on=datetime.datetime.now())
+            # rendered directly instead of by the blocked background thread
+            self.assertTrue(previews._render_xlsx(key, report_definition, data, True, None))
+            response = self.client.get(reverse('albums:report_run'), dict(key=key, outputFormat='xlsx'))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+        self.assertEqual(previews.xlsx_stats['rendered'], stats['rendered'] + 1)
+        self.assertEqual(previews.xlsx_stats['used'], stats['used'] + 1)
+
+
+class RenderSlotsTest(TestCase):
+    def test_acquire_and_release(self):
+        slots = admission.RenderSlots(2, 1)
+        slots.acquire(0)
+        slots.acquire(0)
+        self.assertEqual(slots.used, 2)
+        self.assertFalse(slots.try_acquire())
+        with self.assertRaises(admission.RenderBusyError):
+            slots.acquire(0.01)
+        self.assertEqual(slots.get_queue_depth(), 0)
+        slots.release()
+        self.assertTrue(slots.try_acquire())
+        slots.release()
+        slots.release()
+        self.assertEqual(slots.used, 0)
+
+    def test_queue(self):
+        slots = admission.RenderSlots(1, 1)
+        slots.acquire(0)
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(slots.acquire(5)))
+        waiter.start()
+        while slots.get_queue_depth() == 0:
+            time.sleep(0.01)
+        # the queue is full, further requests are rejected without waiting and try_acquire must
+        # not take the slot released for the waiting request
+        with self.assertRaises(admission.RenderBusyError):
+            slots.acquire(5)
+        slots.release()
+        waiter.join()
+        self.assertEqual(acquired, [None])
+        self.assertEqual((slots.used, slots.get_queue_depth()), (1, 0))
+        self.assertFalse(slots.try_acquire())
+
+    def test_async_acquire(self):
+        slots = admission.RenderSlots(1, 2)
+
+        async def acquire_all():
+            await slots.aacquire(0)
+            waiter = asyncio.ensure_future(slots.aacquire(5))
+            await asyncio.sleep(0.01)
+            self.assertEqual(slots.get_queue_depth(), 1)
+            with self.assertRaises(admission.RenderBusyError):
+                await slots.aacquire(0.01)
+            slots.release()
+            await waiter
+
+        asyncio.run(acquire_all())
+        self.assertEqual((slots.used, slots.get_queue_depth()), (1, 0))
+
+
+@override_settings(ALBUMS_RENDER_POOL=dict(MAX_PENDING=2, MAX_QUEUE=2, QUEUE_TIMEOUT=1, SHARED_SLOTS=1))
+class SharedSlotsTest(TestCase):
+    def test_waiting_for_shared_slot_does_not_block_sync_thread(self):
+        token = admission.acquire_shared_slot(1, admission.timer() + 1)
+        self.addCleanup(admission.release_shared_slot, token)
+
+        async def wait_for_slot():
+            with self.assertRaises(admission.RenderBusyError):
+                async with admission.arender_slot():
+                    pass
+
+        async def query():
+            await asyncio.sleep(0.1)
+            start = time.monotonic()
+            await sync_to_async(Album.objects.count)()
+            return time.monotonic() - start
+
+        async def main():
+            _, duration = await asyncio.gather(wait_for_slot(), query())
+            return duration
+
+        # db queries of other requests are executed while the request waits for the shared slot
+        self.assertLess(async_to_sync(main)(), 0.5)
+
+
+@override_settings(ALBUMS_RENDER_POOL=dict(MAX_PENDING=1, MAX_QUEUE=0, RETRY_AFTER=7))
+class AdmissionTest(TestCase):
+    def test_busy_response(self):
+        Album.objects.create(name='Album', artist='Artist', year=2000)
+        rejected = admission.stats['rejected']
+        slots = admission.get_slots()
+        slots.acquire(0)
+        try:
+            response = self.client.get(reverse('albums:album_report'))
+        finally:
+            slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(admission.stats['rejected'], rejected + 1)
+        self.assertEqual(slots.used, 0)
+
+    def test_prerender_does_not_wait(self):
+        stats = dict(previews.xlsx_stats)
+        rejected = admission.stats['rejected']
+        slots = admission.get_slots()
+        slots.acquire(0)
+        try:
+            start = time.monotonic()
+            self.assertFalse(previews._render_xlsx('key', '{}', '{}', True, None))
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            slots.release()
+        self.assertEqual(previews.xlsx_stats['skipped'], stats['skipped'] + 1)
+        self.assertEqual(previews.xlsx_stats['failed'], stats['failed'])
+        self.assertEqual(admission.stats['rejected'], rejected)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.albums = [
+            Album.objects.create(name='Blue Train', artist='John Coltrane', year=1957),
+            Album.objects.create(name='Kind of Blue', artist='Miles Davis', year=1959),
+            Album.objects.create(name='Giant Steps', artist='John Coltrane', year=1960),
+            Album.objects.create(name='Blueprint', artist='Other Artist', year=1959),
+        ]
+
+    def search(self, **params):
+        response = self.client.get(reverse('albums:album_search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_names(self, **params):
+        return sorted(album['name'] for album in self.search(**params)['albums'])
+
+    def test_prefix(self):
+        self.assertEqual(self.get_names(q='blue'), ['Blue Train', 'Blueprint', 'Kind of Blue'])
+        self.assertEqual(self.get_names(q='John Col'), ['Blue Train', 'Giant Steps'])
+        # all words must match, only the last one is used as prefix
+        self.assertEqual(self.get_names(q='blu train'), [])
+        self.assertEqual(self.get_names(q=''), [])
+
+    def test_year_filter(self):
+        self.assertEqual(self.get_names(q='blue', year=1959), ['Blueprint', 'Kind of Blue'])
+        self.assertEqual(self.get_names(q='coltrane', year=1959), [])
+        response = self.client.get(reverse('albums:album_search'), dict(q='blue', year='x'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages(self):
+        rv = self.search(q='blue', limit=2)
+        self.assertEqual((len(rv['albums']), rv['next']), (2, 2))
+        next_rv = self.search(q='blue', limit=2, offset=rv['next'])
+        self.assertEqual((len(next_rv['albums']), next_rv['next']), (1, None))
+        self.assertEqual(
+            sorted(album['id'] for album in rv['albums'] + next_rv['albums']),
+            sorted(album.id for album in self.albums if 'Blue' in album.name))
+
+    def test_index_is_updated(self):
+        Album.objects.filter(id=self.albums[2].id).update(name='Ballads')
+        Album.objects.filter(id=self.albums[0].id).delete()
+        self.assertEqual(self.get_names(q='coltrane'), ['Ballads'])
+        self.assertEqual(self.get_names(q='giant'), [])
+
+    def test_operators_are_not_interpreted(self):
+        self.assertEqual(self.get_names(q='blue OR giant'), [])
+        self.assertEqual(self.get_names(q='(blue "'), ['Blue Train', 'Blueprint', 'Kind of Blue'])
+        self.assertEqual(search.get_match_query('a "b" c'), '"a" "b" "c"*')
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Album.objects.create(name='=HYPERLINK("http://example.com")', artist='@SUM(1+1)', year=2000)
+        Album.objects.create(name='-1', artist='Artist', year=2001, best_of_compilation=True)
+
+    def get_export(self, export_format):
+        response = self.client.get(reverse('albums:album_export'), dict(format=export_format))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_formulas_are_escaped(self):
+        rows = list(csv.reader(io.StringIO(self.get_export('csv').decode('utf-8'))))
+        self.assertEqual(len(rows), 3)
+        # albums are sorted by name
+        self.assertEqual(rows[1][1:], ["'-1", 'Artist', '2001', 'True'])
+        self.assertEqual(rows[2][1:], ['\'=HYPERLINK("http://example.com")', "'@SUM(1+1)", '2000', 'False'])
+
+    def test_xlsx_text_is_not_written_as_formula(self):
+        with zipfile.ZipFile(io.BytesIO(self.get_export('xlsx'))) as xlsx_file:
+            sheet = xlsx_file.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertNotIn('<f>', sheet)
+        self.assertIn('<t>=HYPERLINK("http://example.com")</t>', sheet)
+        self.assertIn('<t>@SUM(1+1)</t>', sheet)
+        self.assertIn('<t>-1</t>', sheet)
+
+
+@override_settings(ALBUMS_ROW_CACHE=dict(MAX_SIZE=1000))
+class RowCacheTest(TestCase):
+    def setUp(self):
+        row_cache.clear()
+
+    def encode(self, rows):
+        hits, misses = row_cache.stats['hits'], row_cache.stats['misses']
+        fragments = row_cache.encode_rows(rows)
+        self.assertEqual([json.loads(fragment)['id'] for fragment in fragments], [row[0] for row in rows])
+        return row_cache.stats['hits'] - hits, row_cache.stats['misses'] - misses
+
+    def test_more_albums_than_max_size(self):
+        Album.objects.bulk_create(Album(name='Album %d' % i, artist='Artist') for i in range(1001))
+        rows = list(Album.objects.order_by('id').values_list(*row_cache.FIELDS))
+        self.assertEqual(self.encode(rows), (0, 1001))
+        for i in range(3):
+            self.assertEqual(self.encode(rows), (1000, 1))
+
+    def test_least_recently_used_albums_are_evicted(self):
+        Album.objects.bulk_create(Album(name='Album %d' % i, artist='Artist') for i in range(2000))
+        rows = list(Album.objects.order_by('id').values_list(*row_cache.FIELDS))
+        self.assertEqual(self.encode(rows[:1000]), (0, 1000))
+        self.assertEqual(self.encode(rows[:1000]), (1000, 0))
+        # the least recently used albums are evicted for other albums
+        self.assertEqual(self.encode(rows[1000:1500])[0], 0)
+        self.encode(rows[1000:1500])
+        self.assertEqual(self.encode(rows[1000:1500]), (500, 0))
+        self.assertEqual(self.encode(rows[500:1000]), (500, 0))
+        self.assertEqual(self.encode(rows[:500]), (0, 500))
+
+    def test_modified_album_is_encoded_again(self):
+        album = Album.objects.create(name='Album', artist='Artist')
+        self.assertEqual(self.encode(list(Album.objects.values_list(*row_cache.FIELDS))), (0, 1))
+        Album.objects.filter(id=album.id).update(name='Album modified')
+        rows = list(Album.objects.values_list(*row_cache.FIELDS))
+        self.assertEqual(self.encode(rows), (0, 1))
+        self.assertEqual(json.loads(row_cache.encode_rows(rows)[0])['name'], 'Album modified')
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(ALBUMS_PROFILING=dict(ENABLED=True, TOKEN='secret', DIR=directory.name))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get_profiled_functions(self, response):
+        profile_id = response[profiling.RESPONSE_HEADER]
+        stats = pstats.Stats(profiling.get_profile_path(profile_id, 'pstats'))
+        return {(os.path.basename(filename), name) for filename, line, name in stats.stats}
+
+    def test_async_view_is_profiled(self):
+        Album.objects.create(name='Album', artist='Artist')
+        # the test client calls async views in an event loop in another thread, same as under wsgi
+        response = self.client.get(reverse('albums:album_data'), dict(profile='secret'))
+        self.assertEqual(response.status_code, 200)
+        functions = self.get_profiled_functions(response)
+        self.assertIn(('album_views.py', 'data'), functions)
+        self.assertIn(('row_cache.py', 'encode_rows'), functions)
+
+    def test_not_profiled_without_token(self):
+        response = self.client.get(reverse('albums:album_data'), dict(profile='other'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(profiling.RESPONSE_HEADER, response)
+
+
+class BenchmarkTest(TestCase):
+    def render(self):
+        rv = render_pool.render(rendering.render_report, get_report_definition(), dict(albums=[]), True, 'pdf', None)
+        self.assertIn('file', rv)
+
+    def test_measure(self):
+        calls = []
+        result = benchmark.Command.measure(calls.append, 2, 10)
+        self.assertEqual(calls, [-1, -2] + list(range(10)))
+        self.assertEqual(result['iterations'], 10)
+        self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+        self.assertGreater(result['peak_rss_kb'], 0)
+
+    def test_workers_peak_rss(self):
+        self.render()
+        # the worker processes are stopped to get their peak memory
+        self.assertGreater(benchmark.Command.get_workers_peak_rss_kb(), 0)
+        # and started again by the next report
+        self.render()
+
+
+@skipIf(PdfReader is None, 'pypdf is not installed')
+@override_settings(ALBUMS_PARTITIONED_RENDERING=dict(ENABLED=True, MIN_ROWS=0, CHUNK_SIZE=40))
+class PartitionedRenderingTest(TestCase):
+    def get_pages(self, rv):
+        self.assertNotIn('errors', rv)
+        return [page.extract_text() for page in PdfReader(io.BytesIO(rv['file'])).pages]
+
+    def test_same_pages_as_whole_report(self):
+        report_definition = get_report_definition()
+        albums = [dict(name='Album %d' % i, artist='Artist', year=2000, best_of_compilation=False) for i in range(130)]
+        data = dict(year=None, albums=albums, current_date=datetime.datetime.now())
+        pages = self.get_pages(rendering.render_report(report_definition, data, False, 'pdf'))
+        partitioned_pages = self.get_pages(partitioning.render_pdf(report_definition, data, 'albums'))
+        self.assertGreater(len(pages), 3)
+        self.assertEqual(len(partitioned_pages), len(pages))
+        for i, page in enumerate(partitioned_pages):
+            self.assertIn('Page %d / %d' % (i + 1, len(pages)), page)
+            # same albums on each page
+            self.assertEqual(re.findall(r'Album \d+', page), re.findall(r'Album \d+', pages[i]))
+
+    @override_settings(ALBUMS_PDF_CACHE=None)
+    def test_report_view(self):
+        Album.objects.bulk_create(
+            [Album(name='Album %03d' % i, artist='Artist', year=2000, best_of_compilation=False) for i in range(130)])
+        response = self.client.get(reverse('albums:album_report'))
+        self.assertEqual(response.status_code, 200)
+        with override_settings(ALBUMS_PARTITIONED_RENDERING=dict(ENABLED=False)):
+            pages = self.get_pages(dict(file=self.client.get(reverse('albums:album_report')).content))
+        partitioned_pages = self.get_pages(dict(file=response.content))
+        self.assertEqual(len(partitioned_pages), len(pages))
+        self.assertEqual([re.findall(r'Album \d+', page) for page in partitioned_pages],
+                         [re.findall(r'Album \d+', page) for page in pages])
+
+    def test_partition_definitions(self):
+        report_definition = get_report_definition()
+        partition_definitions = partitioning.get_partition_definitions(report_definition, 'albums')
+        self.assertEqual(
+            [element['id'] for element in partition_definitions['middle']['docElements']
+             if element.get('containerId') == '0_content'], [partition_definitions['table_id']])
+        # the rows are not shown in a table of the content band
+        self.assertIsNone(partitioning.get_partition_definitions(report_definition, 'other'))
+
+    def test_chunk_sizes(self):
+        self.assertEqual(partitioning.get_chunk_sizes(130, 40, 33, 34), [33, 34, 34, 29])
+        self.assertEqual(partitioning.get_chunk_sizes(200, 80, 10, 20), [70, 80, 50])
+        # rows per page unknown
+        self.assertEqual(partitioning.get_chunk_sizes(100, 40, None, None), [40, 40, 20])
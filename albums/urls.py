@@ -1,7 +1,7 @@
 from django.urls import path
 from django.views.generic import RedirectView
 
-from . import album_views, report_views
+from . import album_views, job_views, profile_views, report_views
 
 app_name = 'albums'
 urlpatterns = [
@@ -9,10 +9,19 @@ urlpatterns = [
     path('album/data/', album_views.data, name='album_data'),
     path('album/edit/', album_views.edit, name='album_edit'),
     path('album/edit/<int:album_id>/', album_views.edit, name='album_edit'),
+    path('album/export/', album_views.export_albums, name='album_export'),
+    path('album/import/', album_views.bulk_import, name='album_import'),
     path('album/index/', album_views.index, name='album_index'),
     path('album/report/', album_views.report, name='album_report'),
+    path('album/report/job/', job_views.album_report, name='album_report_job'),
     path('album/save/', album_views.save, name='album_save'),
+    path('album/search/', album_views.search_albums, name='album_search'),
+    path('profile/', profile_views.index, name='profile_index'),
+    path('profile/<str:profile_id>/<str:profile_format>/', profile_views.download, name='profile_download'),
     path('report/edit/', report_views.edit, name='report_edit'),
+    path('report/job/<str:key>/', job_views.status, name='report_job'),
+    path('report/job/<str:key>/file/', job_views.download, name='report_job_file'),
     path('report/run/', report_views.run, name='report_run'),
+    path('report/run/job/', job_views.preview, name='report_run_job'),
     path('report/save/<str:report_type>/', report_views.save, name='report_save'),
 ]
\ No newline at end of file
@@ -1,5 +1,6 @@
 import datetime
 import decimal
+import hmac
 import json
 import os
 from django.conf import settings
@@ -7,6 +8,9 @@ from django.urls import reverse
 from django.utils.translation import gettext as _
 from .models import ReportDefinition
 
+# album values returned by the album views and passed to the album report
+ALBUM_FIELDS = ('id', 'name', 'artist', 'year', 'best_of_compilation')
+
 
 def create_album_report_template():
     # use a predefined report definition so you don't have to start from scratch in this demo app,
@@ -29,6 +33,50 @@ def get_menu_items(controller):
          'id': 'menu_report', 'class': 'activeMenuItem' if controller == 'report' else ''})
 
 
+def validate_album(album):
+    """Performs some basic form validation of the given album values.
+
+    Returns the values which can be saved in the album table and a list of errors.
+    """
+    values = dict()
+    errors = []
+    if not album.get('name'):
+        errors.append(dict(field='name', msg=str(_('error.the field must not be empty'))))
+    else:
+        values['name'] = album.get('name')
+    if not album.get('artist'):
+        errors.append(dict(field='artist', msg=str(_('error.the field must not be empty'))))
+    else:
+        values['artist'] = album.get('artist')
+    if album.get('year'):
+        try:
+            values['year'] = int(album.get('year'))
+            if values['year'] < 1900 or values['year'] > 2100:
+                errors.append(dict(field='year', msg=str(_('error.the field must contain a valid year'))))
+        except (ValueError, TypeError):
+            errors.append(dict(field='year', msg=str(_('error.the field must contain a number'))))
+    else:
+        values['year'] = None
+    best_of_compilation = album.get('best_of_compilation')
+    if best_of_compilation is None or isinstance(best_of_compilation, bool):
+        values['best_of_compilation'] = bool(best_of_compilation)
+    else:
+        errors.append(dict(field='best_of_compilation', msg=str(_('error.the field must contain a boolean value'))))
+    return values, errors
+
+
+def has_valid_token(request, token):
+    """Returns True if the request contains the header *Authorization: Bearer <token>*.
+
+    Always False if no token is configured.
+    """
+    if not token:
+        return False
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    scheme, _sep, value = authorization.partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(value.strip().encode('utf-8'), token.encode('utf-8'))
+
+
 def json_default(obj):
     """Serializes decimal and date values, can be used for json encoder."""
     if isinstance(obj, decimal.Decimal):
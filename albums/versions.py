@@ -0,0 +1,39 @@
+from django.db.models import F
+
+from .models import DataVersion
+
+# last sequence number assigned to an album change (Album.change_seq), this is
+# incremented by db triggers for every added, modified and deleted album
+ALBUM_CHANGES = 'album_changes'
+# highest change sequence number of the deleted tombstones (album_tombstone), changes
+# cannot be synced anymore for an older change token
+ALBUM_TOMBSTONES_PRUNED = 'album_tombstones_pruned'
+
+
+def get_version(name):
+    """Returns the current version of the given data, 0 if the data was never modified."""
+    version = DataVersion.objects.filter(name=name).values_list('version', flat=True).first()
+    return version or 0
+
+
+async def aget_version(name):
+    """Same as *get_version* for async views."""
+    version = await DataVersion.objects.filter(name=name).values_list('version', flat=True).afirst()
+    return version or 0
+
+
+def bump_version(name):
+    """Increments the version of the given data, must be called after the data was modified."""
+    if DataVersion.objects.filter(name=name).update(version=F('version') + 1) == 0:
+        _, created = DataVersion.objects.get_or_create(name=name, defaults=dict(version=1))
+        if not created:
+            # counter was created by a concurrent request in the meantime
+            DataVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+
+def raise_version(name, version):
+    """Sets the version of the given data to *version* unless the current version is higher."""
+    if DataVersion.objects.filter(name=name, version__lt=version).update(version=version) == 0:
+        _, created = DataVersion.objects.get_or_create(name=name, defaults=dict(version=version))
+        if not created:
+            DataVersion.objects.filter(name=name, version__lt=version).update(version=version)
@@ -0,0 +1,54 @@
+import datetime
+import logging
+from timeit import default_timer as timer
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# duration of the warm start in seconds, None if it was not executed in this process
+duration = None
+
+
+def is_enabled():
+    return getattr(settings, 'ALBUMS_WARM_START', False)
+
+
+def warm_up():
+    """Does all the work which is otherwise done by the first report request of a process.
+
+    reportbro is imported, the album report template is loaded (and created if it does not
+    exist yet) into the template cache and an empty report is rendered as pdf and xlsx so
+    fonts and all modules needed for rendering are loaded. When this is called in the main
+    process before worker processes are forked (e.g. gunicorn --preload) the loaded modules
+    and the cached template are shared by all workers.
+
+    Afterwards the worker processes of the render pool are started (see render_pool.start),
+    processes forked later on start their own render pool right away.
+    """
+    global duration
+    start = timer()
+    from reportbro import Report
+
+    from . import render_pool, template_cache
+    from .utils import create_album_report_template
+
+    try:
+        template = template_cache.get_template('albums_report')
+        if template is None:
+            create_album_report_template()
+            template = template_cache.get_template('albums_report')
+        if template is not None and not template.errors:
+            data = dict(year=None, albums=[], current_date=datetime.datetime.now())
+            Report(template.report_definition, data).generate_pdf()
+            Report(template.report_definition, data).generate_xlsx()
+    except DatabaseError:
+        # e.g. the db is not migrated yet, the template is loaded by the first request instead
+        logger.warning('warm start could not load the report template', exc_info=True)
+    finally:
+        # db connections must not be shared with forked worker processes
+        connections.close_all()
+    render_pool.start()
+    duration = timer() - start
+    logger.info('warm start finished in %.3f seconds', duration)
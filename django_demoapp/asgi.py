@@ -0,0 +1,22 @@
+"""
+ASGI config for django_demoapp project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_demoapp.settings')
+
+application = get_asgi_application()
+
+# optionally load reportbro and the report template when the application is loaded (see wsgi.py)
+from albums import warmup  # noqa: E402
+
+if warmup.is_enabled():
+    warmup.warm_up()
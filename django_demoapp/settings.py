@@ -41,11 +41,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # measures all requests, see /metrics
+    'albums.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # profiles requests on demand (must be after AuthenticationMiddleware), see ALBUMS_PROFILING
+    'albums.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,6 +73,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'django_demoapp.wsgi.application'
+ASGI_APPLICATION = 'django_demoapp.asgi.application'
 
 
 # Database
@@ -78,9 +83,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'albumapp.sqlite'),
-    }
+        # keep connections open between requests, pragmas (ALBUMS_SQLITE_PRAGMAS)
+        # are executed once per connection. Set to 0 when served by asgi (django_demoapp.asgi),
+        # async views query the db in a new thread for every request so connections cannot be reused
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # optional databases, see albums.db.AlbumRouter:
+    # separate connection for reading the album catalog
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': os.path.join(BASE_DIR, 'albumapp.sqlite'),
+    #     'CONN_MAX_AGE': 600,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+    # report previews and jobs in their own db file (manage.py migrate --database previews)
+    # 'previews': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': os.path.join(BASE_DIR, 'albumapp_previews.sqlite'),
+    #     'CONN_MAX_AGE': 600,
+    # },
 }
 
+DATABASE_ROUTERS = ['albums.db.AlbumRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -120,3 +146,136 @@ USE_L10N = True
 
 STATIC_ROOT = 'staticfiles'
 STATIC_URL = '/static/'
+
+# collectstatic adds the hash of the content to the filenames and creates gzip and brotli
+# compressed variants of text files, see albums.storage
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'albums.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+
+# Album App
+
+# Pragmas executed for every new sqlite connection, the defaults are defined in
+# albums.db.DEFAULT_SQLITE_PRAGMAS. Only pragmas which differ from the defaults must be set,
+# set a pragma to None to skip it, e.g.:
+# ALBUMS_SQLITE_PRAGMAS = {
+#     'mmap_size': 1024 * 1024 * 1024,
+#     'temp_store': None,
+# }
+
+# Cache for rendered album pdf reports (album/report/). Use albums.pdf_cache.FileSystemBackend
+# (with OPTIONS directory and max_size) to share the cache between processes,
+# set BACKEND to None to disable the cache.
+ALBUMS_PDF_CACHE = {
+    'BACKEND': 'albums.pdf_cache.LocMemBackend',
+    'OPTIONS': {'max_size': 100 * 1024 * 1024},
+}
+
+# Asynchronous report jobs (album/report/job/ and report/run/job/), reports are rendered
+# by the render pool (ALBUMS_RENDER_POOL), at most POOL_SIZE jobs at once. A job is added to the report_job table and
+# can be polled with report/job/<key>/. A job stays pending while all render slots are busy.
+# New jobs are rejected (503) as long as MAX_QUEUE_DEPTH jobs are pending, jobs are considered
+# failed after TIMEOUT seconds and deleted (together with their files) after RETENTION seconds.
+ALBUMS_REPORT_JOBS = {
+    'ENABLED': False,
+    'POOL_SIZE': 2,
+    'MAX_QUEUE_DEPTH': 20,
+    'TIMEOUT': 600,
+    'RETENTION': 3600,
+}
+
+# Directory where generated preview files are stored (named by the hash of their content).
+# If the app is served by nginx, ALBUMS_ARTIFACT_ACCEL_REDIRECT can be set to the url prefix of an
+# internal location pointing to this directory so the files are sent by nginx (X-Accel-Redirect).
+ALBUMS_ARTIFACT_DIR = os.path.join(BASE_DIR, 'artifacts')
+ALBUMS_ARTIFACT_ACCEL_REDIRECT = None
+
+# Eviction of report previews (report_request table and stored files): previews are deleted
+# after TTL seconds and the oldest previews are deleted as soon as the total size exceeds MAX_SIZE bytes.
+# Eviction runs every INTERVAL seconds in a background thread, if BACKGROUND is disabled
+# the evict_report_requests command must be executed regularly instead.
+ALBUMS_PREVIEW_EVICTION = {
+    'MAX_SIZE': 1000 * 1024 * 1024,
+    'TTL': 180,
+    'INTERVAL': 30,
+    'BACKGROUND': True,
+}
+
+# Render the xlsx file of a report preview in a background thread right after the pdf file
+# was generated, so switching to the xlsx preview in ReportBro Designer does not need to wait.
+ALBUMS_PREVIEW_PRERENDER_XLSX = True
+
+# Album reports with at least MIN_ROWS albums are split into chunks of CHUNK_SIZE albums which
+# are rendered in parallel by the worker processes of the render pool, the pdf files
+# of all chunks are merged. Requires pypdf (poetry install --extras partitioned).
+ALBUMS_PARTITIONED_RENDERING = {
+    'ENABLED': False,
+    'MIN_ROWS': 5000,
+    'CHUNK_SIZE': 2000,
+}
+
+# Reports are rendered in POOL_SIZE worker processes (None: number of cpus) so rendering
+# does not block the web server. At most MAX_PENDING reports (None: twice the pool size) are
+# rendered or queued at once, at most MAX_QUEUE further requests wait max. QUEUE_TIMEOUT seconds
+# for a free render slot, all others get 503 with a Retry-After header (RETRY_AFTER seconds).
+# Set SHARED_SLOTS to limit the reports rendered by all web server processes (using the same db).
+ALBUMS_RENDER_POOL = {
+    'POOL_SIZE': None,
+    'MAX_PENDING': None,
+    'MAX_QUEUE': 20,
+    'QUEUE_TIMEOUT': 10,
+    'RETRY_AFTER': 5,
+    'SHARED_SLOTS': None,
+}
+
+# Albums are encoded as json once and the json fragments are cached (max. MAX_SIZE albums per
+# process, 0: disabled), see albums.row_cache. ENCODER: 'orjson' or 'json', None: orjson if it is
+# installed (poetry install --extras orjson).
+ALBUMS_ROW_CACHE = {
+    'MAX_SIZE': 100000,
+    'ENCODER': None,
+}
+
+# Profile single requests on demand: a request with the query parameter profile=1 (or the header
+# X-Albums-Profile: 1) of a staff user is profiled, requests of other users must pass TOKEN as value.
+# The latest MAX_PROFILES profiles are stored in DIR and listed at /albums/profile/.
+ALBUMS_PROFILING = {
+    'ENABLED': False,
+    'TOKEN': None,
+    'DIR': os.path.join(BASE_DIR, 'profiles'),
+    'MAX_PROFILES': 50,
+    'SAMPLE_INTERVAL': 0.005,
+}
+
+# Tombstones of deleted albums (delta sync, album/data/?since=<token>) are deleted after this
+# number of seconds. A client with an older change token gets 410 and must load all albums again.
+ALBUMS_TOMBSTONE_RETENTION = 7 * 24 * 3600
+
+# Clients allowed to read /metrics without login: ip addresses in ALLOWED_IPS (e.g. the
+# Prometheus server) and requests with the header Authorization: Bearer <TOKEN>.
+# Logged in staff users can always read the metrics. Only add an ip address if the app is
+# not served behind a reverse proxy, otherwise REMOTE_ADDR is the address of the proxy for all clients.
+ALBUMS_METRICS = {
+    'ALLOWED_IPS': (),
+    'TOKEN': None,
+}
+
+# Token required to import albums with a POST request to album/import/ (header
+# Authorization: Bearer <token>), the import endpoint is disabled if no token is set.
+# The import_albums management command does not need a token.
+ALBUMS_IMPORT_TOKEN = None
+
+# Import reportbro, load the album report template and start the worker processes of the render pool
+# when the wsgi application is loaded instead of during the first report request, see albums.warmup.
+# Use gunicorn --preload so the template is loaded once before the worker processes are forked.
+ALBUMS_WARM_START = False
+
+# Serve collected static files (including precompressed variants) by django, only needed if
+# the app is not running behind a web server which serves STATIC_ROOT (e.g. nginx).
+ALBUMS_SERVE_STATIC = False
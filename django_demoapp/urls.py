@@ -1,7 +1,15 @@
+from django.conf import settings
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
+
+from albums import metrics_views, static_views
 
 urlpatterns = [
     path('albums/', include('albums.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_views.metrics, name='metrics'),
 ]
+
+if getattr(settings, 'ALBUMS_SERVE_STATIC', False):
+    urlpatterns.append(re_path(
+        r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), static_views.serve, name='static'))
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_demoapp.settings')
 
 application = get_wsgi_application()
+
+# optionally load reportbro and the report template when the application is loaded, with
+# gunicorn --preload this is done once before the worker processes are forked
+from albums import warmup  # noqa: E402
+
+if warmup.is_enabled():
+    warmup.warm_up()